@@ -0,0 +1,127 @@
+"""Scraping the HTML listing vs the JSON/RSS/Atom API.
+
+Times 50 feeds read as five HTML pages, as one API page (cold and
+cached) and as a 304 revalidation, and checks that following the
+``next`` links of the API walks every feed exactly once, that search
+results come in the order of the search page, that unknown listings
+are a 404 even to a revalidation and that the RSS and Atom documents
+parse. Exits with an error if a check fails.
+
+    python -m benchmarks.api_bench --feeds 2000
+"""
+import argparse
+import gzip
+import json
+import re
+import sys
+import time
+
+from benchmarks import django_env
+
+
+def timed(func, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = func()
+    return (time.perf_counter() - started) / repeat, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--feeds", type=int, default=2000)
+    args = parser.parse_args()
+
+    django_env.setup()
+    import feedparser
+    from django.contrib.auth.models import Permission, User
+    from django.core.cache import caches
+    from django.conf import settings
+    from django.test import Client
+    from django.utils import timezone
+    from datetime import timedelta
+    from rssfeeder.cache import bump_ingest_version
+    from rssfeeder.models import Category, Feed
+    from rssfeeder.views import search_feeds
+
+    category = Category.objects.create(name="Default")
+    now = timezone.now()
+    Feed.objects.bulk_create(
+        Feed(title="Story {}".format(n), description="Text of story {} ".format(n) * 10,
+             pub_date=now - timedelta(minutes=n // 3), link="https://example.com/{}".format(n),
+             channel_img="https://example.com/l.png", feed_img="https://example.com/{}.png".format(n),
+             channel_name="bench", guid="g{}".format(n), category=category)
+        for n in range(args.feeds))
+    bump_ingest_version()
+    user = User.objects.create_user("bench")
+    user.user_permissions.add(Permission.objects.get(codename="view_feed"))
+    client = Client(secure=True)
+    client.force_login(user)
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+            print("FAILED:", message)
+
+    def scrape():
+        # five pages of ten cards, following the "next" cursor like a scraper
+        response, path = None, "/"
+        for _ in range(5):
+            response = client.get(path)
+            path = "/" + re.search(r'href="(\?after=[^"]+)"', response.content.decode()).group(1)
+        return response
+
+    def api(**headers):
+        return client.get("/api/feeds.json?limit=50", HTTP_ACCEPT_ENCODING="gzip", **headers)
+
+    client.get("/")
+    html, response = timed(scrape, repeat=5)
+    html_bytes = 5 * len(response.content)
+    caches[settings.FEED_CACHE].clear()
+    cold, _ = timed(api, repeat=1)
+    warm, response = timed(api)
+    check(response["Content-Encoding"] == "gzip", "gzipped body")
+    etag = response["ETag"]
+    revalidate, not_modified = timed(lambda: api(HTTP_IF_NONE_MATCH=etag))
+    check(not_modified.status_code == 304, "304 on a matching ETag")
+
+    print("50 feeds as HTML (5 pages)   {:7.2f}ms {:>8} bytes".format(html * 1e3, html_bytes))
+    print("50 feeds as JSON, cold        {:7.2f}ms".format(cold * 1e3))
+    print("50 feeds as JSON, cached      {:7.2f}ms {:>8} bytes gzipped".format(warm * 1e3, len(response.content)))
+    print("revalidation (304)            {:7.2f}ms".format(revalidate * 1e3))
+
+    seen, path = [], "/api/feeds.json?limit=200"
+    while path:
+        page = json.loads(client.get(path).content)
+        seen += [item["guid"] for item in page["items"]]
+        path = page["next"]
+    check(len(seen) == len(set(seen)) == args.feeds, "next links walk every feed once ({})".format(len(seen)))
+
+    query = "story 7"
+    ranked = list(search_feeds(query).values_list("guid", flat=True))
+    seen, path = [], "/api/search.json?limit=50&q=" + query.replace(" ", "+")
+    while path:
+        page = json.loads(client.get(path).content)
+        seen += [item["guid"] for item in page["items"]]
+        path = page["next"]
+    check(seen == ranked, "search results by rank, every match once ({}/{})".format(len(seen), len(ranked)))
+
+    for path in ("/api/channel/nope.json", "/api/category/nope.json"):
+        response = client.get(path, HTTP_IF_NONE_MATCH="*")
+        check(response.status_code == 404, "404 on an unknown listing, not {}".format(response.status_code))
+
+    for fmt in ("rss", "atom"):
+        response = client.get("/api/feeds.{}".format(fmt), HTTP_ACCEPT_ENCODING="gzip")
+        parsed = feedparser.parse(gzip.decompress(response.content))
+        check(not parsed.bozo and len(parsed.entries) == settings.FEED_API_PAGE_SIZE, "{} parses".format(fmt))
+
+    bump_ingest_version()
+    check(api(HTTP_IF_NONE_MATCH=etag).status_code == 200, "new ETag after an ingest")
+    check(Client(secure=True).get("/api/feeds.json").status_code == 403, "anonymous clients refused")
+
+    if failures:
+        sys.exit("{} checks failed".format(len(failures)))
+
+
+if __name__ == "__main__":
+    main()
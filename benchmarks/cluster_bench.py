@@ -0,0 +1,162 @@
+"""Near-duplicate lookup at ingest time: SimHash bands in the feed table.
+
+Seeds ``--rows`` feeds with random fingerprints spread over 30 days and
+times `rssfeeder.clustering.find_stored` for stored fingerprints with up
+to 3 bits flipped (which must be found) and for random ones (which must
+not), then times fingerprinting an entry. Finally ingests three stub
+feeds, the second and third republishing stories of the first under
+other GUIDs, in two cycles, and checks that every republished story is
+clustered with its original, and nothing else. Exits with an error if a
+check fails or a lookup takes more than ``--budget`` ms on average.
+
+    python -m benchmarks.cluster_bench --rows 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from email.utils import format_datetime
+
+from benchmarks import django_env
+
+VOCABULARY = ["word{}".format(n) for n in range(5000)]
+
+
+def rss(title, items):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+        "<title>{}</title><link>https://example.com/</link><description>Stub</description>{}</channel></rss>"
+    ).format(title, "".join(
+        "<item><title>{}</title><link>{}</link><guid>{}</guid><pubDate>{}</pubDate>"
+        "<description><![CDATA[{}]]></description></item>".format(
+            headline, guid, guid, format_datetime(published), body)
+        for guid, headline, body, published in items)).encode()
+
+
+def timed_lookups(find, fingerprints, since):
+    latencies, results = [], []
+    for fingerprint in fingerprints:
+        started = time.perf_counter()
+        results.append(find(fingerprint, since))
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return results, statistics.mean(latencies) * 1e3, latencies[int(0.99 * (len(latencies) - 1))] * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--budget", type=float, default=1.0, help="mean lookup time allowed, in ms")
+    args = parser.parse_args()
+
+    # the FTS triggers would dominate seeding time and are irrelevant here
+    os.environ["FEED_SEARCH_BACKEND"] = "rssfeeder.search.BasicSearchBackend"
+    # on a file: the ingest stages run on threads with their own connections
+    django_env.setup(os.path.join(tempfile.mkdtemp(), "cluster.sqlite3"))
+    from django.conf import settings
+    from django.db import connection, transaction
+    from django.utils import timezone
+    from benchmarks.stubserver import StubServer
+    from rssfeeder.clustering import find_stored, fingerprint, to_signed
+    from rssfeeder.ingest import Source, ingest
+    from rssfeeder.models import Category, Feed
+    from utils.simhash import bands
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+            print("FAILED:", message)
+
+    random.seed(1)
+    category = Category.objects.create(name="Default")
+    now = timezone.now()
+    fingerprints = [random.getrandbits(64) for _ in range(args.rows)]
+    started = time.perf_counter()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO rssfeeder_feed (title, description, pub_date, link, channel_img, feed_img, channel_name, "
+            "guid, category_id, simhash, band0, band1, band2, band3) "
+            "VALUES ('', '', %s, '', '', '', 'bench', %s, %s, %s, %s, %s, %s, %s)",
+            [(now - timedelta(seconds=n * 30 * 86400 // args.rows), "g{}".format(n), category.pk, to_signed(value))
+             + tuple(bands(value)) for n, value in enumerate(fingerprints)],
+        )
+    print("seeded {} rows in {:.1f}s".format(args.rows, time.perf_counter() - started))
+
+    since = now - timedelta(days=settings.FEED_CLUSTER_WINDOW_DAYS)
+    # stored feeds of the window, with 0 to 3 bits flipped
+    in_window = args.rows * settings.FEED_CLUSTER_WINDOW_DAYS // 30
+    targets = random.sample(range(in_window), args.lookups)
+    near = [fingerprints[n] ^ sum(1 << bit for bit in random.sample(range(64), random.randint(0, 3)))
+            for n in targets]
+    results, mean, p99 = timed_lookups(find_stored, near, since)
+    found = sum(1 for n, pk in zip(targets, results) if pk is not None)
+    print("near-duplicate lookup  mean {:.3f}ms p99 {:.3f}ms, found {}/{}".format(mean, p99, found, len(near)))
+    check(found == len(near), "every near-duplicate found")
+    check(mean <= args.budget, "mean lookup within {}ms".format(args.budget))
+    results, mean, p99 = timed_lookups(find_stored, [random.getrandbits(64) for _ in range(args.lookups)], since)
+    matched = sum(1 for pk in results if pk is not None)
+    print("unrelated lookup       mean {:.3f}ms p99 {:.3f}ms, matched {}".format(mean, p99, matched))
+    check(matched == 0, "no unrelated match")
+    check(mean <= args.budget, "mean lookup within {}ms".format(args.budget))
+
+    def story():
+        return " ".join(random.choice(VOCABULARY) for _ in range(random.randint(60, 300)))
+
+    texts = [story() for _ in range(1000)]
+    started = time.perf_counter()
+    for text in texts:
+        fingerprint("Title of the story", text)
+    print("fingerprint            mean {:.3f}ms per entry".format((time.perf_counter() - started) / len(texts) * 1e3))
+
+    # A publishes 30 stories; B republishes 15 of them with other markup and
+    # 15 of its own in the same cycle; C republishes 10 in the next cycle;
+    # D publishes one story twice, E republishes 5 of A in another category
+    stories = [("Headline {} {}".format(n, random.choice(VOCABULARY)), story()) for n in range(60)]
+    published = timezone.now() - timedelta(hours=1)
+    feeds = {
+        "/a.xml": [("https://a.example.com/{}".format(n), title, "<p>{}</p>".format(body), published)
+                   for n, (title, body) in enumerate(stories[:30])],
+        "/b.xml": [("https://b.example.com/{}".format(n), title, body.replace(" ", "  ") + ".", published)
+                   for n, (title, body) in enumerate(stories[15:45], 15)],
+        "/c.xml": [("https://c.example.com/{}".format(n), title, "<div>{}</div>".format(body), published)
+                   for n, (title, body) in enumerate(stories[:10])],
+        "/d.xml": [("https://d.example.com/{}".format(n), stories[50][0], stories[50][1] + suffix, published)
+                   for n, suffix in enumerate(["", " again"])],
+        "/e.xml": [("https://e.example.com/{}".format(n), title, body, published)
+                   for n, (title, body) in enumerate(stories[:5])],
+    }
+    with StubServer() as stub:
+        for path, items in feeds.items():
+            stub.files[path] = ("application/rss+xml", rss(path, items))
+        sources = {path: Source(name=path[1], feed=stub.file_url(path), title=path[1].upper(), logo="",
+                                category="Elsewhere" if path == "/e.xml" else "Stories")
+                   for path in feeds}
+        ingest([sources["/a.xml"], sources["/b.xml"], sources["/d.xml"]])
+        ingest([sources["/c.xml"], sources["/e.xml"]])
+
+    ingested = Feed.objects.filter(category__name="Stories").exclude(channel_name="D")
+    roots = {}
+    for guid, pk, canonical_id in ingested.values_list("guid", "pk", "canonical_id"):
+        roots.setdefault(guid.rsplit("/", 1)[1], set()).add(canonical_id or pk)
+    listed = ingested.filter(canonical__isnull=True).count()
+    print("ingest: {} feeds, {} listed, 45 stories".format(ingested.count(), listed))
+    check(all(len(pks) == 1 for pks in roots.values()), "republished stories clustered with their original")
+    check(listed == 45, "one listed feed per story ({})".format(listed))
+    check(not Feed.objects.filter(channel_name="D", canonical__isnull=False).exists(),
+          "entries of one channel never clustered together")
+    check(not Feed.objects.filter(category__name="Elsewhere", canonical__isnull=False).exists(),
+          "stories of another category not clustered")
+
+    if failures:
+        sys.exit("{} checks failed".format(len(failures)))
+
+
+if __name__ == "__main__":
+    main()
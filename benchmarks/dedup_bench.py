@@ -0,0 +1,53 @@
+"""Compares per-entry EXISTS checks with the bulk GUID lookup.
+
+    python -m benchmarks.dedup_bench --entries 10000 --stored 5000
+"""
+import argparse
+import time
+
+from benchmarks import django_env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=10_000, help="entries seen in one cycle")
+    parser.add_argument("--stored", type=int, default=5_000, help="entries already in the database")
+    args = parser.parse_args()
+
+    django_env.setup()
+    from django.db import connection
+    from django.utils import timezone
+    from rssfeeder.ingest import existing_guids
+    from rssfeeder.models import Category, Feed
+
+    category = Category.objects.create(name="Bench")
+    now = timezone.now()
+    Feed.objects.bulk_create([
+        Feed(title="t", description="d", pub_date=now, link="https://example.com", channel_img="",
+             feed_img="", channel_name="bench", guid="guid-{}".format(n), category=category)
+        for n in range(args.stored)
+    ], batch_size=1000)
+    guids = ["guid-{}".format(n) for n in range(args.entries)]
+
+    def per_entry():
+        return {guid for guid in guids if Feed.objects.filter(guid=guid).exists()}
+
+    def bulk():
+        return existing_guids(guids)
+
+    for name, run in (("per-entry", per_entry), ("bulk", bulk)):
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            found = run()
+            elapsed = time.perf_counter() - started
+        print("{:<10} {:>6} queries {:>6} seen {:>8.3f}s".format(name, len(queries), len(found), elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""Boots Django against a throwaway SQLite database for the benchmarks."""
+import os
+
+
+def setup(db_name=":memory:"):
+    """Configures Django; `db_name=None` keeps the database of the settings (DB_* variables)."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "feeder.settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("ALLOWED_HOSTS", "*")
+
+    import django
+    from django.conf import settings
+
+    if db_name is not None:
+        settings.DATABASES["default"]["NAME"] = db_name
+    django.setup()
+
+    from django.core.management import call_command
+    call_command("migrate", run_syncdb=True, verbosity=0)
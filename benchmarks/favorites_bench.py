@@ -0,0 +1,66 @@
+"""Query counts of the favorites page, a listing page and the favorite toggle.
+
+Exits with an error when a page's query count grows with the number of
+favorites it shows, i.e. when an N+1 pattern comes back.
+
+    python -m benchmarks.favorites_bench
+"""
+import sys
+
+from benchmarks import django_env
+
+
+def count_queries(func):
+    from django.db import connection
+
+    queries = []
+
+    def count(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        func()
+    return len(queries)
+
+
+def main():
+    django_env.setup()
+    from django.contrib.auth.models import Permission, User
+    from django.test import Client
+    from django.utils import timezone
+    from rssfeeder.models import Category, Feed, UserFavorites
+
+    category = Category.objects.create(name="Default")
+    now = timezone.now()
+    feeds = Feed.objects.bulk_create(
+        Feed(title="t{}".format(n), description="", pub_date=now, link="https://example.com/{}".format(n),
+             channel_img="https://example.com/l.png", feed_img="https://example.com/i.png",
+             channel_name="bench", guid="g{}".format(n), category=category)
+        for n in range(10))
+    user = User.objects.create_user("bench")
+    user.user_permissions.add(Permission.objects.get(codename="view_feed"))
+    client = Client(secure=True)
+    client.force_login(user)
+
+    failed = False
+    for path in ("/favorites", "/"):
+        counts = []
+        for favorites in (1, 10):
+            UserFavorites.objects.all().delete()
+            UserFavorites.objects.bulk_create(UserFavorites(user=user, favorites=feed) for feed in feeds[:favorites])
+            # warm the per-process caches (category map, ingest version) first
+            client.get(path)
+            counts.append(count_queries(lambda: client.get(path)))
+        failed |= counts[0] != counts[1]
+        print("{:<12} queries with 1 favorite: {:>3}, with 10: {:>3}".format(path, *counts))
+
+    toggle = count_queries(lambda: client.post("/favops", {"pk": feeds[0].pk, "addfavorite": ""},
+                                               HTTP_REFERER="/"))
+    print("{:<12} queries to add a favorite: {}".format("/favops", toggle))
+    if failed:
+        sys.exit("query count depends on the number of favorites")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compares sequential feedparser downloads with the concurrent fetcher.
+
+    python -m benchmarks.fetch_bench --feeds 200 --latency 0.25
+
+Then checks that a slow consumer holds back the downloads: no more than
+``--concurrency`` results may wait for the callback at any time.
+"""
+import argparse
+import time
+
+import feedparser
+
+from benchmarks.stubserver import StubServer
+from utils.fetcher import fetch_all, fetch_each
+
+
+def sequential(urls):
+    return [feedparser.parse(url) for url in urls.values()]
+
+
+def concurrent(urls, concurrency, per_host):
+    responses = fetch_all(urls, concurrency=concurrency, per_host=per_host)
+    return [feedparser.parse(r.body, response_headers=r.headers) for r in responses.values()]
+
+
+def backlog(server, urls, concurrency, per_host, delay=0.05):
+    """Returns the most requests served but not yet consumed, with a consumer taking `delay` per result."""
+    consumed = 0
+    worst = 0
+
+    def consume(result):
+        nonlocal consumed, worst
+        with server.lock:
+            worst = max(worst, sum(server.hits.values()) - consumed)
+        time.sleep(delay)
+        consumed += 1
+
+    fetch_each(urls, consume, concurrency=concurrency, per_host=per_host)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--feeds", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.25)
+    parser.add_argument("--concurrency", type=int, default=50)
+    # every stub feed lives on one host, so the per-host cap is the effective limit
+    parser.add_argument("--per-host", type=int, default=50)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency) as server:
+        urls = {str(n): server.url(n) for n in range(args.feeds)}
+        runs = [("concurrent", lambda: concurrent(urls, args.concurrency, args.per_host))]
+        if not args.skip_sequential:
+            runs.insert(0, ("sequential", lambda: sequential(urls)))
+        for name, run in runs:
+            started = time.perf_counter()
+            parsed = run()
+            elapsed = time.perf_counter() - started
+            entries = sum(len(p.entries) for p in parsed)
+            print("{:<12} {:>5} feeds {:>7} entries {:>8.2f}s".format(name, len(parsed), entries, elapsed))
+
+        server.hits.clear()
+        worst = backlog(server, urls, args.concurrency, args.per_host)
+        print("slow consumer: up to {} results waiting (limit {})".format(worst, args.concurrency))
+        assert worst <= args.concurrency, "the fetcher did not wait for the consumer"
+
+
+if __name__ == "__main__":
+    main()
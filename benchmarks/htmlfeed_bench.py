@@ -0,0 +1,83 @@
+"""Throughput of HTML description extraction: single thread, threads, processes.
+
+The corpus is taken from the entries of the feeds in feed.ini (``--live``),
+from a directory of saved ``.html`` files (``--corpus``), or is generated.
+
+    python -m benchmarks.htmlfeed_bench --live --repeat 50
+"""
+import argparse
+import configparser
+import multiprocessing as mp
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils.htmlfeed import extract, extract_many
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+PARAGRAPH = ("<p>The <a href=\"https://example.com/{n}\">{n} release</a> brings <em>many</em> "
+             "fixes &amp; improvements to the <code>kernel</code> scheduler.</p>")
+
+
+def live_corpus():
+    import feedparser
+
+    config = configparser.ConfigParser()
+    config.read(BASE_DIR.joinpath('feed.ini'))
+    corpus = []
+    for section in config.sections():
+        for entry in feedparser.parse(config[section]['feed']).entries:
+            corpus.extend(c.value for c in entry.get('content', []))
+            corpus.append(entry.get('description', ''))
+    return [html for html in corpus if html]
+
+
+def synthetic_corpus(size=500):
+    rnd = random.Random(0)
+    corpus = []
+    for n in range(size):
+        body = "".join(PARAGRAPH.format(n=n) for _ in range(rnd.randint(2, 60)))
+        corpus.append('<div><img src="https://example.com/{}.png"/>{}</div>'.format(n, body))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--live", action="store_true", help="download the feeds in feed.ini")
+    parser.add_argument("--corpus", type=Path, help="directory of .html files")
+    parser.add_argument("--repeat", type=int, default=20, help="times the corpus is repeated")
+    parser.add_argument("--chunksize", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.live:
+        corpus = live_corpus()
+    elif args.corpus:
+        corpus = [p.read_text(errors="replace") for p in sorted(args.corpus.glob("*.html"))]
+    else:
+        corpus = synthetic_corpus()
+    docs = corpus * args.repeat
+    size = sum(len(d) for d in docs) / 1e6
+    print("{} documents, {:.1f} MB".format(len(docs), size))
+
+    def thread_pool():
+        with ThreadPoolExecutor() as executor:
+            return list(executor.map(extract, docs))
+
+    runs = (
+        ("single", lambda: [extract(d) for d in docs]),
+        ("threads", thread_pool),
+        ("processes", lambda: extract_many(docs, chunksize=args.chunksize)),
+    )
+    for name, run in runs:
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        print("{:<10} {:>8.2f}s {:>9.0f} docs/s {:>7.2f} MB/s".format(
+            name, elapsed, len(docs) / elapsed, size / elapsed))
+
+
+if __name__ == "__main__":
+    mp.set_start_method("fork")
+    main()
@@ -0,0 +1,192 @@
+"""Load test of full ingest cycles (``startjobs.save_rss``) against a local feed server.
+
+The feeds are generated, ``--sources`` feeds of ``--entries`` entries
+with about ``--description-bytes`` of HTML each, or replayed from a
+directory written by `benchmarks.record_feeds` (``--replay``). The feed
+server runs in its own process (see `benchmarks.stubserver`), answering
+after ``--latency`` seconds with a share ``--error-rate`` of 500s. The
+ingest writes to a fresh SQLite database with the shipped settings.
+
+Reported per cycle: throughput, per-source download and processing
+(parse and HTML extraction) time at p50/p99, database write time; and
+the peak RSS of the process and of the extraction workers. The second
+and later cycles mostly get 304 responses. ``--output FILE`` appends the
+results as a JSON line; ``--compare FILE`` prints the runs of that file
+side by side.
+
+    python -m benchmarks.ingest_bench --sources 5000 --entries 100 --output ingest.jsonl --label baseline
+    python -m benchmarks.ingest_bench --compare ingest.jsonl
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks import django_env
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))] if values else 0.0
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def start_stub(args):
+    command = [sys.executable, "-m", "benchmarks.stubserver", "--latency", str(args.latency),
+               "--entries", str(args.entries), "--description-bytes", str(args.description_bytes),
+               "--error-rate", str(args.error_rate)]
+    if args.replay:
+        command += ["--replay", args.replay]
+    stub = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    return stub, json.loads(stub.stdout.readline())
+
+
+def write_config(path, urls):
+    with open(path, "w") as ini:
+        for name, url in urls.items():
+            ini.write("[{0}]\ntitle = {0}\nfeed = {1}\nlink = {1}\nlogo = /static/imgs/news.png\n\n".format(name, url))
+
+
+def run_cycle(save_rss):
+    from rssfeeder.models import FetchState, IngestRun
+
+    started = time.perf_counter()
+    save_rss()
+    elapsed = time.perf_counter() - started
+    run = IngestRun.objects.latest("started_on")
+    states = list(FetchState.objects.values_list("fetch_seconds", "parse_seconds", "extract_seconds"))
+    fetch = [fetch_seconds for fetch_seconds, _, _ in states]
+    process = [parse_seconds + extract_seconds for _, parse_seconds, extract_seconds in states]
+    return {
+        "seconds": round(elapsed, 3),
+        "sources": run.sources,
+        "errors": run.errors,
+        "unchanged": run.unchanged,
+        "entries": run.entries,
+        "new_entries": run.new_entries,
+        "bytes": run.bytes,
+        "sources_per_second": round(run.sources / elapsed, 1),
+        "entries_per_second": round(run.new_entries / elapsed, 1),
+        "fetch_p50": round(percentile(fetch, 0.5), 4),
+        "fetch_p99": round(percentile(fetch, 0.99), 4),
+        "process_p50": round(percentile(process, 0.5), 4),
+        "process_p99": round(percentile(process, 0.99), 4),
+        "parse_seconds": round(run.parse_seconds, 3),
+        "extract_seconds": round(run.extract_seconds, 3),
+        "write_seconds": round(run.write_seconds, 3),
+    }
+
+
+def print_cycle(n, cycle):
+    print("cycle {}: {sources} sources ({errors} errors, {unchanged} unchanged), {new_entries} new entries, "
+          "{bytes} bytes in {seconds:.2f}s".format(n, **cycle))
+    print("  {sources_per_second} sources/s, {entries_per_second} entries/s".format(**cycle))
+    print("  per source: fetch p50 {:.1f}ms p99 {:.1f}ms, parse+extract p50 {:.1f}ms p99 {:.1f}ms".format(
+        cycle["fetch_p50"] * 1e3, cycle["fetch_p99"] * 1e3, cycle["process_p50"] * 1e3,
+        cycle["process_p99"] * 1e3))
+    print("  parse {parse_seconds:.2f}s, extract {extract_seconds:.2f}s, write {write_seconds:.2f}s".format(**cycle))
+
+
+def compare(path):
+    runs = [json.loads(line) for line in open(path) if line.strip()]
+    columns = "{:<20} {:<8} {:>6} {:>7} {:>9} {:>8} {:>10} {:>10} {:>9} {:>8}"
+    print(columns.format("label", "commit", "srcs", "entries", "seconds", "vs 1st", "entries/s", "fetch p99",
+                         "write s", "RSS MB"))
+    for run in runs:
+        cycle = run["cycles"][0]
+        print(columns.format(
+            run["label"][:20], run["commit"], cycle["sources"], cycle["new_entries"],
+            "{:.2f}".format(cycle["seconds"]),
+            "{:+.0%}".format(cycle["seconds"] / runs[0]["cycles"][0]["seconds"] - 1),
+            cycle["entries_per_second"], "{:.0f}ms".format(cycle["fetch_p99"] * 1e3),
+            "{:.2f}".format(cycle["write_seconds"]), "{:.0f}".format(run["peak_rss_mb"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sources", type=int, default=500)
+    parser.add_argument("--entries", type=int, default=50, help="entries per generated feed")
+    parser.add_argument("--description-bytes", type=int, default=2000, help="HTML per generated entry")
+    parser.add_argument("--replay", metavar="DIR", help="ingest the feeds recorded in DIR instead")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds before every response")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of 500 responses")
+    parser.add_argument("--cycles", type=int, default=2)
+    # every feed is on the one local host: let the per-host cap stand in for many hosts
+    parser.add_argument("--per-host", type=int, default=50)
+    parser.add_argument("--label", default="", help="name of the run in the output file")
+    parser.add_argument("--output", metavar="FILE", help="append the results to FILE as a JSON line")
+    parser.add_argument("--compare", metavar="FILE", help="print the runs of FILE and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    tmp = tempfile.mkdtemp(prefix="feeder-ingest-")
+    os.environ.update({
+        "DB_NAME": os.path.join(tmp, "db.sqlite3"),
+        "FEED_CONFIG": os.path.join(tmp, "feed.ini"),
+        "FEED_FETCH_PER_HOST": str(args.per_host),
+    })
+    stub, server = start_stub(args)
+    try:
+        if args.replay:
+            urls = server["replay"]
+        else:
+            urls = {"s{}".format(n): "{}/feed/{}.xml".format(server["url"], n) for n in range(args.sources)}
+        write_config(os.environ["FEED_CONFIG"], urls)
+
+        django_env.setup(db_name=None)
+        from rssfeeder.ingest import close_extract_pool
+        from rssfeeder.management.commands.startjobs import save_rss
+
+        cycles = []
+        for n in range(args.cycles):
+            cycles.append(run_cycle(save_rss))
+            print_cycle(n + 1, cycles[-1])
+        # the extraction workers only count once they exited, and before
+        # the feed server, also a child process, exits
+        close_extract_pool()
+        workers_rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    result = {
+        "label": args.label,
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("label", "output", "compare")},
+        "cycles": cycles,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        # the largest of the extraction worker processes
+        "workers_peak_rss_mb": round(workers_rss, 1),
+    }
+    print("peak RSS {peak_rss_mb:.0f} MB, extraction workers {workers_peak_rss_mb:.0f} MB".format(**result))
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
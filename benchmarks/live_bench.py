@@ -0,0 +1,257 @@
+"""Many idle live-update streams on one ASGI process (see rssfeeder.live).
+
+Starts uvicorn on a fresh SQLite database and opens ``--clients`` event
+streams on the home page listing, then ingests a feed of the local stub
+server ``--rounds`` times. Checks that every stream gets one ``items``
+event per round with the number of new feeds and their cards, and
+reports the delay from the ingest commit to the events at p50/p99/max
+(bounded by ``FEED_LIVE_POLL_INTERVAL``) and the memory the server holds
+per stream. Also checks that a page opened before the rounds gets all
+their feeds at once, that a reconnecting stream resumes from its
+``Last-Event-ID``, the ``stale`` event of a page too far behind, the
+limit on connections under a burst and the refusal of anonymous readers
+and unknown listings. Exits with an error
+if a check fails.
+
+    python -m benchmarks.live_bench --clients 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import django_env
+from benchmarks.ingest_bench import percentile
+from benchmarks.sqlite_load_bench import free_port
+
+BURST = 50
+BURST_SLOTS = 5
+
+
+def rss_kb(pid):
+    with open("/proc/{}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def login():
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.models import Permission, User
+    from django.contrib.sessions.backends.db import SessionStore
+
+    user = User.objects.create_user("bench")
+    user.user_permissions.add(Permission.objects.get(codename="view_feed"))
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+def bump_versions(count):
+    from rssfeeder.cache import bump_ingest_version
+
+    for _ in range(count):
+        bump_ingest_version()
+    return bump_ingest_version()
+
+
+def ingest_round(n, url):
+    """Ingests one stub feed; returns the number of new listed feeds and the time of the commit."""
+    from rssfeeder.ingest import Source, ingest
+    from rssfeeder.models import Feed, IngestStamp
+
+    last_id = Feed.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+    ingest([Source(name="s{}".format(n), feed=url, title="Feed {}".format(n), logo="")])
+    committed = IngestStamp.objects.get(pk=1).updated_on.timestamp()
+    return Feed.objects.filter(pk__gt=last_id, canonical__isnull=True).count(), committed
+
+
+async def read_events(response):
+    """Yields the (name, data) of the events of an SSE response, once the stream opened as (None, None)."""
+    name, data = None, []
+    async for line in response.content:
+        line = line.decode().rstrip("\n")
+        if line.startswith("retry:"):
+            yield None, None
+        elif line.startswith("event:"):
+            name = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+        elif not line and name:
+            yield name, json.loads("".join(data))
+            name, data = None, []
+
+
+async def stream(http, url, headers, opened, received):
+    async with http.get(url, headers=headers) as response:
+        if response.status != 200:
+            opened.set_exception(RuntimeError("HTTP {}".format(response.status)))
+            return
+        async for name, data in read_events(response):
+            if name is None:
+                opened.set_result(True)
+            else:
+                received.append((time.time(), name, data))
+
+
+async def late_events(http, url, headers, wait):
+    """Opens a stream and returns the names and data of its events within `wait` seconds."""
+    opened, received = asyncio.get_event_loop().create_future(), []
+    task = asyncio.ensure_future(stream(http, url, headers, opened, received))
+    await opened
+    await asyncio.sleep(wait)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return [(name, data) for _, name, data in received]
+
+
+async def status_of(http, url, headers):
+    async with http.get(url, headers=headers) as response:
+        return response.status
+
+
+async def run(args, port, server, session, version, check):
+    """Runs the streams; the Django ORM is only used from other threads here."""
+    import aiohttp
+    from django.conf import settings
+    from django.utils.http import urlencode
+    from benchmarks.stubserver import StubServer
+    from rssfeeder.cache import read_ingest_version
+
+    base = "http://127.0.0.1:{}/events".format(port)
+    headers = {"Cookie": "sessionid={}".format(session)}
+    loop = asyncio.get_event_loop()
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        check(await status_of(http, base + "?category=", {}) == 403, "anonymous readers refused")
+        check(await status_of(http, base + "?category=nope", headers) == 404, "unknown listing refused")
+
+        idle_rss = rss_kb(server.pid)
+        url = "{}?{}".format(base, urlencode({"category": "", "version": version}))
+        inboxes, tasks, openings = [], [], []
+        started = time.perf_counter()
+        for n in range(args.clients):
+            opened, received = loop.create_future(), []
+            inboxes.append(received)
+            openings.append(opened)
+            tasks.append(asyncio.ensure_future(stream(http, url, headers, opened, received)))
+        results = await asyncio.gather(*openings, return_exceptions=True)
+        failed = [result for result in results if isinstance(result, Exception)]
+        print("{} streams open in {:.1f}s, {} failed{}".format(
+            len(results) - len(failed), time.perf_counter() - started, len(failed),
+            " ({})".format(failed[0]) if failed else ""))
+        check(not failed, "every stream opens")
+        # the server allows BURST_SLOTS more streams
+        burst = [loop.create_future() for _ in range(BURST)]
+        burst_tasks = [asyncio.ensure_future(stream(http, url, headers, opened, [])) for opened in burst]
+        results = await asyncio.gather(*burst, return_exceptions=True)
+        accepted = sum(1 for result in results if result is True)
+        print("burst of {} connections over the limit: {} accepted".format(BURST, accepted))
+        check(accepted <= BURST_SLOTS, "connections within FEED_LIVE_MAX_CONNECTIONS")
+        for task in burst_tasks:
+            task.cancel()
+        await asyncio.gather(*burst_tasks, return_exceptions=True)
+        await asyncio.sleep(1)
+        print("server RSS {:.0f} MB idle, {:.0f} MB with the streams: {:.1f} KB per stream".format(
+            idle_rss / 1024, rss_kb(server.pid) / 1024, (rss_kb(server.pid) - idle_rss) / args.clients))
+
+        total = 0
+        with StubServer(entries=args.entries) as stub:
+            for n in range(args.rounds):
+                listed, committed = await loop.run_in_executor(None, ingest_round, n, stub.url(n))
+                total += listed
+                # the servers poll every FEED_LIVE_POLL_INTERVAL seconds
+                await asyncio.sleep(args.wait)
+                delays, wrong = [], 0
+                for received in inboxes:
+                    events = [(at, data) for at, name, data in received if name == "items"]
+                    received.clear()
+                    if len(events) != 1 or events[0][1]["count"] != listed or not events[0][1]["cards"]:
+                        wrong += 1
+                    else:
+                        delays.append(events[0][0] - committed)
+                print("round {}: {} new feeds, {} streams notified, {} wrong, delay p50 {:.0f}ms "
+                      "p99 {:.0f}ms max {:.0f}ms".format(n + 1, listed, len(delays), wrong,
+                                                         percentile(delays, 0.5) * 1e3,
+                                                         percentile(delays, 0.99) * 1e3,
+                                                         max(delays or [0]) * 1e3))
+                check(not wrong, "round {}: every stream gets one event with the new feeds".format(n + 1))
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        received = await late_events(http, url, headers, 0.5)
+        check([(name, data["count"]) for name, data in received] == [("items", total)],
+              "page opened before the rounds gets their {} feeds at once".format(total))
+        current = await loop.run_in_executor(None, read_ingest_version)
+        resumed = dict(headers, **{"Last-Event-ID": str(current)})
+        check(await late_events(http, url, resumed, 0.5) == [], "reconnecting stream resumes from Last-Event-ID")
+        # no feeds in these versions, but too many for the page to catch up
+        await loop.run_in_executor(None, bump_versions, settings.FEED_LIVE_CATCH_UP)
+        await asyncio.sleep(settings.FEED_LIVE_POLL_INTERVAL + 1)
+        received = await late_events(http, url, headers, 0.5)
+        check([name for name, _ in received] == ["stale"], "page too far behind told to reload")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=2000, help="concurrent event streams")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--entries", type=int, default=20, help="entries of each ingested feed")
+    parser.add_argument("--wait", type=float, default=4, help="seconds allowed for the events to arrive")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="feeder-live-")
+    os.environ["DB_NAME"] = os.path.join(tmp, "db.sqlite3")
+    django_env.setup(db_name=None)
+    from django.db import connection
+    from rssfeeder.cache import bump_ingest_version, ingest_version
+    from rssfeeder.models import Category
+
+    Category.objects.create(name="Default")
+    session = login()
+    bump_ingest_version()
+    version = ingest_version()
+    connection.close()
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+            print("FAILED:", message)
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "feeder.asgi:application", "--port", str(port),
+         "--log-level", "warning", "--no-access-log", "--lifespan", "off"],
+        env=dict(os.environ, FEED_LIVE_MAX_CONNECTIONS=str(args.clients + BURST_SLOTS)))
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        asyncio.get_event_loop().run_until_complete(run(args, port, server, session, version, check))
+    finally:
+        server.terminate()
+        server.wait()
+
+    if failures:
+        sys.exit("{} checks failed".format(len(failures)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Latency of page 1 vs a deep page: OFFSET pagination vs keyset cursors.
+
+    python -m benchmarks.pagination_bench --rows 1000000 --page 5000
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+
+from benchmarks import django_env
+
+
+def timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page", type=int, default=5000)
+    args = parser.parse_args()
+
+    # the FTS triggers would dominate seeding time and are irrelevant here
+    os.environ["FEED_SEARCH_BACKEND"] = "rssfeeder.search.BasicSearchBackend"
+    django_env.setup()
+    from django.core.paginator import Paginator
+    from django.db import connection
+    from django.utils import timezone
+    from rssfeeder.models import Category, Feed
+    from rssfeeder.pagination import cursor_page, encode_cursor
+
+    category = Category.objects.create(name="Bench")
+    start = timezone.now()
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO rssfeeder_feed (title, description, pub_date, link, channel_img, feed_img, "
+            "channel_name, guid, category_id) VALUES (%s, '', %s, '', '', '', 'bench', %s, %s)",
+            [("t{}".format(n), start - timedelta(seconds=n // 3), "g{}".format(n), category.pk)
+             for n in range(args.rows)],
+        )
+    print("seeded {} rows in {:.1f}s".format(args.rows, time.perf_counter() - started))
+
+    posts = Feed.objects.filter(category=category)
+    # the cursor a reader would hold after clicking "Next" page - 1 times
+    anchor = posts.order_by('-pub_date', '-id')[(args.page - 1) * 10 - 1]
+    cursor = encode_cursor(anchor)
+
+    def offset(number):
+        return lambda: list(Paginator(posts.order_by('-pub_date', '-id'), 10).page(number).object_list)
+
+    rows = (
+        ("offset", "1", offset(1)),
+        ("offset", str(args.page), offset(args.page)),
+        ("cursor", "1", lambda: list(cursor_page(posts))),
+        ("cursor", str(args.page), lambda: list(cursor_page(posts, after=cursor))),
+    )
+    for mode, page, func in rows:
+        print("{:<7} page {:>6} {:>9.2f}ms".format(mode, page, timed(func)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Single-transaction delete() vs the batched retention purge.
+
+While each purge runs, a second thread commits a small write every 10ms
+as the ingest writer would; its worst wait is how long the purge locked
+ingest out.
+
+    python -m benchmarks.purge_bench --rows 200000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from benchmarks import django_env
+
+
+def seed(rows, favorites):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.utils import timezone
+    from rssfeeder.models import Category, Feed, UserFavorites
+
+    UserFavorites.objects.all().delete()
+    Feed.objects.all().delete()
+    category = Category.objects.get_or_create(name="Default")[0]
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        # spread over the last 60 days, so that half of them are expired
+        cursor.executemany(
+            "INSERT INTO rssfeeder_feed (title, description, pub_date, link, channel_img, feed_img, "
+            "channel_name, guid, category_id) VALUES (%s, %s, %s, '', '', '', 'bench', %s, %s)",
+            [("t{}".format(n), "description " * 20, now - timedelta(days=60) * (n + 1) / rows,
+              "g{}".format(n), category.pk) for n in range(rows)],
+        )
+    user = User.objects.get_or_create(username="bench")[0]
+    UserFavorites.objects.bulk_create(
+        UserFavorites(user=user, favorites_id=pk)
+        for pk in Feed.objects.order_by("pk").values_list("pk", flat=True)[:rows:max(rows // favorites, 1)]
+    )
+    return Feed.objects.filter(pub_date__lte=now - timedelta(days=30)).count()
+
+
+def old_purge():
+    from django.db.models import Exists, OuterRef
+    from django.utils import timezone
+    from rssfeeder.models import Feed, UserFavorites
+
+    # the favorited rows have to be left out, or PROTECT aborts the purge
+    favorited = UserFavorites.objects.filter(favorites=OuterRef("pk"))
+    return Feed.objects.filter(pub_date__lte=timezone.now() - timedelta(days=30)).filter(
+        ~Exists(favorited)).delete()[0]
+
+
+def new_purge(batch_size):
+    from rssfeeder.retention import purge_old_feeds
+
+    return purge_old_feeds(30, batch_size=batch_size)
+
+
+def with_writer(purge):
+    """Runs `purge` while a writer thread commits every 10ms; returns (deleted, seconds, worst wait)."""
+    from django.db import OperationalError, connection, transaction
+    from rssfeeder.cache import bump_ingest_version
+
+    stop = threading.Event()
+    waits = [0.0]
+
+    def write():
+        while not stop.is_set():
+            started = time.perf_counter()
+            with transaction.atomic():
+                bump_ingest_version()
+            waits.append(time.perf_counter() - started)
+            time.sleep(0.01)
+        connection.close()
+
+    bump_ingest_version()
+    thread = threading.Thread(target=write)
+    thread.start()
+    started = time.perf_counter()
+    try:
+        deleted = purge()
+    except OperationalError as exc:
+        deleted = "failed ({})".format(exc)
+    finally:
+        stop.set()
+        thread.join()
+    return deleted, time.perf_counter() - started, max(waits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--favorites", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ["FEED_SEARCH_BACKEND"] = "rssfeeder.search.BasicSearchBackend"
+    # a file, so that the writer thread gets its own connection to the same database
+    django_env.setup(os.path.join(tempfile.mkdtemp(), "purge.sqlite3"))
+
+    for name, purge in (("delete()", old_purge), ("batched", lambda: new_purge(args.batch_size))):
+        expired = seed(args.rows, args.favorites)
+        deleted, elapsed, wait = with_writer(purge)
+        print("{:<9} deleted {:>7} of {:>7} expired in {:6.2f}s, writer waited up to {:6.3f}s".format(
+            name, deleted, expired, elapsed, wait))
+
+
+if __name__ == "__main__":
+    main()
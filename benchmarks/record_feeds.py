@@ -0,0 +1,52 @@
+"""Records feed responses to a directory, to be replayed by the benchmarks.
+
+Downloads the sources of feed.ini (or of OPML / INI catalogs, see
+``manage.py importsources``) once and saves every successful response
+body with an ``index.json``. ``python -m benchmarks.ingest_bench --replay
+DIR`` then ingests them from a local server, without the internet.
+
+    python -m benchmarks.record_feeds recordings/ --catalog subscriptions.opml
+"""
+import argparse
+import json
+from pathlib import Path
+
+from benchmarks import django_env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--catalog", action="append", help="OPML or INI file (default: FEED_CONFIG)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    django_env.setup()
+    from django.conf import settings
+    from rssfeeder.sources import read_catalog
+    from utils.fetcher import fetch_all
+
+    sources = [source for path in args.catalog or [settings.FEED_CONFIG] for source in read_catalog(path)]
+    # catalogs read from OPML have no names
+    urls = {source.name or "feed{}".format(n): source.feed for n, source in enumerate(sources)}
+    responses = fetch_all(urls, concurrency=args.concurrency, timeout=settings.FEED_SOURCE_PROBE_TIMEOUT)
+
+    directory = Path(args.directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    index = {}
+    for n, (name, response) in enumerate(sorted(responses.items())):
+        if not response.ok:
+            print("{}: {}".format(name, response.error or response.status))
+            continue
+        recording = {"url": response.url, "file": "{}.xml".format(n), "bytes": len(response.body),
+                     "content_type": response.headers.get("content-type", "application/xml"),
+                     "elapsed": round(response.elapsed, 3)}
+        directory.joinpath(recording["file"]).write_bytes(response.body)
+        index[name] = recording
+    directory.joinpath("index.json").write_text(json.dumps(index, indent=1))
+    print("Recorded {} of {} feeds, {} bytes, in {}".format(
+        len(index), len(urls), sum(recording["bytes"] for recording in index.values()), directory))
+
+
+if __name__ == "__main__":
+    main()
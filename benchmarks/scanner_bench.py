@@ -0,0 +1,76 @@
+"""Per-entry extraction cost: legacy two-pass parsers vs the fused FeedScanner.
+
+    python -m benchmarks.scanner_bench --repeat 20
+"""
+import argparse
+import time
+from html.parser import HTMLParser
+from io import StringIO
+
+from benchmarks.htmlfeed_bench import synthetic_corpus
+from utils.htmlfeed import FeedScanner, extract
+
+
+class MLStripper(HTMLParser):
+    # the stripper used by save_new_feeds before the fused scanner
+    def __init__(self):
+        super().__init__()
+        self.reset()
+        self.strict = False
+        self.convert_charrefs = True
+        self.text = StringIO()
+
+    def handle_data(self, d):
+        self.text.write(d)
+
+
+def legacy_get_links(html):
+    class URLSeeker(HTMLParser):
+        def __init__(self):
+            HTMLParser.__init__(self)
+            self.urls = []
+
+        def handle_starttag(self, tag, attrs):
+            if tag == 'img':
+                src = dict(attrs).get('src')
+                if src:
+                    self.urls.append(src)
+
+    url_seeker = URLSeeker()
+    url_seeker.feed(html)
+    return url_seeker.urls
+
+
+def legacy(html):
+    imgs = legacy_get_links(html)
+    s = MLStripper()
+    s.feed(html)
+    return s.text.getvalue(), imgs[0] if imgs else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--budget", type=int, default=300, help="text budget for the early-stop run")
+    args = parser.parse_args()
+
+    docs = synthetic_corpus() * args.repeat
+    summary = FeedScanner(max_length=args.budget, max_images=1, summary_length=200)
+    runs = (
+        ("two-pass", legacy),
+        ("fused", extract),
+        ("fused+budget", summary.scan),
+    )
+    base = None
+    for name, run in runs:
+        started = time.perf_counter()
+        for doc in docs:
+            run(doc)
+        elapsed = time.perf_counter() - started
+        base = base or elapsed
+        print("{:<13} {:>7.2f}s {:>8.1f} us/entry {:>6.1f}x".format(
+            name, elapsed, elapsed / len(docs) * 1e6, base / elapsed))
+
+
+if __name__ == "__main__":
+    main()
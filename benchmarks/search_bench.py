@@ -0,0 +1,59 @@
+"""Search latency of the substring scan vs the FTS5 index on a generated corpus.
+
+    python -m benchmarks.search_bench --rows 200000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import django_env
+
+WORDS = ("kernel release security patch python django linux network storage browser privacy "
+         "science climate energy policy election market rocket vaccine compiler database").split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    django_env.setup()
+    from django.core.paginator import Paginator
+    from django.utils import timezone
+    from rssfeeder.models import Category, Feed
+    from rssfeeder.search import BasicSearchBackend, SQLiteFTSBackend
+
+    rnd = random.Random(0)
+    category = Category.objects.create(name="Bench")
+    now = timezone.now()
+
+    def text(n):
+        return " ".join(rnd.choice(WORDS) + str(rnd.randint(0, 500)) for _ in range(n))
+
+    started = time.perf_counter()
+    for start in range(0, args.rows, 10_000):
+        Feed.objects.bulk_create([
+            Feed(title=text(8), description=text(80), pub_date=now, link="https://example.com",
+                 channel_img="", feed_img="", channel_name="bench", guid="guid-{}".format(n), category=category)
+            for n in range(start, min(start + 10_000, args.rows))
+        ])
+    print("seeded {} rows in {:.1f}s".format(args.rows, time.perf_counter() - started))
+
+    queries = [rnd.choice(WORDS) + str(rnd.randint(0, 500)) for _ in range(args.queries)]
+    for name, backend in (("icontains", BasicSearchBackend()), ("fts5", SQLiteFTSBackend())):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            page = Paginator(backend.search(Feed.objects.all(), query), 10).page(1)
+            list(page.object_list)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        print("{:<10} p50 {:>7.1f}ms  p95 {:>7.1f}ms  mean {:>7.1f}ms".format(
+            name, timings[len(timings) // 2] * 1e3, timings[int(len(timings) * 0.95)] * 1e3,
+            statistics.mean(timings) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
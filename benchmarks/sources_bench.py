@@ -0,0 +1,107 @@
+"""Importing a large OPML catalog with ``manage.py importsources``.
+
+Writes an OPML file of ``--sources`` feeds in category folders: most
+served by the local stub server, some HTML pages that are not feeds and
+some on a closed port. Runs the import, checks what the probes recorded,
+that the scheduler's `current_sources` sees the new sources and drops a
+disabled one at once, and that importing again updates the rows in place.
+Exits with an error if a check fails.
+
+All stub feeds share one host, so the per-host cap is raised to the
+concurrency to mimic a catalog spread over many hosts.
+
+    python -m benchmarks.sources_bench --sources 5000 --latency 0.2
+"""
+import argparse
+import io
+import os
+import socket
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import quoteattr
+
+from benchmarks import django_env
+from benchmarks.stubserver import StubServer
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sources", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the stub server answers")
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    django_env.setup()
+    from django.core.management import call_command
+    from rssfeeder.models import FeedSource
+    from rssfeeder.sources import current_sources
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+            print("FAILED:", message)
+
+    pages = args.sources // 20
+    dead = args.sources // 20
+    feeds = args.sources - pages - dead
+    port = closed_port()
+    with StubServer(latency=args.latency) as stub:
+        urls = [stub.url(n) for n in range(feeds)]
+        for n in range(pages):
+            stub.files["/page/{}.html".format(n)] = ("text/html", b"<html><body><p>Not a feed</p></body></html>")
+            urls.append(stub.file_url("/page/{}.html".format(n)))
+        urls += ["http://127.0.0.1:{}/feed/{}.xml".format(port, n) for n in range(dead)]
+
+        path = os.path.join(tempfile.mkdtemp(), "catalog.opml")
+        with open(path, "w") as opml:
+            opml.write('<?xml version="1.0"?><opml version="2.0"><head><title>Bench</title></head><body>')
+            for folder in range(10):
+                opml.write('<outline text="Folder {}">'.format(folder))
+                for n, url in enumerate(urls[folder::10]):
+                    opml.write('<outline type="rss" text={} xmlUrl={}/>'.format(
+                        quoteattr("Source {} {}".format(folder, n)), quoteattr(url)))
+                opml.write("</outline>")
+            opml.write("</body></opml>")
+
+        out = io.StringIO()
+        started = time.perf_counter()
+        call_command("importsources", path, concurrency=args.concurrency, per_host=args.concurrency, stdout=out)
+        elapsed = time.perf_counter() - started
+        print(out.getvalue().rstrip())
+        print("import of {} sources: {:.1f}s".format(args.sources, elapsed))
+
+        check(FeedSource.objects.count() == args.sources, "every source imported")
+        check(FeedSource.objects.filter(feed_type="rss20").count() == feeds, "feeds recognised")
+        check(FeedSource.objects.filter(reachable=True, feed_type="").count() == pages, "pages are not feeds")
+        check(FeedSource.objects.filter(reachable=False).count() == dead, "closed port unreachable")
+        check(FeedSource.objects.filter(category="Folder 3").count() == args.sources // 10, "folders as categories")
+        check(len(set(FeedSource.objects.values_list("name", flat=True))) == args.sources, "unique names")
+
+        started = time.perf_counter()
+        sources = current_sources(os.devnull)
+        print("current_sources: {:.1f}ms".format((time.perf_counter() - started) * 1e3))
+        check(len(sources) == args.sources, "scheduler sees the imported sources")
+        disabled = FeedSource.objects.order_by("pk").first()
+        FeedSource.objects.filter(pk=disabled.pk).update(enabled=False)
+        check(disabled.name not in current_sources(os.devnull), "disabled source dropped without restart")
+
+        out = io.StringIO()
+        call_command("importsources", path, no_probe=True, stdout=out)
+        print(out.getvalue().rstrip())
+        check(FeedSource.objects.count() == args.sources, "re-import updates in place")
+
+    if failures:
+        sys.exit("{} checks failed".format(len(failures)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Concurrent gunicorn readers while an ingest cycle writes to the same SQLite file.
+
+Runs the same load twice, in a fresh database each time:
+
+* ``stock``: Django's SQLite backend without pragmas or persistent
+  connections, i.e. the settings before the tuning profile;
+* ``tuned``: the settings as shipped (rssfeeder.backends.sqlite3, WAL,
+  CONN_MAX_AGE).
+
+Client threads request listing pages, API pages, searches and the
+favorites page from gunicorn, and add or remove a favorite in one
+request out of seven, while the bench process ingests feeds from the
+local stub server. Reported: latencies and errors before and during the
+ingest, "database is locked" errors logged by gunicorn, and the ingest
+time.
+
+    python -m benchmarks.sqlite_load_bench --workers 3 --clients 12
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROFILES = {
+    "stock": (
+        "DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'\n"
+        "DATABASES['default']['CONN_MAX_AGE'] = 0\n"
+    ),
+    "tuned": "",
+}
+PATHS = ["/", "/?after={cursor}", "/api/feeds.json", "/api/search.json?q=story", "/favorites", "/channels", None]
+# any 32 characters form a valid CSRF secret, sent as cookie and header
+CSRF_TOKEN = "b" * 32
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed(feeds):
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.models import Permission, User
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.utils import timezone
+    from datetime import timedelta
+    from rssfeeder.models import Category, Feed, UserFavorites
+    from rssfeeder.pagination import encode_cursor
+
+    category = Category.objects.create(name="Default")
+    now = timezone.now()
+    Feed.objects.bulk_create(
+        (Feed(title="Old story {}".format(n), description="Text of an old story " * 10,
+              pub_date=now - timedelta(minutes=n), link="https://example.com/old/{}".format(n),
+              channel_img="", feed_img="", channel_name="seed", guid="old{}".format(n), category=category)
+         for n in range(feeds)), batch_size=1000)
+    user = User.objects.create_user("bench")
+    user.user_permissions.add(Permission.objects.get(codename="view_feed"))
+    UserFavorites.objects.bulk_create(UserFavorites(user=user, favorites=feed) for feed in Feed.objects.all()[:20])
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    middle = Feed.objects.order_by("-pub_date", "-id")[feeds // 2]
+    return session.session_key, encode_cursor(middle)
+
+
+def client(port, session, cursor, feeds, stop, results):
+    headers = {"Cookie": "sessionid={}; csrftoken={}".format(session, CSRF_TOKEN), "Authorization": "Bearer bench"}
+    while not stop.is_set():
+        path = random.choice(PATHS)
+        started = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            if path is None:
+                body = "pk={}&{}=".format(random.randint(1, feeds), random.choice(["addfavorite", "removefavorite"]))
+                conn.request("POST", "/favops", body=body, headers=dict(
+                    headers, **{"X-CSRFToken": CSRF_TOKEN, "Referer": "/",
+                                "Content-Type": "application/x-www-form-urlencoded"}))
+            else:
+                conn.request("GET", path.format(cursor=cursor), headers=headers)
+            status = conn.getresponse().status
+            conn.close()
+        except OSError:
+            status = 0
+        results.append((time.perf_counter() - started, status))
+
+
+def run_profile(name, args):
+    tmp = tempfile.mkdtemp()
+    with open(os.path.join(tmp, "bench_settings.py"), "w") as f:
+        f.write("from feeder.settings import *  # noqa\n" + PROFILES[name])
+    os.environ.update({
+        "DJANGO_SETTINGS_MODULE": "bench_settings",
+        "DB_NAME": os.path.join(tmp, "db.sqlite3"),
+        "FEED_API_TOKEN": "bench",
+        "PYTHONPATH": os.pathsep.join([tmp, os.getcwd(), os.environ.get("PYTHONPATH", "")]),
+    })
+    sys.path.insert(0, tmp)
+
+    from benchmarks import django_env
+    django_env.setup(db_name=None)
+    from django.db import connection
+    from benchmarks.stubserver import StubServer
+    from rssfeeder.ingest import Source, ingest
+
+    session, cursor = seed(args.seed)
+    connection.close()
+
+    port = free_port()
+    log = open(os.path.join(tmp, "gunicorn.log"), "w+")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "feeder.wsgi:application", "--workers", str(args.workers),
+         "--bind", "127.0.0.1:{}".format(port), "--timeout", "120"],
+        stdout=log, stderr=subprocess.STDOUT)
+    try:
+        for _ in range(100):
+            try:
+                http.client.HTTPConnection("127.0.0.1", port, timeout=1).request("GET", "/api/feeds.json")
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        stop, results = threading.Event(), []
+        clients = [threading.Thread(target=client, args=(port, session, cursor, args.seed, stop, results))
+                   for _ in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        # let every gunicorn worker load the application first
+        time.sleep(2)
+        idle_start = len(results)
+        time.sleep(args.idle)
+        busy_start = len(results)
+        with StubServer(entries=args.entries) as stub:
+            started = time.perf_counter()
+            written = ingest([Source(name="s{}".format(n), feed=stub.url(n), title="Feed {}".format(n), logo="")
+                              for n in range(args.sources)])
+            elapsed = time.perf_counter() - started
+        busy_end = len(results)
+        stop.set()
+        for thread in clients:
+            thread.join()
+        idle, busy = results[idle_start:busy_start], results[busy_start:busy_end]
+    finally:
+        server.terminate()
+        server.wait()
+    log.seek(0)
+    locked = log.read().count("database is locked")
+
+    def summary(results):
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(1 for _, status in results if status not in (200, 302))
+        return "{:>5} requests, {:>4} errors, p50 {:7.1f}ms p95 {:7.1f}ms p99 {:7.1f}ms max {:7.1f}ms".format(
+            len(results), errors, statistics.median(latencies) * 1e3,
+            latencies[int(0.95 * (len(latencies) - 1))] * 1e3, latencies[int(0.99 * (len(latencies) - 1))] * 1e3,
+            latencies[-1] * 1e3)
+
+    print("{}: idle   {}".format(name, summary(idle)))
+    print("{}: ingest {}".format(name, summary(busy)))
+    print("{}: ingest wrote {} feeds in {:.2f}s, 'database is locked' logged {} times".format(
+        name, written, elapsed, locked))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--profile", choices=sorted(PROFILES))
+    parser.add_argument("--workers", type=int, default=3, help="gunicorn workers")
+    parser.add_argument("--clients", type=int, default=12, help="concurrent client threads")
+    parser.add_argument("--seed", type=int, default=20000, help="feeds stored before the run")
+    parser.add_argument("--sources", type=int, default=200)
+    parser.add_argument("--entries", type=int, default=50, help="entries per source")
+    parser.add_argument("--idle", type=float, default=5, help="seconds of requests before the ingest starts")
+    args = parser.parse_args()
+
+    if args.profile:
+        run_profile(args.profile, args)
+        return
+    # Django can only be set up once per process: one process per profile
+    for name in PROFILES:
+        subprocess.run([sys.executable, "-m", "benchmarks.sqlite_load_bench", "--profile", name] + sys.argv[1:],
+                       check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Local HTTP server serving synthetic RSS feeds for the benchmarks.
+
+Every path of the form ``/feed/<n>.xml`` returns a small RSS 2.0 document;
+each response is delayed by ``latency`` seconds to mimic a remote host,
+and a share ``error_rate`` of the responses are 500 errors. Responses
+carry an ETag and honour ``If-None-Match`` with a 304. Other paths can be
+served with fixed content through `StubServer.files`, e.g. the feeds
+recorded by `benchmarks.record_feeds` (see `load_recordings`).
+
+Load tests run the server in its own process, so it does not compete with
+the code under test for the GIL::
+
+    python -m benchmarks.stubserver --latency 0.2 --entries 100
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ITEM = """<item>
+<title>Story {feed}-{n}</title>
+<link>https://example.com/{feed}/{n}</link>
+<guid>https://example.com/{feed}/{n}</guid>
+<pubDate>Mon, 03 Oct 2022 10:{minute:02d}:00 +0000</pubDate>
+<description><![CDATA[<p>Body of story {n} from feed {feed}.</p>
+<img src="https://example.com/img/{feed}-{n}.png"/><p>More text follows here.</p>{filler}]]></description>
+</item>"""
+
+
+def _paragraphs(count=1000, vocabulary=5000, seed=0):
+    rnd = random.Random(seed)
+    words = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(2, 9)))
+             for _ in range(vocabulary)]
+    return ["<p>{}.</p>".format(" ".join(rnd.choice(words) for _ in range(40))) for _ in range(count)]
+
+
+PARAGRAPHS = _paragraphs()
+
+
+def filler(key, size):
+    """Returns about `size` bytes of paragraphs of random words, the same for the same `key`.
+
+    Paragraphs are drawn from a fixed pool, so that two entries rarely
+    share more than one and are not near-duplicates of each other.
+    """
+    start, parts, length = zlib.crc32(key.encode()), [], 0
+    while length < size:
+        parts.append(PARAGRAPHS[(start + 7919 * len(parts)) % len(PARAGRAPHS)])
+        length += len(parts[-1])
+    return "".join(parts)
+
+
+def render_feed(feed, entries=20, description_bytes=0):
+    items = "".join(ITEM.format(feed=feed, n=n, minute=n % 60,
+                                filler=filler("{}-{}".format(feed, n), description_bytes) if description_bytes else "")
+                    for n in range(entries))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+        "<title>Feed {0}</title><link>https://example.com/{0}</link>"
+        "<description>Synthetic feed</description>{1}</channel></rss>"
+    ).format(feed, items).encode()
+
+
+class _Server(ThreadingHTTPServer):
+    # the default backlog of 5 drops connections under concurrent load
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # clients may hang up early on purpose, e.g. over a size limit
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """Runs a threaded stub feed server in the background.
+
+    Usage:
+        with StubServer(latency=0.2) as server:
+            url = server.url(3)
+    """
+
+    def __init__(self, latency=0.0, entries=20, error_rate=0.0, description_bytes=0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.entries = entries
+        self.error_rate = error_rate
+        self.description_bytes = description_bytes
+        # path -> (content type, body), served instead of a feed
+        self.files = {}
+        # requests served per feed, or per path of `files`
+        self.hits = Counter()
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(stub.latency)
+                if stub.error_rate and random.random() < stub.error_rate:
+                    self.send_response(500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.path in stub.files:
+                    with stub.lock:
+                        stub.hits[self.path] += 1
+                    content_type, body = stub.files[self.path]
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                feed = self.path.rsplit("/", 1)[-1].split(".")[0]
+                with stub.lock:
+                    stub.hits[feed] += 1
+                body = render_feed(feed, stub.entries, stub.description_bytes)
+                etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _Server((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, n):
+        host, port = self.httpd.server_address
+        return "http://{}:{}/feed/{}.xml".format(host, port, n)
+
+    def file_url(self, path):
+        host, port = self.httpd.server_address
+        return "http://{}:{}{}".format(host, port, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def load_recordings(self, directory):
+        """Serves the feeds recorded by `benchmarks.record_feeds` in `directory`.
+
+        Returns:
+            dict of recorded source name to its URL on this server
+        """
+        directory = Path(directory)
+        urls = {}
+        for name, recording in json.loads(directory.joinpath("index.json").read_text()).items():
+            path = "/replay/{}".format(recording["file"])
+            self.files[path] = (recording["content_type"], directory.joinpath(recording["file"]).read_bytes())
+            urls[name] = self.file_url(path)
+        return urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--entries", type=int, default=20, help="entries per synthetic feed")
+    parser.add_argument("--description-bytes", type=int, default=0, help="filler text added to every entry")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    parser.add_argument("--replay", metavar="DIR", help="also serve the feeds recorded in DIR")
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency, entries=args.entries, error_rate=args.error_rate,
+                        description_bytes=args.description_bytes, port=args.port)
+    recordings = server.load_recordings(args.replay) if args.replay else {}
+    host, port = server.httpd.server_address
+    # the first line tells the parent process where to connect
+    print(json.dumps({"url": "http://{}:{}".format(host, port), "replay": recordings}), flush=True)
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Thumbnailing of feed images served by the local stub server.
+
+Checks that every image URL is downloaded once, that identical images
+share a file, that oversized and undecodable images are given up, that
+the thumbnail view serves files with long cache headers, that eviction
+keeps the most recently requested files, that the thumbnails of images
+no feed uses are deleted and that images on local addresses are
+refused. Exits with an error if any check fails.
+
+    python -m benchmarks.thumbnail_bench --images 200
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks import django_env
+from benchmarks.stubserver import StubServer
+
+
+def photo(n, size=(1600, 1200)):
+    from PIL import Image
+
+    gradient = Image.radial_gradient("L").resize(size)
+    image = Image.merge("RGB", (gradient, Image.new("L", size, n % 256), gradient.rotate(90 + n)))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def encode(image, fmt):
+    out = io.BytesIO()
+    image.save(out, fmt)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["FEED_THUMBNAIL_DIR"] = tempfile.mkdtemp()
+    django_env.setup()
+    from django.conf import settings
+    from django.test import Client
+    from django.utils import timezone
+    from PIL import Image
+    from rssfeeder import thumbnails
+    from rssfeeder.models import Thumbnail
+
+    settings.FEED_THUMBNAIL_MAX_BYTES = 1024 * 1024
+    # the stub server is local
+    settings.FEED_THUMBNAIL_PRIVATE_HOSTS = True
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+            print("FAILED:", message)
+
+    with StubServer() as server:
+        for n in range(args.images):
+            server.files["/img/{}.jpg".format(n)] = ("image/jpeg", photo(n))
+        server.files["/img/same.jpg"] = server.files["/img/0.jpg"]
+        server.files["/img/logo.png"] = ("image/png", encode(Image.new("RGBA", (600, 200), (0, 90, 200, 128)), "PNG"))
+        server.files["/img/huge.bmp"] = ("image/bmp", encode(Image.new("RGB", (1000, 1000)), "BMP"))
+        server.files["/img/bomb.png"] = ("image/png", encode(Image.new("1", (10000, 5000)), "PNG"))
+        urls = {path: server.file_url(path) for path in server.files}
+        urls["feed"] = server.url(1)
+        downloaded = sum(len(body) for _, body in server.files.values())
+
+        # every URL shows up in many feeds, and in several ingest flushes
+        thumbnails.queue_thumbnails(list(urls.values()) * 3)
+        thumbnails.queue_thumbnails(urls.values())
+        check(Thumbnail.objects.count() == len(urls), "one row per URL")
+
+        started = time.perf_counter()
+        made = thumbnails.make_thumbnails(limit=len(urls))
+        elapsed = time.perf_counter() - started
+        thumbnails.make_thumbnails(limit=len(urls))
+        check(max(server.hits.values()) == 1, "every image downloaded once")
+
+        rows = {row.url: row for row in Thumbnail.objects.all()}
+        ready = [row for row in rows.values() if row.status == Thumbnail.READY]
+        stored = sum({row.file: row.size for row in ready}.values())
+        print("{} images ({:.1f} MB) -> {} thumbnails ({:.1f} MB) in {:.2f}s".format(
+            len(urls), downloaded / 1e6, made, stored / 1e6, elapsed))
+        check(made == args.images + 2, "thumbnails made for the photos, the duplicate and the logo")
+        check(rows[urls["/img/same.jpg"]].file == rows[urls["/img/0.jpg"]].file, "identical images share a file")
+        for path in ("/img/huge.bmp", "/img/bomb.png", "feed"):
+            row = rows[urls[path]]
+            check(row.status == Thumbnail.FAILED, "{} given up ({})".format(path, row.error))
+        for row in ready:
+            with Image.open(thumbnails.file_path(row.file)) as image:
+                check(image.width <= settings.FEED_THUMBNAIL_SIZE[0] and
+                      image.height <= settings.FEED_THUMBNAIL_SIZE[1], "{} fits".format(row.url))
+        with Image.open(thumbnails.file_path(rows[urls["/img/logo.png"]].file)) as image:
+            check(image.mode == "RGBA", "transparency kept")
+
+    client = Client(secure=True)
+    response = client.get("/thumbnails/" + rows[urls["/img/1.jpg"]].key)
+    check(response.status_code == 200 and "immutable" in response["Cache-Control"], "thumbnail served")
+    response.close()
+    response = client.get("/thumbnails/" + rows[urls["feed"]].key)
+    check(response.status_code == 302 and response["Location"] == urls["feed"], "failed image redirected")
+
+    # the first half of the photos was last requested a day ago
+    old = [rows[urls["/img/{}.jpg".format(n)]].pk for n in range(1, args.images // 2)]
+    Thumbnail.objects.filter(pk__in=old).update(used_on=timezone.now() - timedelta(days=1))
+    freed = thumbnails.evict(stored // 2)
+    left = Thumbnail.objects.filter(status=Thumbnail.READY)
+    check(sum({row.file: row.size for row in left}.values()) <= stored // 2, "cache trimmed to its limit")
+    check(not Thumbnail.objects.filter(pk__in=old, status=Thumbnail.READY).exists(),
+          "least recently used files evicted first")
+    check(all(thumbnails.file_path(row.file).exists() for row in left), "kept files still on disk")
+    print("evicted {:.1f} MB, {} thumbnails left".format(freed / 1e6, left.count()))
+
+    evicted = Thumbnail.objects.get(pk=old[0])
+    response = client.get("/thumbnails/" + evicted.key)
+    evicted.refresh_from_db()
+    check(response.status_code == 302 and evicted.status == Thumbnail.PENDING, "evicted image queued again")
+
+    # no feed uses the images of the bench: as after a purge of their feeds
+    unused = [urls["/img/same.jpg"], urls["/img/{}.jpg".format(args.images - 1)]]
+    files = set(Thumbnail.objects.filter(url__in=unused).exclude(file="").values_list("file", flat=True))
+    check(thumbnails.delete_unused(unused) == 2 and not Thumbnail.objects.filter(url__in=unused).exists(),
+          "unused thumbnails deleted")
+    left = Thumbnail.objects.exclude(file="")
+    check(all(thumbnails.file_path(row.file).exists() for row in left), "shared files kept")
+    check(not any(thumbnails.file_path(name).exists() for name in files - {row.file for row in left}),
+          "unused files deleted")
+
+    settings.FEED_THUMBNAIL_PRIVATE_HOSTS = False
+    private = ["http://127.0.0.1:9/a.jpg", "http://169.254.169.254/latest/meta-data", "http://[::1]/a.jpg",
+               "http://localhost/a.jpg", "http://10.0.0.1/a.jpg"]
+    thumbnails.queue_thumbnails(private)
+    thumbnails.make_thumbnails(limit=len(private) + args.images)
+    refused = Thumbnail.objects.filter(url__in=private)
+    check(all(row.status != Thumbnail.READY and "public address" in row.error for row in refused),
+          "images on local addresses refused")
+
+    if failures:
+        sys.exit("{} checks failed".format(len(failures)))
+
+
+if __name__ == "__main__":
+    main()
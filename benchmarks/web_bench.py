@@ -0,0 +1,306 @@
+"""Load test of the read-only web views on a database seeded at scale.
+
+Fills a SQLite file with ``manage.py seedfeeds`` (by default a million
+feeds, 10,000 users and their favorites), then requests each view
+``--requests`` times from ``--concurrency`` client threads, every thread
+logged in as another seeded user:
+
+* ``home``, ``home-deep``, ``category``: IndexView, on its first page
+  (cached until the next ingest) and on cursors deep in the listing;
+* ``channel``: ChannelView of the busiest channels, ``channels``: ChannelList;
+* ``search``: SearchResults for one or two words;
+* ``favorites``: UserFavoritesView.
+
+``--mode client`` runs the views in this process through the Django test
+client and counts queries with an execute wrapper; ``--mode gunicorn``
+requests them over HTTP from ``--workers`` gunicorn workers, with the
+profiling middleware on to report the queries in its Server-Timing
+header (which adds a little to every request). ``both`` runs one then
+the other. Reported per view: requests per second, latency p50/p95/p99,
+errors and queries per request.
+
+Seeding a million feeds takes about a minute; ``--db FILE`` keeps the
+database so that later runs skip it. ``--output FILE`` appends the
+results as a JSON line, ``--compare FILE`` prints the runs of that file.
+
+    python -m benchmarks.web_bench --db /tmp/web.sqlite3 --concurrency 8 --mode both
+    python -m benchmarks.web_bench --db /tmp/web.sqlite3 --output web.jsonl --label baseline
+    python -m benchmarks.web_bench --compare web.jsonl
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from benchmarks import django_env
+from benchmarks.ingest_bench import git_commit, percentile
+from benchmarks.sqlite_load_bench import free_port
+
+VIEWS = ["home", "home-deep", "category", "channel", "channels", "search", "favorites"]
+QUERIES_HEADER = re.compile(r'desc="(\d+) queries"')
+
+
+class Targets:
+    """The paths requested for each view, picked at random among realistic ones."""
+
+    def __init__(self):
+        from django.db.models import Count
+        from rssfeeder.categories import get_categories
+        from rssfeeder.management.commands.seedfeeds import WORDS
+        from rssfeeder.models import Category, Channel, Feed
+        from rssfeeder.pagination import encode_cursor
+
+        listing = Feed.objects.filter(category__name="Default", canonical__isnull=True).order_by("-pub_date", "-id")
+        total = listing.count()
+        # about a hundred cursors spread over the whole listing
+        self.cursors = [encode_cursor(listing[n]) for n in range(0, total, max(total // 100, 1))[1:]]
+        categories = set(Category.objects.annotate(n=Count("feeds")).filter(n__gt=0).values_list("pk", flat=True))
+        self.categories = [slug for slug, (pk, name) in get_categories().items() if slug and pk in categories]
+        self.channels = list(Channel.objects.order_by("-item_count").values_list("name", flat=True)[:50])
+        self.channel_pages = max(Channel.objects.count() // 10, 1)
+        # neither the most frequent words, which match most feeds, nor the rarest
+        self.words = WORDS[20:120]
+
+    def path(self, view, rng):
+        from django.utils.http import urlencode
+        from urllib.parse import quote
+
+        if view == "home":
+            return "/"
+        if view == "home-deep":
+            return "/?" + urlencode({"after": rng.choice(self.cursors)})
+        if view == "category":
+            return "/" + rng.choice(self.categories)
+        if view == "channel":
+            return "/channel/" + quote(rng.choice(self.channels))
+        if view == "channels":
+            return "/channels?page={}".format(rng.randint(1, self.channel_pages))
+        if view == "search":
+            return "/search/?" + urlencode({"q": " ".join(rng.sample(self.words, rng.randint(1, 2)))})
+        return "/favorites"
+
+
+def seed(args):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from rssfeeder.management.commands.seedfeeds import USER_PREFIX
+
+    if User.objects.filter(username__startswith=USER_PREFIX).exists():
+        print("Using the seeded database {}".format(os.environ["DB_NAME"]))
+        return
+    out = io.StringIO()
+    call_command("seedfeeds", feeds=args.feeds, users=args.users, channels=args.channels, stdout=out)
+    print(out.getvalue().rstrip())
+
+
+def sessions(count):
+    """Logs in `count` seeded users with favorites, returns their session keys."""
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.models import User
+    from django.contrib.sessions.backends.db import SessionStore
+    from rssfeeder.management.commands.seedfeeds import USER_PREFIX
+
+    users = User.objects.filter(username__startswith=USER_PREFIX, userfavorites__isnull=False).distinct()
+    keys = []
+    for user in users.order_by("?")[:count]:
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        keys.append(session.session_key)
+    return keys
+
+
+def in_process(session):
+    """Returns a function requesting a path with the test client: (status, queries)."""
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+
+    client = Client(secure=True)
+    client.cookies[settings.SESSION_COOKIE_NAME] = session
+
+    def request(path):
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            status = client.get(path).status_code
+        return status, len(queries)
+
+    return request
+
+
+def over_http(port):
+    def client(session):
+        """Returns a function requesting a path from gunicorn: (status, queries)."""
+        headers = {"Cookie": "sessionid={}".format(session), "X-Forwarded-Proto": "https"}
+
+        def request(path):
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+            except OSError:
+                return 0, None
+            match = QUERIES_HEADER.search(response.getheader("Server-Timing") or "")
+            return response.status, int(match.group(1)) if match else None
+
+        return request
+
+    return client
+
+
+def run_view(view, clients, targets, requests):
+    """Requests `view` from every client in parallel, `requests` times in all, and returns the statistics."""
+    results = []
+
+    def worker(n, request):
+        rng = random.Random(n)
+        # the first request warms the per-process caches, as in a running site
+        request(targets.path(view, rng))
+        mine = []
+        for _ in range(requests // len(clients)):
+            started = time.perf_counter()
+            status, queries = request(targets.path(view, rng))
+            mine.append((time.perf_counter() - started, status, queries))
+        results.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(n, request)) for n, request in enumerate(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, _, _ in results]
+    queries = [queries for _, _, queries in results if queries is not None]
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, status, _ in results if status != 200),
+        "rps": round(len(results) / elapsed, 1),
+        "p50": round(percentile(latencies, 0.5), 4),
+        "p95": round(percentile(latencies, 0.95), 4),
+        "p99": round(percentile(latencies, 0.99), 4),
+        "queries": round(sum(queries) / len(queries), 1) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+
+
+def run_mode(mode, args, targets, keys):
+    from django.db import connections
+
+    server = None
+    if mode == "client":
+        factory = in_process
+    else:
+        # the server processes must not inherit open SQLite connections
+        connections.close_all()
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "feeder.wsgi:application", "--workers", str(args.workers),
+             "--bind", "127.0.0.1:{}".format(port), "--timeout", "120"],
+            env=dict(os.environ, FEED_PROFILE_SAMPLE_RATE="1"), stderr=subprocess.DEVNULL)
+        for _ in range(100):
+            try:
+                http.client.HTTPConnection("127.0.0.1", port, timeout=1).request("GET", "/login/")
+                break
+            except OSError:
+                time.sleep(0.1)
+        factory = over_http(port)
+    try:
+        clients = [factory(keys[n % len(keys)]) for n in range(args.concurrency)]
+        views = {}
+        for view in args.views:
+            views[view] = run_view(view, clients, targets, args.requests)
+            print_view(mode, view, views[view])
+        return views
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def print_view(mode, view, result):
+    queries = "-" if result["queries"] is None else "{queries:g} (max {max_queries})".format(**result)
+    print("{:<8} {:<10} {:>8.1f} req/s  p50 {:7.1f}ms  p95 {:7.1f}ms  p99 {:7.1f}ms  {:>3} errors  queries {}".format(
+        mode, view, result["rps"], result["p50"] * 1e3, result["p95"] * 1e3, result["p99"] * 1e3,
+        result["errors"], queries))
+
+
+def compare(path):
+    runs = [json.loads(line) for line in open(path) if line.strip()]
+    columns = "{:<20} {:<8} {:<8} {:<10} {:>9} {:>8} {:>9} {:>9} {:>8}"
+    print(columns.format("label", "commit", "mode", "view", "req/s", "vs 1st", "p50 ms", "p99 ms", "queries"))
+    for run in runs:
+        for mode, views in run["modes"].items():
+            for view, result in views.items():
+                first = runs[0]["modes"].get(mode, {}).get(view)
+                print(columns.format(
+                    run["label"][:20], run["commit"], mode, view, result["rps"],
+                    "{:+.0%}".format(result["rps"] / first["rps"] - 1) if first else "",
+                    "{:.1f}".format(result["p50"] * 1e3), "{:.1f}".format(result["p99"] * 1e3),
+                    "-" if result["queries"] is None else result["queries"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", metavar="FILE", help="SQLite file to seed, or reuse if already seeded")
+    parser.add_argument("--feeds", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--channels", type=int, default=500)
+    parser.add_argument("--mode", choices=["client", "gunicorn", "both"], default="client")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--requests", type=int, default=400, help="requests per view")
+    parser.add_argument("--views", nargs="+", choices=VIEWS, default=VIEWS)
+    parser.add_argument("--label", default="", help="name of the run in the output file")
+    parser.add_argument("--output", metavar="FILE", help="append the results to FILE as a JSON line")
+    parser.add_argument("--compare", metavar="FILE", help="print the runs of FILE and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    os.environ["DB_NAME"] = os.path.abspath(args.db or os.path.join(tempfile.mkdtemp(), "web.sqlite3"))
+    django_env.setup(db_name=None)
+    seed(args)
+    targets = Targets()
+    keys = sessions(args.concurrency)
+
+    modes = {}
+    for mode in (["client", "gunicorn"] if args.mode == "both" else [args.mode]):
+        modes[mode] = run_mode(mode, args, targets, keys)
+
+    if args.output:
+        from rssfeeder.models import Feed
+        result = {
+            "label": args.label,
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("label", "output", "compare")},
+            "rows": Feed.objects.count(),
+            "modes": modes,
+        }
+        with open(args.output, "a") as output:
+            output.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
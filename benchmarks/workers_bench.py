@@ -0,0 +1,79 @@
+"""Runs several `startjobs --worker --once` processes against one database.
+
+Checks that the workers share the sources without fetching any of them
+twice, that sections leased by a crashed worker are taken over once the
+lease expired, and reports the wall time.
+
+    python -m benchmarks.workers_bench --workers 4 --feeds 400
+
+Uses a throwaway SQLite database unless DB_ENGINE/DB_NAME/... point at
+another (empty) database, e.g. PostgreSQL in a container.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from benchmarks import django_env
+from benchmarks.stubserver import StubServer
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--feeds", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--batch", type=int, default=25, help="FEED_LEASE_BATCH_SIZE of the workers")
+    parser.add_argument("--crashed", type=int, default=20, help="sections left leased by a crashed worker")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="feeder-workers-")
+    if not os.environ.get("DB_ENGINE"):
+        os.environ["DB_NAME"] = os.path.join(tmp, "db.sqlite3")
+    os.environ["FEED_CONFIG"] = os.path.join(tmp, "feed.ini")
+    os.environ["FEED_LEASE_BATCH_SIZE"] = str(args.batch)
+    django_env.setup(db_name=None)
+
+    from django.utils import timezone
+    from rssfeeder.models import Feed, FetchState
+
+    Feed.objects.all().delete()
+    FetchState.objects.all().delete()
+    expired = timezone.now() - timedelta(seconds=1)
+    FetchState.objects.bulk_create(
+        [FetchState(section="s{}".format(n), leased_by="crashed:0", lease_expires=expired)
+         for n in range(args.crashed)])
+
+    with StubServer(latency=args.latency) as server:
+        with open(os.environ["FEED_CONFIG"], "w") as ini:
+            for n in range(args.feeds):
+                ini.write("[s{0}]\ntitle = S{0}\nfeed = {1}\nlink = https://example.com/{0}\n"
+                          "logo = /static/imgs/news.png\n\n".format(n, server.url(n)))
+
+        started = time.perf_counter()
+        workers = [
+            subprocess.Popen([sys.executable, "manage.py", "startjobs", "--worker", "--once"], cwd=ROOT,
+                             stdout=subprocess.DEVNULL, stderr=open(os.path.join(tmp, "worker{}.log".format(i)), "w"))
+            for i in range(args.workers)
+        ]
+        codes = [worker.wait() for worker in workers]
+        elapsed = time.perf_counter() - started
+
+    hits = [server.hits[str(n)] for n in range(args.feeds)]
+    print("workers={} feeds={} exit codes={}".format(args.workers, args.feeds, codes))
+    print("elapsed: {:.2f}s".format(elapsed))
+    print("fetched: {}, twice or more: {}, never: {}".format(
+        sum(hits), sum(1 for h in hits if h > 1), sum(1 for h in hits if h == 0)))
+    print("feeds stored: {} (expected {})".format(Feed.objects.count(), args.feeds * server.entries))
+    print("leases left: {}".format(FetchState.objects.exclude(leased_by="").count()))
+    print("logs: {}".format(tmp))
+
+
+if __name__ == "__main__":
+    main()
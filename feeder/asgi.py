@@ -2,6 +2,8 @@
 ASGI config for feeder project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests to FEED_LIVE_PATH are streamed by rssfeeder.live, all others go
+to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'feeder.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# after get_asgi_application(), which loads the apps
+from django.conf import settings  # noqa: E402
+from rssfeeder.live import events  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == settings.FEED_LIVE_PATH:
+        await events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
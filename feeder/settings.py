@@ -64,6 +64,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'rssfeeder.context_processors.categories',
             ],
         },
     },
@@ -77,14 +78,41 @@ WSGI_APPLICATION = 'feeder.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # django.db.backends.sqlite3 with the pragmas below and write-locking
+        # transactions, see rssfeeder/backends/sqlite3/base.py
+        'ENGINE': 'rssfeeder.backends.sqlite3',
+        'NAME': os.environ.get("DB_NAME", BASE_DIR / 'db.sqlite3'),
         'OPTIONS': {
             'timeout': 20,
         }
     }
 }
+# Applied to every new SQLite connection. WAL lets the web processes read
+# while ingest writes; synchronous=NORMAL is durable in WAL mode except for
+# the last commits before a power loss. cache_size is in KiB when negative.
+FEED_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+# Several startjobs workers (possibly on several hosts) can share a PostgreSQL
+# database instead, e.g. DB_ENGINE=django.db.backends.postgresql DB_HOST=db
+if os.environ.get("DB_ENGINE"):
+    DATABASES['default'] = {
+        'ENGINE': os.environ.get("DB_ENGINE"),
+        'NAME': os.environ.get("DB_NAME"),
+        'USER': os.environ.get("DB_USER", ""),
+        'PASSWORD': os.environ.get("DB_PASSWORD", ""),
+        'HOST': os.environ.get("DB_HOST", ""),
+        'PORT': os.environ.get("DB_PORT", ""),
+    }
 DATABASES['default']['ATOMIC_REQUESTS'] = True
+# Keep connections open between requests (seconds), instead of reconnecting
+# and re-applying the pragmas on every request.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get("DB_CONN_MAX_AGE", 600))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
 
 
 # Password validation
@@ -149,6 +177,148 @@ LOGGING = {
     },
 }
 
+# Feed listings
+# Page the home, category and channel listings by (pub_date, id) cursor
+# instead of page number; no COUNT(*) or OFFSET is needed then.
+
+FEED_CURSOR_PAGINATION = True
+
+# JSON/RSS/Atom listings under /api/, for users who may view feeds and for
+# services sending "Authorization: Bearer <FEED_API_TOKEN>". Clients pick
+# the page size with ?limit=, up to FEED_API_MAX_PAGE_SIZE.
+FEED_API_TOKEN = os.environ.get("FEED_API_TOKEN")
+FEED_API_PAGE_SIZE = 50
+FEED_API_MAX_PAGE_SIZE = 200
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Rendered listings and feed cards go to the "feeds" cache. The local-memory
+# backend evicts least recently used entries beyond MAX_ENTRIES; point
+# FEED_CACHE_BACKEND/FEED_CACHE_LOCATION at a file-based, memcached or redis
+# cache to share it between gunicorn workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'feeds': {
+        'BACKEND': os.environ.get("FEED_CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get("FEED_CACHE_LOCATION", 'feeds'),
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get("FEED_CACHE_MAX_ENTRIES", 5000)),
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+FEED_CACHE = 'feeds'
+# Seconds a process trusts its last read of the ingest version.
+FEED_CACHE_VERSION_TTL = 5
+
+# Request profiling, see rssfeeder/profiling.py
+# Share of requests to profile (0 to 1); 0 leaves the middleware out. The
+# report of each process is served to staff users at /metrics/requests.
+
+FEED_PROFILE_SAMPLE_RATE = float(os.environ.get("FEED_PROFILE_SAMPLE_RATE", 0))
+FEED_PROFILE_SLOW_QUERY_MS = 100
+# flag SQL shapes run at least this many times in one request as N+1
+FEED_PROFILE_REPEAT_THRESHOLD = 5
+FEED_PROFILE_REPORT_SIZE = 500
+if FEED_PROFILE_SAMPLE_RATE:
+    MIDDLEWARE.insert(0, 'rssfeeder.profiling.ProfilingMiddleware')
+
+# Full-text search
+# rssfeeder.search.SQLiteFTSBackend, PostgresSearchBackend or BasicSearchBackend
+
+FEED_SEARCH_BACKEND = os.environ.get("FEED_SEARCH_BACKEND", "rssfeeder.search.SQLiteFTSBackend")
+
+# Live updates, see rssfeeder/live.py
+# Open listings receive the new feeds over server-sent events from
+# FEED_LIVE_PATH, served by feeder.asgi (e.g. uvicorn, see README.md). Each
+# process checks the ingest version every FEED_LIVE_POLL_INTERVAL seconds,
+# whatever the number of readers.
+
+FEED_LIVE_UPDATES = True if os.environ.get("FEED_LIVE_UPDATES") == "True" else False
+FEED_LIVE_PATH = '/events'
+FEED_LIVE_POLL_INTERVAL = 2
+# seconds between the comments sent on idle streams, so that proxies keep them open
+FEED_LIVE_KEEPALIVE = 25
+FEED_LIVE_MAX_CONNECTIONS = int(os.environ.get("FEED_LIVE_MAX_CONNECTIONS", 10000))
+# cards sent per listing and update, taken from the FEED_LIVE_SCAN newest new feeds
+FEED_LIVE_CARDS = 10
+FEED_LIVE_SCAN = 500
+# updates kept for a slow reader before its stream is closed
+FEED_LIVE_QUEUE_SIZE = 16
+# ingest versions a page may be behind and still get the feeds it missed, instead of a reload
+FEED_LIVE_CATCH_UP = 100
+
+# Feed ingest
+# Sources to ingest besides the imported ones (rssfeeder.sources), see README.md.
+FEED_CONFIG = os.environ.get("FEED_CONFIG", BASE_DIR / 'feed.ini')
+# Limits for the concurrent feed downloader used by the startjobs command.
+
+FEED_FETCH_CONCURRENCY = int(os.environ.get("FEED_FETCH_CONCURRENCY", 50))
+FEED_FETCH_PER_HOST = int(os.environ.get("FEED_FETCH_PER_HOST", 4))
+FEED_FETCH_TIMEOUT = int(os.environ.get("FEED_FETCH_TIMEOUT", 30))
+# "manage.py importsources" downloads every new source once first; a source
+# that does not answer within this many seconds is recorded as unreachable.
+FEED_SOURCE_PROBE_TIMEOUT = 15
+FEED_SOURCE_PROBE_MAX_BYTES = 10 * 1024 * 1024
+# Every feed is polled on its own schedule, adapted to how often it
+# publishes (seconds). The dispatcher checks for due feeds at this interval.
+FEED_POLL_DISPATCH_INTERVAL = 60
+FEED_POLL_MIN_INTERVAL = 5 * 60
+FEED_POLL_MAX_INTERVAL = 24 * 60 * 60
+FEED_POLL_DEFAULT_INTERVAL = 30 * 60
+# Number of entry descriptions sent to an HTML extraction worker at once.
+FEED_EXTRACT_CHUNKSIZE = 64
+# Stop parsing an entry description after this many characters (None keeps all).
+FEED_DESCRIPTION_MAX_LENGTH = None
+# New entries whose title and text nearly match a feed published in the last
+# FEED_CLUSTER_WINDOW_DAYS are stored as alternates of it, and only the first
+# feed of a story is listed. Entries with fewer words are never clustered.
+FEED_CLUSTER_WINDOW_DAYS = 3
+FEED_CLUSTER_MIN_WORDS = 12
+# Sources buffered between two ingest pipeline stages.
+FEED_PIPELINE_QUEUE_SIZE = 16
+# The ingest writer commits after this many new feeds or seconds, whichever comes first.
+FEED_WRITE_BATCH_SIZE = 500
+FEED_WRITE_INTERVAL = 2
+# Ingest metrics are served at /metrics to staff users and to Prometheus
+# scrapers sending "Authorization: Bearer <FEED_METRICS_TOKEN>".
+FEED_METRICS_TOKEN = os.environ.get("FEED_METRICS_TOKEN")
+# Feeds older than FEED_RETENTION_DAYS are purged every night, except the
+# favorited ones. FEED_RETENTION_DAYS_BY_CATEGORY overrides it by category
+# name, e.g. {'News': 7, 'Science': None} (None keeps them forever). Set
+# FEED_PURGE_ARCHIVE_DIR to write purged feeds to a JSON lines file first.
+FEED_RETENTION_DAYS = int(os.environ.get("FEED_RETENTION_DAYS", 30))
+FEED_RETENTION_DAYS_BY_CATEGORY = {}
+FEED_PURGE_BATCH_SIZE = 1000
+FEED_PURGE_ARCHIVE_DIR = os.environ.get("FEED_PURGE_ARCHIVE_DIR")
+# Ingest workers lease due sources in batches of FEED_LEASE_BATCH_SIZE. A lease
+# is renewed by its worker's heartbeat and is taken over by other workers once
+# it has not been renewed for FEED_LEASE_TIMEOUT seconds (e.g. after a crash).
+FEED_LEASE_BATCH_SIZE = int(os.environ.get("FEED_LEASE_BATCH_SIZE", 100))
+FEED_LEASE_TIMEOUT = 5 * 60
+
+# Thumbnails, see rssfeeder/thumbnails.py
+# Feed images are downloaded once by the scheduler, resized to fit within
+# FEED_THUMBNAIL_SIZE and stored as WebP files in FEED_THUMBNAIL_DIR. The
+# least recently requested files are deleted once the directory grows past
+# FEED_THUMBNAIL_CACHE_BYTES.
+FEED_THUMBNAIL_DIR = os.environ.get("FEED_THUMBNAIL_DIR", BASE_DIR / 'thumbnails')
+FEED_THUMBNAIL_CACHE_BYTES = int(os.environ.get("FEED_THUMBNAIL_CACHE_BYTES", 512 * 1024 * 1024))
+FEED_THUMBNAIL_SIZE = (320, 320)
+FEED_THUMBNAIL_QUALITY = 80
+# images above these limits (bytes downloaded, pixels decoded) are not thumbnailed
+FEED_THUMBNAIL_MAX_BYTES = 5 * 1024 * 1024
+FEED_THUMBNAIL_MAX_PIXELS = 40_000_000
+# images thumbnailed per run of the job, and seconds between runs
+FEED_THUMBNAIL_BATCH_SIZE = 200
+FEED_THUMBNAIL_INTERVAL = 60
+# images on loopback, private and link-local addresses are refused unless this is on
+FEED_THUMBNAIL_PRIVATE_HOSTS = False
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 CSRF_COOKIE_SECURE = True
 SESSION_COOKIE_SECURE = True
@@ -1,13 +1,42 @@
 from django.contrib import admin
-from .models import Feed, Category
+from .models import Feed, Category, Channel, FeedSource, FetchState, IngestRun, Thumbnail
 
 
 # Register your models here.
 @admin.register(Feed)
 class EpisodeAdmin(admin.ModelAdmin):
     list_display = ("channel_name", "title", "pub_date", "category")
+    raw_id_fields = ("canonical",)
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ("name",)
+
+
+@admin.register(FeedSource)
+class FeedSourceAdmin(admin.ModelAdmin):
+    list_display = ("name", "title", "category", "enabled", "reachable", "feed_type", "size", "probed_on")
+    list_filter = ("enabled", "reachable", "feed_type", "category")
+    search_fields = ("name", "title", "feed")
+
+
+@admin.register(FetchState)
+class FetchStateAdmin(admin.ModelAdmin):
+    list_display = ("section", "status", "fetched_on", "changed_on", "next_poll", "error_count", "leased_by")
+
+
+@admin.register(Channel)
+class ChannelAdmin(admin.ModelAdmin):
+    list_display = ("name", "category", "item_count", "latest_pub_date")
+
+
+@admin.register(IngestRun)
+class IngestRunAdmin(admin.ModelAdmin):
+    list_display = ("started_on", "worker", "seconds", "sources", "new_entries", "errors")
+
+
+@admin.register(Thumbnail)
+class ThumbnailAdmin(admin.ModelAdmin):
+    list_display = ("url", "status", "size", "fetched_on", "used_on")
+    list_filter = ("status",)
@@ -0,0 +1,142 @@
+"""Machine-readable feed listings: JSON, RSS 2.0 and Atom.
+
+The listings are the querysets of the HTML views, paged by keyset cursor
+(see `rssfeeder.pagination`), except search results which keep their
+rank order and are paged by offset like the search page. Bodies are built without templates,
+gzipped once and kept in the feeds cache until the next ingest, like the
+HTML listings (see `rssfeeder.cache`). Their strong ETag only depends on
+the ingest version and the request, so a client revalidating an
+unchanged listing gets a 304 before any feed is queried.
+"""
+import gzip
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import parse_etags
+
+from .cache import ingest_version, listing_key
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'rss': 'application/rss+xml; charset=utf-8',
+    'atom': 'application/atom+xml; charset=utf-8',
+}
+SYNDICATION_FEEDS = {'rss': Rss201rev2Feed, 'atom': Atom1Feed}
+
+
+def page_size(request):
+    """Returns the ``limit`` parameter of `request`, within FEED_API_MAX_PAGE_SIZE."""
+    try:
+        limit = int(request.GET.get('limit', settings.FEED_API_PAGE_SIZE))
+    except ValueError:
+        limit = settings.FEED_API_PAGE_SIZE
+    return max(1, min(limit, settings.FEED_API_MAX_PAGE_SIZE))
+
+
+def page_offset(request):
+    """Returns the ``offset`` parameter of `request`, 0 if it is missing or invalid."""
+    try:
+        return max(0, int(request.GET.get('offset', 0)))
+    except ValueError:
+        return 0
+
+
+def feed_item(feed):
+    return {
+        'id': feed.pk,
+        'guid': feed.guid,
+        'title': feed.title,
+        'link': feed.link,
+        'description': feed.description,
+        'published': feed.pub_date.isoformat(),
+        'channel': feed.channel_name,
+        'category': feed.category.name,
+        'image': feed.feed_img,
+        'also_in': getattr(feed, 'also_in', []),
+    }
+
+
+def render_json(page, title, link, next_url, previous_url):
+    return json.dumps({
+        'title': title,
+        'link': link,
+        'next': next_url,
+        'previous': previous_url,
+        'items': [feed_item(feed) for feed in page],
+    }, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def render_syndication(page, fmt, title, link, feed_url):
+    feed = SYNDICATION_FEEDS[fmt](title=title, link=link, description=title, feed_url=feed_url,
+                                  language=settings.LANGUAGE_CODE)
+    for item in page:
+        feed.add_item(
+            title=item.title,
+            link=item.link,
+            description=item.description,
+            unique_id=item.guid,
+            unique_id_is_permalink=False,
+            pubdate=item.pub_date,
+            author_name=item.channel_name,
+            categories=[item.category.name],
+        )
+    return feed.writeString('utf-8').encode()
+
+
+def render(page, fmt, title, link, page_url):
+    """Returns the body of a listing page.
+
+    Args:
+        page: `CursorPage` or `OffsetPage` of feeds
+        fmt: 'json', 'rss' or 'atom'
+        title: title of the listing
+        link: absolute URL of the HTML listing
+        page_url: function of a query string returning the absolute URL of an API page
+    """
+    if fmt == 'json':
+        return render_json(
+            page, title, link,
+            next_url=page_url(page.next_query()) if page.has_next() else None,
+            previous_url=page_url(page.previous_query()) if page.has_previous() else None,
+        )
+    return render_syndication(page, fmt, title, link, page_url({}))
+
+
+def etag(*parts):
+    """Returns the strong ETag of the listing identified by `parts` in the current ingest version."""
+    raw = ':'.join(str(part) for part in parts)
+    return '"{}-{}"'.format(ingest_version(), hashlib.md5(raw.encode()).hexdigest())
+
+
+def respond(request, fmt, parts, build):
+    """Returns the listing identified by `parts`, built by `build()` on a cache miss.
+
+    Answers 304 when the client holds the current version, so the caller
+    checks that the listing exists before. The body is
+    cached gzipped and sent as is to clients accepting gzip.
+    """
+    identity = etag(*parts)
+    # a different encoding is a different representation, and needs its own strong ETag
+    gzipped = identity[:-1] + '-gzip"'
+    accepts_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    current = gzipped if accepts_gzip else identity
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' in if_none_match or identity in if_none_match or gzipped in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        body = caches[settings.FEED_CACHE].get_or_set(
+            listing_key('api', *parts), lambda: gzip.compress(build(), mtime=0))
+        if accepts_gzip:
+            response = HttpResponse(body, content_type=CONTENT_TYPES[fmt])
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(body), content_type=CONTENT_TYPES[fmt])
+    response['ETag'] = current
+    response['Vary'] = 'Accept-Encoding, Authorization, Cookie'
+    # clients must revalidate, which is a 304 until the next ingest
+    response['Cache-Control'] = 'private, no-cache'
+    return response
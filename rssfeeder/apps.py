@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class RssfeederConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rssfeeder'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate, post_save, post_delete
+        from .categories import invalidate
+        from .search import setup_search_index
+
+        post_migrate.connect(setup_search_index, sender=self)
+        category = self.get_model('Category')
+        post_save.connect(invalidate, sender=category)
+        post_delete.connect(invalidate, sender=category)
@@ -0,0 +1,28 @@
+"""SQLite backend for a web server and ingest workers sharing one database file.
+
+Two changes to Django's backend:
+
+* FEED_SQLITE_PRAGMAS are applied to every new connection. In WAL mode
+  readers neither block nor are blocked by the ingest writer.
+* Transactions start with ``BEGIN IMMEDIATE``, taking the write lock up
+  front. A deferred transaction that reads before it writes cannot wait
+  for a busy writer: SQLite fails its first write at once with "database
+  is locked". An immediate one waits for the lock (up to the ``timeout``
+  option) and then runs, so writers are served one at a time instead.
+  Read-only views are kept out of transactions altogether, see
+  ``non_atomic`` in rssfeeder.views.
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in settings.FEED_SQLITE_PRAGMAS.items():
+            conn.execute("PRAGMA {} = {}".format(pragma, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
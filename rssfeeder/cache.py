@@ -0,0 +1,59 @@
+"""Caching of rendered listings, keyed by the ingest version.
+
+Feed content only changes when the startjobs process commits new items
+or purges old ones. Both bump `IngestStamp.version`, and every cache key
+here contains that version, so stale entries are never read again and
+simply age out of the ``feeds`` cache (see ``CACHES`` in settings).
+
+The version itself is re-read from the database at most every
+``FEED_CACHE_VERSION_TTL`` seconds per process.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+from .models import IngestStamp
+
+_version = None
+_version_read_at = 0.0
+
+
+def bump_ingest_version():
+    """Marks all cached listings as stale and returns the new version. Call in ingest or purge transactions.
+
+    The update locks the stamp row until the transaction ends, so the
+    versions of concurrent transactions follow their commit order.
+    """
+    global _version
+    if not IngestStamp.objects.filter(pk=1).update(version=F('version') + 1, updated_on=timezone.now()):
+        IngestStamp.objects.get_or_create(pk=1, defaults={'version': 1})
+    _version = None
+    return read_ingest_version()
+
+
+def read_ingest_version():
+    """Reads the version from the database, bypassing the per-process copy of `ingest_version`."""
+    return IngestStamp.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def ingest_version():
+    global _version, _version_read_at
+    now = time.monotonic()
+    if _version is None or now - _version_read_at > settings.FEED_CACHE_VERSION_TTL:
+        _version = read_ingest_version()
+        _version_read_at = now
+    return _version
+
+
+def listing_key(*parts):
+    raw = ':'.join(str(part) for part in parts)
+    return 'listing:{}:{}'.format(ingest_version(), hashlib.md5(raw.encode()).hexdigest())
+
+
+def cached_listing(parts, build):
+    """Returns the cached result of `build()` for the listing identified by `parts`."""
+    return caches[settings.FEED_CACHE].get_or_set(listing_key(*parts), build)
@@ -0,0 +1,77 @@
+"""In-process mapping of category URL slugs to category ids.
+
+Category pages are routed by slug (``/tech``, ``/science``...) and the
+``Default`` category is served at ``/``. The mapping is loaded once per
+process and dropped whenever a `Category` is saved or deleted here.
+Categories created by another process (e.g. the startjobs ingest) are
+picked up by reloading on an unknown slug, at most every
+`MISS_RELOAD_INTERVAL` seconds.
+"""
+import time
+
+from django.conf import settings
+from django.utils.text import slugify
+
+DEFAULT_CATEGORY = 'Default'
+MISS_RELOAD_INTERVAL = 60
+# first path segments of the other routes (see urls.py), never given to a category
+RESERVED_SLUGS = {'admin', 'api', 'channel', 'channels', 'favops', 'favorites', 'login', 'logout', 'metrics',
+                  'password-change', 'profile', 'search', 'static', 'thumbnails'}
+
+_mapping = None
+_loaded_at = 0.0
+
+
+def category_slug(name):
+    """Returns the preferred slug of a category, see `assign_slugs` for the one it gets."""
+    return '' if name == DEFAULT_CATEGORY else slugify(name)
+
+
+def assign_slugs(rows):
+    """Returns the mapping of slug to ``(id, name)`` for the ``(id, name)`` `rows`.
+
+    Names that slugify alike (``C++`` and ``C``, or only non-ASCII
+    characters) would share a page: the oldest category keeps the slug,
+    the others fall back to their Unicode slug, then get their id
+    appended. Only `DEFAULT_CATEGORY` is served at the empty slug, and
+    the `RESERVED_SLUGS` and the live updates path are never assigned.
+    """
+    taken = RESERVED_SLUGS | {settings.FEED_LIVE_PATH.strip('/').split('/')[0]}
+    slugs = {}
+    for pk, name in sorted(rows):
+        slug = category_slug(name)
+        if name != DEFAULT_CATEGORY and (not slug or slug in slugs or slug in taken):
+            slug = slugify(name, allow_unicode=True)
+            while not slug or slug in slugs or slug in taken:
+                slug = '{}-{}'.format(slug or 'category', pk)
+        slugs[slug] = (pk, name)
+    return dict(sorted(slugs.items(), key=lambda item: item[1][1]))
+
+
+def _load():
+    global _mapping, _loaded_at
+    from .models import Category
+
+    _mapping = assign_slugs(Category.objects.values_list('pk', 'name'))
+    _loaded_at = time.monotonic()
+    return _mapping
+
+
+def get_categories():
+    """Returns the mapping of slug to ``(id, name)``, loading it if needed."""
+    return _mapping if _mapping is not None else _load()
+
+
+def category_id(slug):
+    """Returns the id of the category served at `slug`, or None."""
+    mapping = get_categories()
+    if slug not in mapping and time.monotonic() - _loaded_at > MISS_RELOAD_INTERVAL:
+        mapping = _load()
+    entry = mapping.get(slug)
+    return entry[0] if entry else None
+
+
+def invalidate(**kwargs):
+    """post_save/post_delete receiver for `Category`."""
+    global _mapping
+    _mapping = None
@@ -0,0 +1,51 @@
+"""Maintenance of the `Channel` directory and its per-channel aggregates."""
+from collections import defaultdict
+
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Channel, Feed
+
+
+def sync_channel(name, link, logo, category):
+    """Returns the channel called `name`, creating or updating it from feed.ini values."""
+    channel, created = Channel.objects.get_or_create(
+        name=name, defaults={'link': link, 'logo': logo, 'category': category})
+    if not created and (channel.link, channel.logo, channel.category_id) != (link, logo, category.pk):
+        channel.link, channel.logo, channel.category = link, logo, category
+        channel.save(update_fields=['link', 'logo', 'category'])
+    return channel
+
+
+def record_new_items(episodes):
+    """Adds freshly inserted `Feed` rows to the aggregates of their channels."""
+    counts = defaultdict(int)
+    latest = {}
+    for episode in episodes:
+        counts[episode.channel_id] += 1
+        if episode.channel_id not in latest or episode.pub_date > latest[episode.channel_id]:
+            latest[episode.channel_id] = episode.pub_date
+    for channel_id, count in counts.items():
+        Channel.objects.filter(pk=channel_id).update(item_count=F('item_count') + count)
+        Channel.objects.filter(pk=channel_id).filter(
+            Q(latest_pub_date__isnull=True) | Q(latest_pub_date__lt=latest[channel_id])
+        ).update(latest_pub_date=latest[channel_id])
+
+
+def refresh_channel_stats(channels=None):
+    """Recomputes the aggregates of `channels` (all by default) from the feed table.
+
+    Used after purges, where the removed rows are not known individually.
+    """
+    feeds = Feed.objects.filter(channel=OuterRef('pk')).order_by().values('channel')
+    channels = Channel.objects.all() if channels is None else channels
+    channels.update(
+        item_count=Coalesce(Subquery(feeds.annotate(c=Count('pk')).values('c')), Value(0)),
+        latest_pub_date=Subquery(feeds.annotate(m=Max('pub_date')).values('m')),
+    )
+
+
+def link_orphan_feeds():
+    """Points feeds stored before channels existed at their channel, by name."""
+    for channel in Channel.objects.all():
+        Feed.objects.filter(channel__isnull=True, channel_name=channel.name).update(channel=channel)
@@ -0,0 +1,172 @@
+"""Near-duplicate clustering of feeds at ingest time.
+
+The same story is often published by several channels under different
+GUIDs, e.g. by a project blog and by the planets aggregating it. The
+cluster stage of the ingest pipeline (see `rssfeeder.ingest`) computes
+the SimHash (see `utils.simhash`) of the title and text of every new
+entry and looks for a near-identical feed published in the last
+FEED_CLUSTER_WINDOW_DAYS: among the stored feeds through the indexed
+band columns of `Feed`, then among the entries of the current cycle that
+may not be written yet. A match is stored with `Feed.canonical` pointing
+at the first feed of the story. Listings only show feeds without a
+canonical feed, with the channels of their alternates.
+
+Only entries of other channels in the same category are matched: the
+near-identical entries of one channel (digests, advisories, release
+notes) are distinct items, and a category listing hiding an alternate
+must show its canonical feed instead.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import timedelta
+from typing import Union
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from utils.simhash import BANDS, MAX_DISTANCE, bands, distance, simhash, words
+
+from .models import Category, Channel, Feed
+
+BAND_FIELDS = ['band{}'.format(i) for i in range(BANDS)]
+
+
+def to_signed(fingerprint):
+    """Maps an unsigned 64-bit fingerprint into the range of a BigIntegerField."""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def fingerprint(title, text, min_words=None):
+    """Returns the SimHash of an entry, or None if it has too few words to be told apart from others."""
+    min_words = settings.FEED_CLUSTER_MIN_WORDS if min_words is None else min_words
+    tokens = words('{} {}'.format(title, text))
+    if len(tokens) < min_words:
+        return None
+    return simhash(tokens)
+
+
+def band_filter(fingerprint):
+    query = Q()
+    for field, band in zip(BAND_FIELDS, bands(fingerprint)):
+        query |= Q(**{field: band})
+    return query
+
+
+@lru_cache(maxsize=None)
+def candidates_sql():
+    """Returns the SQL of the candidates of a fingerprint: the feeds sharing a band, published since a date.
+
+    It is compiled once, as building the query would take most of the
+    lookup time. Parameters: the `bands` of the fingerprint and the date.
+    """
+    queryset = Feed.objects.filter(band_filter(0), pub_date__gte=timezone.now())
+    columns = ['pk', 'simhash', 'canonical_id', 'channel_id', 'category_id', 'canonical__channel_id']
+    return queryset.values_list(*columns).query.sql_with_params()[0]
+
+
+def find_stored(fingerprint, since, channel_id=None, category_id=None):
+    """Returns the pk of the first feed of the stored story nearest to `fingerprint`, or None.
+
+    Only feeds published after `since` are considered, and when given,
+    only those of `category_id` whose story was not told by `channel_id`.
+    """
+    best = None
+    with connection.cursor() as cursor:
+        cursor.execute(candidates_sql(), bands(fingerprint) + [connection.ops.adapt_datetimefield_value(since)])
+        candidates = cursor.fetchall()
+    for pk, value, canonical_id, channel, category, canonical_channel in candidates:
+        if category_id is not None and category != category_id:
+            continue
+        if channel_id is not None and channel_id in (channel, canonical_channel):
+            continue
+        d = distance(fingerprint, to_unsigned(value))
+        if d <= MAX_DISTANCE and (best is None or d < best[0]):
+            best = (d, canonical_id or pk)
+    return best and best[1]
+
+
+@dataclass
+class Signature:
+    """Fingerprint of a new entry and the story it belongs to, if any."""
+    fingerprint: int
+    # pk of a stored feed, or GUID of an earlier entry of the same cycle
+    canonical: Union[int, str, None] = None
+
+    def apply(self, feed):
+        """Sets the clustering fields of an unsaved `feed`."""
+        feed.simhash = to_signed(self.fingerprint)
+        for field, band in zip(BAND_FIELDS, bands(self.fingerprint)):
+            setattr(feed, field, band)
+        if isinstance(self.canonical, int):
+            feed.canonical_id = self.canonical
+
+
+class Clusterer:
+    """Cluster stage of the ingest pipeline.
+
+    Sets `batch.signatures`, one `Signature` (or None for entries too
+    short to cluster) per entry.
+    """
+
+    def __init__(self):
+        self.window = timedelta(days=settings.FEED_CLUSTER_WINDOW_DAYS)
+        # (band number, band) -> [(fingerprint, GUID, canonical, channel, category)] of the entries of this cycle,
+        # channels and categories by name as they may not be stored yet
+        self.pending = defaultdict(list)
+        # GUID -> channel of the entries of this cycle
+        self.channels = {}
+
+    def find_pending(self, fingerprint, channel, category):
+        best = None
+        for key in enumerate(bands(fingerprint)):
+            for other, guid, canonical, other_channel, other_category in self.pending[key]:
+                if channel in (other_channel, self.channels.get(canonical)) or other_category != category:
+                    continue
+                d = distance(fingerprint, other)
+                if d <= MAX_DISTANCE and (best is None or d < best[0]):
+                    best = (d, canonical or guid)
+        return best and best[1]
+
+    def __call__(self, batch):
+        since = timezone.now() - self.window
+        # the writer names channels after the source title, see rssfeeder.channels.sync_channel
+        channel, category = batch.source.title, batch.source.category
+        channel_id = Channel.objects.filter(name=channel).values_list('pk', flat=True).first()
+        category_id = Category.objects.filter(name=category).values_list('pk', flat=True).first()
+        batch.signatures = []
+        for item, html, extracted in zip(batch.entries, batch.htmls, batch.extracted):
+            text = extracted[0] if html and extracted else item.get('description', '')
+            value = fingerprint(item.get('title', ''), text)
+            if value is None:
+                batch.signatures.append(None)
+                continue
+            # nothing is stored in a category that does not exist yet
+            stored = category_id is not None and find_stored(value, since, channel_id, category_id)
+            canonical = stored or self.find_pending(value, channel, category)
+            batch.signatures.append(Signature(value, canonical))
+            self.channels[item.guid] = channel
+            for key in enumerate(bands(value)):
+                self.pending[key].append((value, item.guid, canonical, channel, category))
+
+
+def link_alternates(links):
+    """Points written feeds at their canonical feed written in the same cycle.
+
+    Args:
+        links: list of (GUID of the alternate, GUID of the canonical feed)
+    """
+    canonical_pks = dict(Feed.objects.filter(guid__in={guid for _, guid in links}).values_list('guid', 'pk'))
+    alternates = defaultdict(list)
+    for guid, canonical in links:
+        # the canonical entry may have been dropped, e.g. claimed by another worker
+        if canonical in canonical_pks:
+            alternates[canonical_pks[canonical]].append(guid)
+    for pk, guids in alternates.items():
+        Feed.objects.filter(guid__in=guids, canonical__isnull=True).exclude(pk=pk).update(canonical_id=pk)
@@ -0,0 +1,6 @@
+from .categories import get_categories
+
+
+def categories(request):
+    """Adds the categories shown in the navbar, as ``(slug, name)`` pairs."""
+    return {'feed_categories': [(slug, name) for slug, (pk, name) in get_categories().items() if slug]}
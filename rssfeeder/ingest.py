@@ -0,0 +1,509 @@
+"""Streaming feed ingest pipeline.
+
+One ingest cycle runs six stages connected by bounded queues::
+
+    fetch -> parse -> dedup -> extract -> cluster -> write
+
+Each stage handles one source (`SourceBatch`) at a time, so memory stays
+flat however many sources a cycle covers, and the writer commits in
+small transactions as batches arrive instead of after the slowest feed.
+Fetching is asyncio (see `utils.fetcher`), HTML extraction runs on a
+process pool kept for the life of the process (see `extract_pool`), and
+the writer is the only stage that writes to the database. The cluster
+stage matches new entries against recent stories told by other
+channels, see `rssfeeder.clustering`.
+"""
+import hashlib
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, List, Optional
+
+import feedparser
+from dateutil import parser
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from utils.fetcher import FetchResult, fetch_each
+from utils.htmlfeed import extract_many
+from utils.schedule import next_interval
+
+from .cache import bump_ingest_version
+from .channels import record_new_items, sync_channel
+from .clustering import Clusterer, link_alternates
+from .models import Category, Feed, FetchState, IngestRun
+from .thumbnails import queue_thumbnails
+
+logger = logging.getLogger(__name__)
+
+HTML_TYPES = {'text/html', 'application/xhtml+xml'}
+IMG_TAGS = ('media_thumbnail', 'media_content', 'thumbnail')
+# FetchState columns written by the pipeline; the lease columns belong to
+# rssfeeder.leases and are renewed concurrently by the worker heartbeat
+STATE_FIELDS = ['etag', 'last_modified', 'status', 'content_hash', 'fetched_on', 'changed_on',
+                'next_poll', 'interval', 'error_count',
+                'fetch_seconds', 'bytes', 'parse_seconds', 'extract_seconds', 'entries', 'new_entries', 'duplicates']
+
+
+@dataclass
+class Source:
+    """A feed to ingest, as described by a feed.ini section."""
+    name: str
+    feed: str
+    title: str
+    logo: str
+    link: str = ''
+    category: str = 'Default'
+
+    @classmethod
+    def from_section(cls, name, section):
+        """Builds a source from a configparser section, or returns None if it is incomplete."""
+        try:
+            return cls(name=name, feed=section['feed'], title=section['title'], logo=section['logo'],
+                       link=section.get('link', ''), category=section.get('category') or 'Default')
+        except KeyError as exc:
+            logger.warning("Error reading {}: missing {}".format(name, exc))
+            return None
+
+
+@dataclass
+class SourceBatch:
+    """A source travelling through the pipeline stages."""
+    source: Source
+    state: FetchState
+    response: Optional[FetchResult] = None
+    feed: Any = None
+    changed: bool = False
+    entries: List[Any] = field(default_factory=list)
+    htmls: List[str] = field(default_factory=list)
+    extracted: List[Any] = field(default_factory=list)
+    signatures: List[Any] = field(default_factory=list)
+
+
+def entry_html(item):
+    """Returns the HTML description of `item`, or an empty string for plain text entries."""
+    detail = item.get('summary_detail')
+    if detail is not None and detail.get('type') in HTML_TYPES:
+        return item.get('description', '')
+    return ''
+
+
+def entry_image(item):
+    """Returns the media thumbnail URL of `item`, if the feed provides one."""
+    for tag in IMG_TAGS:
+        value = item.get(tag)
+        if value:
+            value = value[0] if isinstance(value, list) else value
+            if value.get('url'):
+                return value['url']
+    return None
+
+
+def save_new_feeds(item, channel, extracted=None):
+    """Builds a new feed for the database.
+
+    The caller is expected to have checked the feed GUID against the
+    feeds currently stored in the database (see `existing_guids`) and to
+    have run HTML descriptions through `utils.htmlfeed.extract`.
+
+    Args:
+        item: requires a feedparser object
+        channel: `Channel` the feed belongs to
+        extracted: (text, first image URL) of an HTML description
+    """
+    logger.debug("Processing: {}".format(item.title))
+    description = item.get('description', '')
+    html_img = None
+    if extracted is not None:
+        description, html_img = extracted
+    feed_img = entry_image(item) or html_img or "/static/imgs/news.png"
+    try:
+        episode = Feed(
+            title=item.title,
+            description=description,
+            # as of version 5.1.1, feedparser returns a datetime object
+            # if this key doesn’t exist but entries[i].published does,
+            # the value of entries[i].published will be returned.
+            # changed to use updated_parsed instead of published_parsed
+            pub_date=parser.parse(item.updated),
+            link=item.link,
+            channel_img=channel.logo,
+            feed_img=feed_img,
+            channel_name=channel.name,
+            guid=item.guid,
+            category=channel.category,
+            channel=channel,
+        )
+        logger.debug("Saving: {}".format(item.title))
+        return episode
+    except AttributeError as exc:
+        logger.error("Error saving the feed {}: {}".format(item.guid, exc))
+
+
+def conditional_headers(state):
+    """Builds If-None-Match/If-Modified-Since headers from a `FetchState`."""
+    headers = {}
+    if state.etag:
+        headers['If-None-Match'] = state.etag
+    if state.last_modified:
+        headers['If-Modified-Since'] = state.last_modified
+    return headers
+
+
+def update_fetch_state(state, response):
+    """Records a download in `state` and tells whether the feed changed.
+
+    A 304 response or a body identical to the previous download counts as
+    unchanged, so the caller can skip parsing it.
+    """
+    now = timezone.now()
+    state.status = response.status
+    state.fetched_on = now
+    if not response.ok:
+        return False
+    content_hash = hashlib.sha256(response.body).hexdigest()
+    state.etag = response.headers.get('etag', '')
+    state.last_modified = response.headers.get('last-modified', '')
+    if content_hash == state.content_hash:
+        return False
+    state.content_hash = content_hash
+    state.changed_on = now
+    return True
+
+
+def forget_download(state):
+    """Clears the validators and hash of the last download, so the next poll fetches and parses the feed again."""
+    state.etag = state.last_modified = state.content_hash = ''
+
+
+def schedule_next_poll(state, response, feed=None, changed=False):
+    """Sets `state.next_poll` from the outcome of a poll, see `utils.schedule.next_interval`."""
+    failed = not (response.ok or response.not_modified)
+    state.error_count = min(state.error_count + 1, 100) if failed else 0
+    interval = next_interval(
+        state.interval, changed, feed=feed, headers=response.headers, errors=state.error_count,
+        minimum=settings.FEED_POLL_MIN_INTERVAL,
+        maximum=settings.FEED_POLL_MAX_INTERVAL,
+        default=settings.FEED_POLL_DEFAULT_INTERVAL,
+    )
+    state.interval = int(interval)
+    state.next_poll = timezone.now() + timedelta(seconds=interval)
+
+
+def existing_guids(guids, chunk_size=500):
+    """Returns the subset of `guids` that is already stored in the database.
+
+    Lookups are chunked to stay below the SQLite bound parameter limit.
+    """
+    guids = list(guids)
+    found = set()
+    for i in range(0, len(guids), chunk_size):
+        found.update(Feed.objects.filter(guid__in=guids[i:i + chunk_size]).values_list('guid', flat=True))
+    return found
+
+
+_DONE = object()
+
+
+def _stage(name, func, inbox, outbox):
+    """Applies `func` to every batch of `inbox` and forwards it to `outbox`.
+
+    A batch that fails in a stage loses its entries but still reaches the
+    writer, so its fetch state is recorded. The download is forgotten, so
+    the lost entries are fetched again at the next poll.
+    """
+    try:
+        while True:
+            batch = inbox.get()
+            if batch is _DONE:
+                break
+            try:
+                func(batch)
+            except Exception:
+                logger.exception("Error in {} stage for {}".format(name, batch.source.name))
+                batch.entries, batch.htmls, batch.extracted, batch.signatures = [], [], [], []
+                forget_download(batch.state)
+            outbox.put(batch)
+    finally:
+        outbox.put(_DONE)
+        # stages run on their own threads, and so use their own connections
+        connection.close()
+
+
+def _parse(batch):
+    response, state = batch.response, batch.state
+    started = time.perf_counter()
+    changed = batch.changed = update_fetch_state(state, response)
+    if response.not_modified or (response.ok and not changed):
+        logger.debug("Unchanged: {}".format(batch.source.name))
+    elif not response.ok:
+        logger.warning("Error fetching {}: {}".format(batch.source.name, response.error or response.status))
+    else:
+        batch.feed = feedparser.parse(response.body, response_headers=response.headers)
+        batch.entries = [item for item in batch.feed.entries if item.get('guid')]
+    schedule_next_poll(state, response, batch.feed, changed)
+    state.fetch_seconds = response.elapsed
+    state.bytes = len(response.body)
+    state.parse_seconds = time.perf_counter() - started
+    state.entries = len(batch.entries)
+    state.new_entries = state.duplicates = 0
+    state.extract_seconds = 0
+    # the body is not needed past this point
+    response.body = b''
+
+
+def _dedup(seen):
+    def dedup(batch):
+        if not batch.entries:
+            return
+        found = existing_guids({item.guid for item in batch.entries})
+        entries = []
+        for item in batch.entries:
+            if item.guid not in found and item.guid not in seen:
+                seen.add(item.guid)
+                entries.append(item)
+        batch.state.duplicates = len(batch.entries) - len(entries)
+        batch.entries = entries
+    return dedup
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def extract_pool():
+    """Returns the process pool of the extract stage, started on first use.
+
+    The pool is kept for the life of the process, so every ingest cycle
+    reuses the same workers. They are spawned, never forked from this
+    process: the other pipeline threads may hold locks a forked child
+    would inherit.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def close_extract_pool(executor=None, wait=True):
+    """Shuts down the pool of `extract_pool()`, or only `executor` if it is still that pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or executor not in (None, _pool):
+            return
+        executor, _pool = _pool, None
+    executor.shutdown(wait=wait)
+
+
+class _Extractor:
+    """Extract stage. Batches too big to extract in-process go to `extract_pool()`."""
+
+    def __call__(self, batch):
+        batch.htmls = [entry_html(item) for item in batch.entries]
+        if not any(batch.htmls):
+            batch.extracted = [None] * len(batch.htmls)
+            return
+        started = time.perf_counter()
+        executor = extract_pool() if len(batch.htmls) > settings.FEED_EXTRACT_CHUNKSIZE else None
+        try:
+            batch.extracted = extract_many(batch.htmls, chunksize=settings.FEED_EXTRACT_CHUNKSIZE,
+                                           max_length=settings.FEED_DESCRIPTION_MAX_LENGTH, executor=executor)
+        except BrokenProcessPool:
+            # a worker died: the next batch starts a new pool
+            close_extract_pool(executor, wait=False)
+            raise
+        batch.state.extract_seconds = time.perf_counter() - started
+
+
+class Writer:
+    """Final stage: builds `Feed` rows and commits them in bounded transactions.
+
+    The totals of the cycle are added up in `cycle`, an unsaved `IngestRun`,
+    once the batches are committed.
+    """
+
+    def __init__(self, batch_size, interval, cycle):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.cycle = cycle
+        self.episodes = []
+        self.batches = []
+        # GUID -> FetchState of the source of each episode
+        self.owners = {}
+        # (GUID, canonical GUID) of new feeds repeating a story of the same cycle
+        self.links = []
+        self.channels = {}
+        self.written = 0
+        self.flushed_at = time.monotonic()
+
+    def channel(self, source):
+        if source.name not in self.channels:
+            category = Category.objects.get_or_create(name=source.category)[0]
+            self.channels[source.name] = sync_channel(source.title, source.link, source.logo, category)
+        return self.channels[source.name]
+
+    def add(self, batch):
+        state = batch.state
+        self.batches.append(batch)
+        if batch.entries:
+            channel = self.channel(batch.source)
+            for item, html, result, signature in zip(batch.entries, batch.htmls, batch.extracted, batch.signatures):
+                episode = save_new_feeds(item, channel, result if html else None)
+                if episode:
+                    if signature is not None:
+                        signature.apply(episode)
+                        if isinstance(signature.canonical, str):
+                            self.links.append((episode.guid, signature.canonical))
+                    self.episodes.append(episode)
+                    self.owners[episode.guid] = state
+                    state.new_entries += 1
+        # the episodes are built: only the state and the response are needed from now on
+        batch.entries, batch.htmls, batch.extracted, batch.signatures = [], [], [], []
+        if len(self.episodes) >= self.batch_size or time.monotonic() - self.flushed_at >= self.interval:
+            self.flush()
+
+    def count(self, batch):
+        state, run = batch.state, self.cycle
+        run.sources += 1
+        if not (batch.response.ok or batch.response.not_modified):
+            run.errors += 1
+        elif not batch.changed:
+            run.unchanged += 1
+        run.bytes += state.bytes
+        run.entries += state.entries
+        run.new_entries += state.new_entries
+        run.duplicates += state.duplicates
+        run.fetch_seconds += state.fetch_seconds
+        run.parse_seconds += state.parse_seconds
+        run.extract_seconds += state.extract_seconds
+        if state.entries:
+            logger.info("{}: {} entries, {} new, {} bytes in {:.2f}s".format(
+                batch.source.name, state.entries, state.new_entries, state.bytes, state.fetch_seconds))
+
+    def inserted(self, version):
+        """Returns the episodes stored by the insert of this flush, stamped with `version`.
+
+        The insert ignores the GUIDs stored since the dedup stage, e.g. by
+        another worker that took over a source whose lease expired; they
+        are taken off the new entries of their source.
+        """
+        stored = set(Feed.objects.filter(ingest_version=version).values_list('guid', flat=True))
+        ignored = {}
+        for episode in self.episodes:
+            if episode.guid not in stored:
+                state = self.owners[episode.guid]
+                state.new_entries -= 1
+                ignored[state.pk] = state
+        # the states were saved before the insert
+        for state in ignored.values():
+            FetchState.objects.filter(pk=state.pk).update(new_entries=state.new_entries)
+        return [episode for episode in self.episodes if episode.guid in stored]
+
+    def flush(self):
+        started = time.perf_counter()
+        with transaction.atomic():
+            for batch in self.batches:
+                batch.state.save(update_fields=STATE_FIELDS)
+            if self.episodes:
+                # bumped first, the version is stamped on the new rows; concurrent
+                # workers wait for the stamp row, so versions follow commit order
+                version = bump_ingest_version()
+                for episode in self.episodes:
+                    episode.ingest_version = version
+            Feed.objects.bulk_create(self.episodes, batch_size=1000, ignore_conflicts=True)
+            inserted = self.inserted(version) if self.episodes else []
+            if self.links:
+                link_alternates(self.links)
+            if inserted:
+                record_new_items(inserted)
+                queue_thumbnails({url for episode in inserted for url in (episode.feed_img, episode.channel_img)})
+        self.written += len(inserted)
+        # counted once committed, without the entries the insert ignored
+        for batch in self.batches:
+            self.count(batch)
+        self.episodes, self.batches, self.links, self.owners = [], [], [], {}
+        self.flushed_at = time.monotonic()
+        self.cycle.write_seconds += time.perf_counter() - started
+
+    def run(self, inbox):
+        while True:
+            try:
+                batch = inbox.get(timeout=self.interval)
+            except queue.Empty:
+                # nothing arrived for a while: make what we have visible
+                if self.episodes or self.batches:
+                    self.flush()
+                continue
+            if batch is _DONE:
+                break
+            self.add(batch)
+        self.flush()
+
+
+def ingest(sources, worker=''):
+    """Runs one ingest cycle over `sources` and returns the number of new feeds.
+
+    Args:
+        sources: list of `Source`
+        worker: name of the ingest worker, recorded with the cycle metrics
+    """
+    run = IngestRun(worker=worker, started_on=timezone.now())
+    started = time.perf_counter()
+    sources = {source.name: source for source in sources}
+    FetchState.objects.bulk_create([FetchState(section=name) for name in sources], ignore_conflicts=True)
+    states = {state.section: state for state in FetchState.objects.filter(section__in=sources)}
+    logger.info("Fetching {} feeds".format(len(sources)))
+
+    size = settings.FEED_PIPELINE_QUEUE_SIZE
+    fetched, parsed, deduped, extracted, clustered = (queue.Queue(maxsize=size) for _ in range(5))
+
+    def fetch():
+        try:
+            fetch_each(
+                {name: source.feed for name, source in sources.items()},
+                lambda response: fetched.put(SourceBatch(sources[response.key], states[response.key], response)),
+                headers={name: conditional_headers(state) for name, state in states.items()},
+                concurrency=settings.FEED_FETCH_CONCURRENCY,
+                per_host=settings.FEED_FETCH_PER_HOST,
+                timeout=settings.FEED_FETCH_TIMEOUT,
+            )
+        except Exception:
+            logger.exception("Error in fetch stage")
+        finally:
+            fetched.put(_DONE)
+
+    writer = Writer(settings.FEED_WRITE_BATCH_SIZE, settings.FEED_WRITE_INTERVAL, run)
+    threads = [
+        threading.Thread(target=fetch, name="ingest-fetch"),
+        threading.Thread(target=_stage, args=("parse", _parse, fetched, parsed), name="ingest-parse"),
+        threading.Thread(target=_stage, args=("dedup", _dedup(set()), parsed, deduped), name="ingest-dedup"),
+        threading.Thread(target=_stage, args=("extract", _Extractor(), deduped, extracted), name="ingest-extract"),
+        threading.Thread(target=_stage, args=("cluster", Clusterer(), extracted, clustered), name="ingest-cluster"),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        writer.run(clustered)
+    finally:
+        # if the writer failed, keep draining so the other stages can finish
+        while any(thread.is_alive() for thread in threads):
+            try:
+                clustered.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    run.seconds = time.perf_counter() - started
+    run.save()
+    logger.info(
+        "Ingested {} feeds in {:.2f}s: {} new entries, {} unchanged, {} errors "
+        "(fetch {:.2f}s, parse {:.2f}s, extract {:.2f}s, write {:.2f}s)".format(
+            run.sources, run.seconds, run.new_entries, run.unchanged, run.errors,
+            run.fetch_seconds, run.parse_seconds, run.extract_seconds, run.write_seconds))
+    return writer.written
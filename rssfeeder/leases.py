@@ -0,0 +1,111 @@
+"""Leases that let several ingest workers share the feed sources.
+
+A worker claims due sections by writing its name and an expiry time on
+their `FetchState` rows. The claim is a single conditional UPDATE, so two
+workers racing for the same rows can never both get them, on SQLite as on
+PostgreSQL. While a worker polls, its heartbeat pushes the expiry forward;
+the sections of a worker that stops heartbeating (crash, lost host) are
+claimed by the others once the lease has expired.
+"""
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import FetchState
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name():
+    """Returns a name for this process, unique across hosts."""
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def _free(now):
+    return Q(lease_expires__isnull=True) | Q(lease_expires__lt=now)
+
+
+def _due(now):
+    return Q(next_poll__isnull=True) | Q(next_poll__lte=now)
+
+
+def claim(worker, sections, limit=None, timeout=None):
+    """Leases up to `limit` of `sections` that are due for polling.
+
+    Sections never polled before are due immediately, and the longest
+    overdue ones are claimed first.
+
+    Returns:
+        names of the sections leased to `worker`
+    """
+    limit = limit or settings.FEED_LEASE_BATCH_SIZE
+    timeout = timeout or settings.FEED_LEASE_TIMEOUT
+    sections = list(sections)
+    known = set(FetchState.objects.filter(section__in=sections).values_list('section', flat=True))
+    FetchState.objects.bulk_create(
+        [FetchState(section=section) for section in sections if section not in known], ignore_conflicts=True)
+
+    now = timezone.now()
+    due = list(
+        FetchState.objects.filter(section__in=sections)
+        .filter(_due(now))
+        .filter(_free(now))
+        .order_by(F('next_poll').asc(nulls_first=True))
+        .values_list('pk', flat=True)[:limit]
+    )
+    if not due:
+        return []
+    # both conditions are checked again by the UPDATE itself: rows another
+    # worker claimed, or polled and released, since the SELECT above are left alone
+    FetchState.objects.filter(pk__in=due).filter(_due(now)).filter(_free(now)).update(
+        leased_by=worker, lease_expires=now + timedelta(seconds=timeout))
+    return list(FetchState.objects.filter(pk__in=due, leased_by=worker).values_list('section', flat=True))
+
+
+def renew(worker, timeout=None):
+    """Extends the unexpired leases of `worker` and returns how many there are."""
+    timeout = timeout or settings.FEED_LEASE_TIMEOUT
+    now = timezone.now()
+    return FetchState.objects.filter(leased_by=worker, lease_expires__gte=now).update(
+        lease_expires=now + timedelta(seconds=timeout))
+
+
+def release(worker, sections=None):
+    """Gives up the leases of `worker` on `sections` (all of them by default)."""
+    leases = FetchState.objects.filter(leased_by=worker)
+    if sections is not None:
+        leases = leases.filter(section__in=list(sections))
+    return leases.update(leased_by='', lease_expires=None)
+
+
+@contextmanager
+def heartbeat(worker, timeout=None):
+    """Renews the leases of `worker` every third of `timeout` while the block runs."""
+    timeout = timeout or settings.FEED_LEASE_TIMEOUT
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(timeout / 3):
+                try:
+                    renew(worker, timeout)
+                except Exception:
+                    logger.exception("Error renewing the leases of {}".format(worker))
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
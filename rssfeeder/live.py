@@ -0,0 +1,291 @@
+"""Live updates of the open listings over server-sent events.
+
+A listing page with live updates on (``FEED_LIVE_UPDATES``) opens an
+``EventSource`` on ``FEED_LIVE_PATH``, a raw ASGI route in front of
+Django (see feeder/asgi.py), for its category (``?category=<slug>``, the
+home page being the empty slug) or channel (``?channel=<name>``). When
+new feeds of that listing are committed, the page is sent an ``items``
+event with their number and the HTML of their cards, and offers to show
+them without reloading.
+
+The streams do not touch the database. Each process checks the ingest
+version (`IngestStamp`, bumped by every ingest commit, see
+rssfeeder.cache) every ``FEED_LIVE_POLL_INTERVAL`` seconds while it has
+readers; when it changed, the new feeds are read and the events of every
+listing with readers are rendered once, then queued on all the matching
+streams. An idle stream is a coroutine waiting on its queue, so a
+process holds thousands of them (``FEED_LIVE_MAX_CONNECTIONS``).
+
+New feeds are found by the ingest version stamped on them
+(`Feed.ingest_version`), which follows the commit order of the ingest
+transactions even with several workers on PostgreSQL, unlike ids. Events
+carry the version as their id. A stream starts from the version of its
+page (``?version=``, see rssfeeder.views.paginate_feeds) or, when the
+browser reconnects, from the last event it received (``Last-Event-ID``):
+the feeds committed since are sent at once, and later events of versions
+the page already holds are skipped. A page more than
+``FEED_LIVE_CATCH_UP`` versions behind is sent a ``stale`` event
+instead, and so is a reader that fell ``FEED_LIVE_QUEUE_SIZE`` events
+behind, whose stream is then closed (the browser reconnects).
+"""
+import asyncio
+import io
+import json
+import logging
+from collections import defaultdict
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.db.models import Count
+from django.http import Http404
+from django.template.loader import render_to_string
+
+from .cache import read_ingest_version
+from .categories import category_id, get_categories
+from .models import Channel, Feed
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE = b': ping\n\n'
+
+
+def event(name, data, version=None):
+    """Encodes a server-sent event whose data is `data` as JSON."""
+    lines = ['event: {}'.format(name), 'data: {}'.format(json.dumps(data, separators=(',', ':')))]
+    if version is not None:
+        lines.insert(0, 'id: {}'.format(version))
+    return '\n'.join(lines + ['', '']).encode()
+
+
+def read_version():
+    close_old_connections()
+    return read_ingest_version()
+
+
+def render_card(feed):
+    # new feeds are nobody's favorite yet; the page adds its CSRF token to the form
+    return render_to_string('_items/feed.html', {'feed': feed, 'favorite_ids': (), 'csrf_token': 'NOTPROVIDED'})
+
+
+def new_items(after, until, topics):
+    """Returns ``{topic: (count, cards)}`` for the feeds stored by the ingest versions in (`after`, `until`].
+
+    The cards are (id, HTML) pairs. Topics are ``('category', id)`` or
+    ``('channel', id)``; only those in `topics` are counted and get cards. Category listings leave out the
+    repeated stories (see rssfeeder.clustering), as the pages do. The
+    cards are taken from the ``FEED_LIVE_SCAN`` newest of the new feeds.
+    """
+    close_old_connections()
+    feeds = Feed.objects.filter(ingest_version__gt=after, ingest_version__lte=until).order_by()
+    counts = {}
+    rows = feeds.filter(canonical__isnull=True).values_list('category_id').annotate(n=Count('pk'))
+    counts.update((('category', pk), n) for pk, n in rows)
+    counts.update((('channel', pk), n) for pk, n in feeds.values_list('channel_id').annotate(n=Count('pk')))
+    wanted = {topic for topic in topics if topic in counts}
+    cards = defaultdict(list)
+    if wanted:
+        for feed in feeds.select_related('category').order_by('-pub_date', '-id')[:settings.FEED_LIVE_SCAN]:
+            listed = [('channel', feed.channel_id)]
+            if feed.canonical_id is None:
+                listed.append(('category', feed.category_id))
+            for topic in listed:
+                if topic in wanted and len(cards[topic]) < settings.FEED_LIVE_CARDS:
+                    cards[topic].append((feed.pk, render_card(feed)))
+    return {topic: (counts[topic], cards[topic]) for topic in wanted}
+
+
+class Stream:
+    """An open event stream, subscribed to the updates of one listing."""
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.queue = asyncio.Queue(settings.FEED_LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class Broadcaster:
+    """Fans the updates of the listings out to the streams of this process."""
+
+    def __init__(self):
+        self.streams = set()
+        # requests being served, streaming or not yet, within FEED_LIVE_MAX_CONNECTIONS
+        self.connections = 0
+        self.labels = {}
+        self.version = 0
+        self.poller = None
+        self.started = None
+
+    async def subscribe(self, topic, label):
+        stream = Stream(topic)
+        self.streams.add(stream)
+        self.labels[topic] = label
+        if self.poller is None or self.poller.done():
+            self.started = asyncio.Event()
+            self.poller = asyncio.ensure_future(self.poll())
+        await self.started.wait()
+        return stream
+
+    def unsubscribe(self, stream):
+        self.streams.discard(stream)
+
+    async def poll(self):
+        try:
+            self.version = await sync_to_async(read_version)()
+        finally:
+            self.started.set()
+        while self.streams:
+            await asyncio.sleep(settings.FEED_LIVE_POLL_INTERVAL)
+            try:
+                version = await sync_to_async(read_version)()
+                if version == self.version:
+                    continue
+                topics = {stream.topic for stream in self.streams}
+                updates = await sync_to_async(new_items)(self.version, version, topics)
+            except Exception:
+                # keep polling: the streams would wait forever otherwise
+                logger.exception("Cannot read the new feeds for live updates")
+                continue
+            self.version = version
+            self.publish(updates)
+        # no await since the loop test: a new subscriber starts another poller
+        self.poller = None
+
+    def items(self, topic, update, version):
+        """Encodes the ``items`` event of an update of `new_items` for `topic`."""
+        count, cards = update
+        return event('items', {
+            'count': count,
+            'label': self.labels[topic],
+            # the page skips the cards it already shows
+            'ids': [pk for pk, _ in cards],
+            'cards': [html for _, html in cards],
+        }, version)
+
+    def publish(self, updates):
+        events = {topic: self.items(topic, update, self.version) for topic, update in updates.items()}
+        for stream in list(self.streams):
+            data = events.get(stream.topic)
+            if data is None:
+                continue
+            try:
+                stream.queue.put_nowait((self.version, data))
+            except asyncio.QueueFull:
+                stream.overflowed = True
+
+
+broadcaster = Broadcaster()
+
+
+def authorize(request):
+    """Returns the topic and label of the listing a stream `request` asks for.
+
+    Raises PermissionDenied for readers without the view_feed permission
+    and Http404 for unknown listings.
+    """
+    close_old_connections()
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not get_user(request).has_perm('rssfeeder.view_feed'):
+        raise PermissionDenied
+    if 'channel' in request.GET:
+        channel = Channel.objects.filter(name=request.GET['channel']).first()
+        if channel is None:
+            raise Http404("Channel does not exist")
+        return ('channel', channel.pk), channel.name
+    slug = request.GET.get('category', '')
+    pk = category_id(slug)
+    if pk is None:
+        raise Http404("Category does not exist")
+    return ('category', pk), get_categories()[slug][1]
+
+
+async def respond(send, status, text):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': text.encode()})
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events(scope, receive, send):
+    """ASGI application streaming the updates of a listing, see the module docstring."""
+    if scope['method'] != 'GET':
+        await respond(send, 405, "Method not allowed")
+        return
+    if broadcaster.connections >= settings.FEED_LIVE_MAX_CONNECTIONS:
+        await respond(send, 503, "Too many readers")
+        return
+    # taken before the first await, so that a burst of connections cannot exceed the limit
+    broadcaster.connections += 1
+    try:
+        await stream_events(scope, receive, send)
+    finally:
+        broadcaster.connections -= 1
+
+
+async def stream_events(scope, receive, send):
+    request = ASGIRequest(scope, io.BytesIO())
+    try:
+        topic, label = await sync_to_async(authorize)(request)
+    except PermissionDenied:
+        await respond(send, 403, "Forbidden")
+        return
+    except Http404 as exc:
+        await respond(send, 404, str(exc))
+        return
+    try:
+        # the last event received by a reconnecting browser, or the version of the page
+        seen = int(request.headers.get('Last-Event-ID') or request.GET.get('version', ''))
+    except ValueError:
+        seen = None
+    # not kept for the life of the stream
+    del request
+
+    stream = await broadcaster.subscribe(topic, label)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # nginx would buffer the stream
+            (b'x-accel-buffering', b'no'),
+        ]})
+        opening = 'retry: {}\n\n'.format(settings.FEED_LIVE_POLL_INTERVAL * 1000).encode()
+        # the queue gets the updates after this version
+        version = broadcaster.version
+        if seen is not None and seen < version:
+            if version - seen > settings.FEED_LIVE_CATCH_UP:
+                opening += event('stale', {'label': label}, version)
+            else:
+                updates = await sync_to_async(new_items)(seen, version, {topic})
+                if topic in updates:
+                    opening += broadcaster.items(topic, updates[topic], version)
+        seen = version if seen is None else max(seen, version)
+        await send({'type': 'http.response.body', 'body': opening, 'more_body': True})
+        while not stream.overflowed:
+            queued = asyncio.ensure_future(stream.queue.get())
+            done, _ = await asyncio.wait({queued, disconnected}, timeout=settings.FEED_LIVE_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                queued.cancel()
+                return
+            if queued in done:
+                version, body = queued.result()
+                if version <= seen:
+                    continue
+            else:
+                queued.cancel()
+                body = KEEPALIVE
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': event('stale', {'label': label}, broadcaster.version)})
+    finally:
+        broadcaster.unsubscribe(stream)
+        disconnected.cancel()
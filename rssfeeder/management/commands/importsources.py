@@ -0,0 +1,91 @@
+import os
+import statistics
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rssfeeder.sources import import_sources, probe, read_catalog
+
+
+class Command(BaseCommand):
+    help = ("Imports feed sources from OPML or feed.ini-style files after probing every URL. "
+            "The scheduler picks them up at its next round.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", help="OPML (.opml, .xml) or INI files.")
+        parser.add_argument(
+            "--category", default="Default",
+            help="Category of the OPML feeds outside of a folder.",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.FEED_FETCH_CONCURRENCY,
+            help="Maximum number of probes in flight.",
+        )
+        parser.add_argument(
+            "--per-host", type=int, default=settings.FEED_FETCH_PER_HOST,
+            help="Maximum number of connections to a single host.",
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=settings.FEED_SOURCE_PROBE_TIMEOUT,
+            help="Seconds allowed for each probe.",
+        )
+        parser.add_argument("--no-probe", action="store_true", help="Import without downloading the feeds.")
+        parser.add_argument(
+            "--skip-unreachable", action="store_true",
+            help="Leave out the sources that could not be downloaded.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Probe and report, but import nothing.")
+
+    def handle(self, *args, **options):
+        write = self.stdout.write
+        sources = {}
+        for path in options["files"]:
+            if not os.path.isfile(path):
+                raise CommandError("No such file: {}".format(path))
+            try:
+                catalog = read_catalog(path, options["category"])
+            except (OSError, SyntaxError) as exc:
+                # ElementTree.ParseError is a SyntaxError
+                raise CommandError("Cannot read {}: {}".format(path, exc))
+            # the first file listing a feed URL wins
+            for source in catalog:
+                sources.setdefault(source.feed, source)
+        sources = list(sources.values())
+        write("Read {} sources from {} files".format(len(sources), len(options["files"])))
+
+        probes = None
+        if not options["no_probe"]:
+            started = time.perf_counter()
+            probes = probe(sources, options["concurrency"], options["per_host"], options["timeout"])
+            self.report(probes, time.perf_counter() - started, options["verbosity"] > 1)
+
+        if options["dry_run"]:
+            return
+        created, updated = import_sources(sources, probes, options["skip_unreachable"])
+        write("Imported {} new sources, updated {}".format(created, updated))
+
+    def report(self, probes, seconds, verbose=False):
+        write = self.stdout.write
+        results = list(probes.values())
+        reachable = [result for result in results if result.reachable]
+        feeds = [result for result in reachable if result.feed_type]
+        write("Probed {} sources in {:.1f}s: {} reachable, {} feeds, {} not feeds, {} unreachable".format(
+            len(results), seconds, len(reachable), len(feeds), len(reachable) - len(feeds),
+            len(results) - len(reachable)))
+        if feeds:
+            types = Counter(result.feed_type for result in feeds)
+            write("  types: {}".format(", ".join("{} {}".format(t, n) for t, n in types.most_common())))
+            write("  size: median {:.0f} KB, max {:.0f} KB; entries: median {:.0f}".format(
+                statistics.median(result.size for result in feeds) / 1024,
+                max(result.size for result in feeds) / 1024,
+                statistics.median(result.entries for result in feeds)))
+        if verbose:
+            for url, result in sorted(probes.items()):
+                if result.error:
+                    write("  {}: {}".format(url, result.error))
+        else:
+            errors = Counter(result.error.split(":")[0] for result in results if result.error)
+            for error, count in errors.most_common(5):
+                write("  {:>6} x {}".format(count, error))
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rssfeeder.metrics import cycle_totals, latest_runs, top_sources
+
+
+class Command(BaseCommand):
+    help = "Summarizes recent ingest cycles and the slowest sources."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=float, default=24, help="Summarize the cycles of the last HOURS.")
+        parser.add_argument("--top", type=int, default=10, help="Number of sources listed per ranking.")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options["hours"])
+        totals = cycle_totals(since)
+        write = self.stdout.write
+
+        write("Cycles in the last {:g}h: {cycles}, avg {avg_seconds:.2f}s, max {max_seconds:.2f}s".format(
+            options["hours"], **totals))
+        write("  sources polled {sources}, unchanged {unchanged}, errors {errors}".format(**totals))
+        write("  entries {entries}, new {new_entries}, duplicates {duplicates}, downloaded {bytes} bytes".format(
+            **totals))
+        write("  time: fetch {fetch_seconds:.1f}s, parse {parse_seconds:.1f}s, "
+              "extract {extract_seconds:.1f}s, write {write_seconds:.1f}s".format(**totals))
+
+        runs = list(latest_runs(since))
+        if runs:
+            write("\nLast cycle per worker:")
+            for run in runs:
+                write("  {:<30} {:%Y-%m-%d %H:%M:%S} {:>4} sources {:>7.2f}s {:>5} new".format(
+                    run.worker or "-", timezone.localtime(run.started_on), run.sources, run.seconds,
+                    run.new_entries))
+
+        for field, title in (("fetch_seconds", "Slowest downloads"), ("parse_seconds", "Slowest parses"),
+                             ("extract_seconds", "Slowest HTML extraction"), ("bytes", "Largest responses"),
+                             ("error_count", "Most failed polls in a row")):
+            rows = [(section, value) for section, value in top_sources(field, options["top"]) if value]
+            if rows:
+                write("\n{} (last poll):".format(title))
+                for section, value in rows:
+                    write("  {:<40} {:>10.3f}".format(section, value) if isinstance(value, float)
+                          else "  {:<40} {:>10}".format(section, value))
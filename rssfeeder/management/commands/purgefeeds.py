@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rssfeeder.retention import purge_old_feeds
+
+
+class Command(BaseCommand):
+    help = "Deletes the feeds past their retention period, as the nightly startjobs job does."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int,
+            help="Retention of the categories without their own setting (default: FEED_RETENTION_DAYS).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.FEED_PURGE_BATCH_SIZE,
+            help="Feeds deleted per transaction.",
+        )
+        parser.add_argument(
+            "--archive", metavar="DIR", default=settings.FEED_PURGE_ARCHIVE_DIR,
+            help="Write the deleted feeds to a JSON lines file in DIR first.",
+        )
+
+    def handle(self, *args, **options):
+        deleted = purge_old_feeds(options["days"], options["batch_size"], options["archive"])
+        self.stdout.write("Deleted {} feeds".format(deleted))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from rssfeeder.models import Thumbnail
+from rssfeeder.thumbnails import queue_existing_images
+
+
+class Command(BaseCommand):
+    help = ("Queues the images of all stored feeds and channels for thumbnailing. startjobs does it on its "
+            "first start only; run it again if that start was interrupted.")
+
+    def handle(self, *args, **options):
+        before = Thumbnail.objects.count()
+        queue_existing_images()
+        self.stdout.write("Queued {} images".format(Thumbnail.objects.count() - before))
@@ -0,0 +1,247 @@
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+
+from rssfeeder.cache import bump_ingest_version
+from rssfeeder.categories import DEFAULT_CATEGORY, invalidate
+from rssfeeder.channels import refresh_channel_stats
+from rssfeeder.models import Category, Channel, Feed, UserFavorites
+from rssfeeder.search import get_backend
+
+CATEGORIES = [DEFAULT_CATEGORY, 'World', 'Business', 'Technology', 'Science', 'Sports', 'Culture', 'Health',
+              'Politics', 'Travel', 'Education', 'Environment']
+# the vocabulary of the seeded titles and descriptions, most frequent first
+WORDS = (
+    "the of and to in a is that for on with as was by at from it are be this has have new said "
+    "government year people market city company report state police week minister court team "
+    "election president million percent public health school water energy climate price bank "
+    "season game player coach club league match final record research study scientists data "
+    "space mission launch planet ocean forest wildlife storm flood fire earthquake drought "
+    "economy inflation trade tax budget debt jobs workers strike union industry factory oil gas "
+    "software security privacy network cloud chip phone startup investors shares profit sales "
+    "hospital doctors patients vaccine disease treatment drug trial cancer virus outbreak "
+    "film music festival museum artist book author award theatre series show concert gallery "
+    "border refugees talks summit treaty sanctions army ceasefire protest vote parliament law "
+    "bill reform party campaign candidate poll senator mayor council housing rent transport "
+    "railway airport flight road traffic bridge tunnel port shipping farmers crops food prices "
+    "university students teachers exams children families community village region coast island"
+).split()
+USER_PREFIX = 'seed-'
+USER_GROUP = 'Seeded readers'
+TITLE_POOL = 20000
+DESCRIPTION_POOL = 5000
+BATCH_SIZE = 10000
+
+
+@contextmanager
+def deferred_indexes(connection, tables):
+    """Drops the indexes and triggers of `tables` for the block and creates them again after it.
+
+    Building an index once over the loaded rows is much faster than
+    updating it on every insert. SQLite only; elsewhere the block runs
+    with the indexes in place. Unique constraints are kept. Run it in a
+    transaction: if the block fails, the drops are rolled back too.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') "
+            "AND sql IS NOT NULL AND tbl_name IN ({})".format(', '.join(['%s'] * len(tables))), tables)
+        deferred = cursor.fetchall()
+        for kind, name, _ in deferred:
+            cursor.execute('DROP {} {}'.format(kind.upper(), connection.ops.quote_name(name)))
+    yield
+    with connection.cursor() as cursor:
+        for _, _, sql in deferred:
+            cursor.execute(sql)
+
+
+def insert_rows(model, columns, rows):
+    """Inserts the tuples of `rows` into the `columns` of `model` with one prepared statement."""
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def zipf_cum_weights(n):
+    return list(accumulate(1 / (rank + 1) for rank in range(n)))
+
+
+class Command(BaseCommand):
+    help = ("Fills the database with generated feeds, channels, categories, users and favorites, "
+            "for load tests (see benchmarks/web_bench.py). Indexes are built once after the inserts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--feeds", type=int, default=1000000, help="Number of feeds to add.")
+        parser.add_argument("--channels", type=int, default=500, help="Number of channels.")
+        parser.add_argument(
+            "--categories", type=int, default=8,
+            help="Number of categories, the Default one included (at most {}).".format(len(CATEGORIES)),
+        )
+        parser.add_argument("--users", type=int, default=10000, help="Number of reader accounts.")
+        parser.add_argument("--favorites", type=int, default=20, help="Average number of favorites per user.")
+        parser.add_argument("--days", type=int, default=365, help="Publication dates span this many days.")
+        parser.add_argument(
+            "--duplicates", type=float, default=0.05,
+            help="Share of feeds repeating the story of an earlier one, see rssfeeder.clustering.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+        parser.add_argument(
+            "--clear", action="store_true",
+            help="Delete all feeds, channels, categories, favorites and seeded users first.",
+        )
+        parser.add_argument(
+            "--noinput", "--no-input", action="store_false", dest="interactive",
+            help="Do not ask for confirmation of --clear.",
+        )
+
+    def handle(self, *args, **options):
+        if not 1 <= options["categories"] <= len(CATEGORIES):
+            raise CommandError("--categories must be between 1 and {}".format(len(CATEGORIES)))
+        if min(options["feeds"], options["users"], options["favorites"]) < 0:
+            raise CommandError("--feeds, --users and --favorites cannot be negative")
+        if options["channels"] < 1 or options["days"] < 1:
+            raise CommandError("--channels and --days must be positive")
+        if options["clear"] and options["interactive"]:
+            answer = input("This deletes every feed, channel, category and favorite in the database. "
+                           "Type 'yes' to continue: ")
+            if answer != "yes":
+                raise CommandError("Seeding cancelled.")
+
+        self.random = random.Random(options["seed"])
+        started = time.perf_counter()
+        # building the indexes anew pays off when most of the rows are new
+        defer = options["clear"] or options["feeds"] >= Feed.objects.count()
+        tables = [Feed._meta.db_table, UserFavorites._meta.db_table]
+        # without their indexes, every deleted feed would scan the tables referencing it;
+        # the generated rows only reference rows inserted with them
+        with connection.constraint_checks_disabled(), transaction.atomic(), \
+                deferred_indexes(connection, tables) if defer else nullcontext():
+            if options["clear"]:
+                self.clear()
+            categories = self.seed_categories(options["categories"])
+            channels = self.seed_channels(options["channels"], categories)
+            first_id = self.seed_feeds(options["feeds"], channels, options["days"], options["duplicates"])
+            users = self.seed_users(options["users"])
+            favorites = self.seed_favorites(users, first_id, options["feeds"], options["favorites"], options["days"])
+            inserted = time.perf_counter()
+        indexed = time.perf_counter()
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Feed, UserFavorites]):
+                cursor.execute(sql)
+        if defer:
+            get_backend().rebuild(connection.alias)
+        searchable = time.perf_counter()
+        refresh_channel_stats()
+        invalidate()
+        bump_ingest_version()
+
+        self.stdout.write(
+            "Seeded {} feeds in {} channels and {} categories, {} users and {} favorites in {:.1f}s "
+            "(inserts {:.1f}s, indexes {:.1f}s, search index {:.1f}s)".format(
+                options["feeds"], len(channels), len(categories), len(users), favorites, time.perf_counter() - started,
+                inserted - started, indexed - inserted, searchable - indexed))
+
+    def clear(self):
+        # plain DELETEs: no per-row signals or cascades, the favorites go first (PROTECT)
+        with connection.cursor() as cursor:
+            for model in (UserFavorites, Feed, Channel, Category):
+                cursor.execute('DELETE FROM {}'.format(connection.ops.quote_name(model._meta.db_table)))
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+
+    def seed_categories(self, count):
+        names = CATEGORIES[:count]
+        Category.objects.bulk_create([Category(name=name) for name in names], ignore_conflicts=True)
+        return list(Category.objects.filter(name__in=names).order_by('pk'))
+
+    def seed_channels(self, count, categories):
+        names = ["Seed {} {}".format(self.random.choice(WORDS[40:]).title(), n) for n in range(count)]
+        Channel.objects.bulk_create([
+            Channel(name=name, link='https://{}.example.com/'.format(slugify(name)),
+                    logo='https://{}.example.com/logo.png'.format(slugify(name)),
+                    category=categories[n % len(categories)])
+            for n, name in enumerate(names)
+        ], ignore_conflicts=True)
+        return list(Channel.objects.filter(name__in=names).order_by('pk'))
+
+    def sentence(self, weights, low, high):
+        words = self.random.choices(WORDS, cum_weights=weights, k=self.random.randint(low, high))
+        return ' '.join(words).capitalize()
+
+    def seed_feeds(self, count, channels, days, duplicates):
+        """Inserts `count` feeds, oldest first, and returns the id of the first one.
+
+        A few channels publish most of the feeds, as in real catalogs.
+        """
+        rng = self.random
+        weights = zipf_cum_weights(len(WORDS))
+        titles = [self.sentence(weights, 5, 12) for _ in range(TITLE_POOL)]
+        descriptions = ['. '.join(self.sentence(weights, 8, 18) for _ in range(rng.randint(2, 5))) + '.'
+                        for _ in range(DESCRIPTION_POOL)]
+        channel_weights = zipf_cum_weights(len(channels))
+        first_id = (Feed.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        # naive UTC, which the database adapter takes as is, without a time zone conversion per row
+        start = timezone.now().replace(tzinfo=None) - timedelta(days=days)
+        step = timedelta(days=days) / max(count, 1)
+        adapt = connection.ops.adapt_datetimefield_value
+        sources = [(channel.pk, channel.name, channel.link, channel.logo, channel.category_id) for channel in channels]
+
+        def rows():
+            for offset in range(0, count, BATCH_SIZE):
+                size = min(BATCH_SIZE, count - offset)
+                chosen = rng.choices(sources, cum_weights=channel_weights, k=size)
+                for n, (channel_id, name, link, logo, category_id) in enumerate(chosen, offset):
+                    pk = first_id + n
+                    canonical = pk - rng.randint(1, min(n, 50)) if n and rng.random() < duplicates else None
+                    yield (pk, titles[rng.randrange(TITLE_POOL)], descriptions[rng.randrange(DESCRIPTION_POOL)],
+                           adapt(start + step * n), '{}story/{}'.format(link, pk), logo,
+                           '{}images/{}.jpg'.format(link, pk) if pk % 3 else '', name,
+                           'seed-{}'.format(pk), category_id, channel_id, canonical)
+
+        insert_rows(Feed, ['id', 'title', 'description', 'pub_date', 'link', 'channel_img', 'feed_img',
+                           'channel_name', 'guid', 'category_id', 'channel_id', 'canonical_id'], rows())
+        return first_id
+
+    def seed_users(self, count):
+        """Creates the reader accounts ``seed-0``... (without a usable password) and returns their ids."""
+        group, _ = Group.objects.get_or_create(name=USER_GROUP)
+        group.permissions.add(Permission.objects.get(content_type__app_label='rssfeeder', codename='view_feed'))
+        names = ['{}{}'.format(USER_PREFIX, n) for n in range(count)]
+        User.objects.bulk_create([User(username=name, password='!') for name in names],
+                                 batch_size=BATCH_SIZE, ignore_conflicts=True)
+        wanted = set(names)
+        users = [pk for pk, name in User.objects.filter(username__startswith=USER_PREFIX).order_by('pk')
+                 .values_list('pk', 'username') if name in wanted]
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=pk, group_id=group.pk) for pk in users],
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+        return users
+
+    def seed_favorites(self, users, first_id, feeds, average, days):
+        """Gives every user up to twice `average` favorites among the new feeds; returns how many."""
+        rng = self.random
+        now = timezone.now().replace(tzinfo=None)
+        adapt = connection.ops.adapt_datetimefield_value
+        rows = []
+        for user in users:
+            picked = rng.sample(range(first_id, first_id + feeds), min(feeds, rng.randint(0, 2 * average)))
+            rows.extend((user, pk, adapt(now - timedelta(seconds=rng.randrange(days * 86400))))
+                        for pk in picked)
+        insert_rows(UserFavorites, ['user_id', 'favorites_id', 'created_on'], rows)
+        return len(rows)
@@ -1,147 +1,165 @@
 # Standard Library
 import logging
-import configparser
+import time
 import multiprocessing as mp
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from feeder.settings import BASE_DIR
-from utils.htmlfeed import strip_tags, get_links
 
 # Django
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 
 # Third Party
-import feedparser
-from dateutil import parser
-from datetime import datetime, timedelta
+from datetime import timedelta
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.jobstores.base import JobLookupError
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler.models import DjangoJobExecution
 
 # Models
-from rssfeeder.models import Feed, Category
+from rssfeeder.models import IngestRun, Thumbnail
+from rssfeeder.channels import refresh_channel_stats, link_orphan_feeds
+from rssfeeder.ingest import ingest
+from rssfeeder.leases import worker_name, claim, release, heartbeat
+from rssfeeder.retention import purge_old_feeds
+from rssfeeder.sources import current_sources
+from rssfeeder.thumbnails import make_thumbnails, evict, queue_existing_images
 
 # added for macOS compatibility. Because macOS default method: spawn
 mp.set_start_method('fork')
 
 logger = logging.getLogger(__name__)
-config = configparser.ConfigParser()
-config.read(BASE_DIR.joinpath('feed.ini'))
 
 
-def save_new_feeds(item, title, image, category):
-    """Saves new feed to the database.
+def save_rss(sections=None, worker='', sources=None):
+    """Saves RSS Feeds
 
-    Checks the feed GUID against the feeds currently stored in the
-    database. If not found, then a new `feed` is added to the database.
-
-    Args:
-        item: requires a feedparser object
-        category: requires a category
-        title: title of the feed
-        image: channel image
+    Runs one streaming ingest cycle (see `rssfeeder.ingest`) over every
+    source (feed.ini sections and imported sources, see
+    `rssfeeder.sources`), or only over `sections`.
     """
-    html_types = {'text/html', 'application/xhtml+xml'}
-    img_tags = {'thumbnail', 'media_thumbnail', 'media_content'}
-    feed_img = "/static/imgs/news.png"
-    # Check if feed exists in the database
-    if not Feed.objects.filter(guid=item.guid).exists():
-        logger.info("Processing: {}".format(item.title))
-        try:
-            for k, v in item.items():
-                if k in img_tags and v is not None:
-                    if isinstance(v, list):
-                        feed_img = v[0]['url']
-                    else:
-                        feed_img = v['url']
-                else:
-                    if item.summary_detail.type in html_types:
-                        imgs = get_links(item.description)
-                        if imgs:
-                            feed_img = imgs[0]
-                        item.description = strip_tags(item.description)
-
-            episode = Feed(
-                title=item.title,
-                description=item.description,
-                # as of version 5.1.1, feedparser returns a datetime object
-                # if this key doesn’t exist but entries[i].published does,
-                # the value of entries[i].published will be returned.
-                # changed to use updated_parsed instead of published_parsed
-                pub_date=parser.parse(item.updated),
-                link=item.link,
-                channel_img=image,
-                feed_img=feed_img,
-                channel_name=title,
-                guid=item.guid,
-                category=category,
-            )
-            logger.info("Saving: {}".format(item.title))
-            return episode
-        except AttributeError as exc:
-            logger.error("Error saving the feed {}: {}".format(item.guid, exc))
-            pass
+    sources = current_sources() if sources is None else sources
+    sections = list(sources) if sections is None else sections
+    written = ingest([sources[section] for section in sections if section in sources], worker)
+    logger.info("Saved {} new feeds".format(written))
 
 
-def fetch_feeds(section):
-    """ Fetches new episodes from config ini file"""
-    try:
-        _feed = feedparser.parse(config[section]['feed'])
-        feed_title = config[section]['title']
-        feed_logo = config[section]['logo']
-        feed_cat = Category.objects.get(name=config[section]['category'])
-    except KeyError as exc:
-        logger.warning("Error fetching {}: {}".format(section, exc))
-        pass
-    except Category.DoesNotExist:
-        feed_cat = Category.objects.get_or_create(name=config[section]['category'])[0]
-
-    return _feed, feed_title, feed_logo, feed_cat
+def poll_due_feeds(worker=None):
+    """Fetches the sections whose next poll time has passed.
 
+    Sections never polled before are due immediately. Due sections are
+    leased in batches (see `rssfeeder.leases`), so any number of startjobs
+    processes can poll the same sources at once without fetching a
+    section twice. The sources are read again on every call, so added or
+    disabled ones are picked up at the next round.
+    """
+    worker = worker or worker_name()
+    sources = current_sources()
+    sections = list(sources)
+    while sections:
+        due = claim(worker, sections)
+        if not due:
+            break
+        logger.info("Polling {} of {} feeds".format(len(due), len(sections)))
+        try:
+            with heartbeat(worker):
+                save_rss(due, worker, sources)
+        finally:
+            release(worker, due)
+        # a section whose state could not be saved stays due: leave it for the next round
+        polled = set(due)
+        sections = [section for section in sections if section not in polled]
+
+
+def run_worker(once=False):
+    """Polls due sections until interrupted, without the maintenance jobs of the scheduler."""
+    worker = worker_name()
+    logger.info("Starting ingest worker {}...".format(worker))
+    try:
+        while True:
+            poll_due_feeds(worker)
+            if once:
+                break
+            time.sleep(settings.FEED_POLL_DISPATCH_INTERVAL)
+    except KeyboardInterrupt:
+        logger.info("Stopping ingest worker {}...".format(worker))
+    finally:
+        release(worker)
 
-def save_rss():
-    """Saves RSS Feeds"""
-    futures = []
-    with ThreadPoolExecutor() as executor:
-        for section in config.sections():
-            logger.info("Fetching {}".format(section))
-            feed, title, image, category = fetch_feeds(section)
-            for item in feed.entries:
-                futures.append(executor.submit(save_new_feeds, item, title, image, category))
 
-    logger.info("Saving bulk feeds")
-    Feed.objects.bulk_create([future.result() for future in as_completed(futures)
-                              if future.result()], batch_size=1000, ignore_conflicts=True)
+def delete_old_feeds(max_days=None):
+    """Deletes the feeds past the retention of their category, see `rssfeeder.retention`."""
+    purge_old_feeds(max_days, archive_dir=settings.FEED_PURGE_ARCHIVE_DIR)
 
 
-def delete_old_feeds(max_days=30):
-    """Deletes all feeds older than `max_age`."""
-    Feed.objects.filter(pub_date__lte=datetime.now()-timedelta(days=max_days)).delete()
+def update_thumbnails():
+    """Thumbnails the queued feed images and trims the thumbnail directory, see `rssfeeder.thumbnails`."""
+    make_thumbnails()
+    evict()
 
 
 def delete_old_job_executions(max_age=604_800):
-    """Deletes all apscheduler job execution logs older than `max_age`."""
+    """Deletes all apscheduler job execution logs and ingest cycle metrics older than `max_age`."""
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
+    IngestRun.objects.filter(started_on__lt=timezone.now() - timedelta(seconds=max_age)).delete()
 
 
 class Command(BaseCommand):
     help = "Runs apscheduler."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--worker", action="store_true",
+            help="Only poll feeds, sharing them with the other startjobs processes.",
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="With --worker, exit once no feed is due.",
+        )
+
     def handle(self, *args, **options):
+        if options["worker"]:
+            run_worker(once=options["once"])
+            return
+
+        # feeds stored before the channel directory existed
+        link_orphan_feeds()
+        refresh_channel_stats()
+        # images stored before thumbnails existed: a full scan of the feeds, so only
+        # on the first start (see the queuethumbnails command)
+        if not Thumbnail.objects.exists():
+            queue_existing_images()
+
         scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
-        scheduler.add_jobstore(DjangoJobStore(), "default")
+        jobstore = DjangoJobStore()
+        scheduler.add_jobstore(jobstore, "default")
+
+        # replaced by the per-feed schedule of PollFeeds
+        try:
+            jobstore.remove_job("FetchFeeds")
+        except JobLookupError:
+            pass
 
         scheduler.add_job(
-            save_rss,
+            poll_due_feeds,
             trigger="interval",
-            minutes=30,
-            id="FetchFeeds",
+            seconds=settings.FEED_POLL_DISPATCH_INTERVAL,
+            id="PollFeeds",
             max_instances=1,
             replace_existing=True,
         )
         logger.info("Added job: News Feed.")
 
+        scheduler.add_job(
+            update_thumbnails,
+            trigger="interval",
+            seconds=settings.FEED_THUMBNAIL_INTERVAL,
+            id="Thumbnails",
+            max_instances=1,
+            replace_existing=True,
+        )
+        logger.info("Added job: Thumbnails.")
+
         scheduler.add_job(
             delete_old_job_executions,
             trigger=CronTrigger(
@@ -0,0 +1,92 @@
+"""Ingest metrics in the Prometheus text format.
+
+Ingest runs in the startjobs processes, so its metrics go through the
+database: every source keeps the figures of its last poll on its
+`FetchState`, and every cycle saves its totals as an `IngestRun`.
+"""
+from datetime import timedelta
+
+from django.db.models import Avg, Count, Max, Sum
+from django.utils import timezone
+
+from .models import FetchState, IngestRun
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# FetchState field, metric name, help
+SOURCE_METRICS = [
+    ('fetch_seconds', 'feeder_source_fetch_seconds', 'Duration of the last download of the source.'),
+    ('bytes', 'feeder_source_response_bytes', 'Size of the last response body of the source.'),
+    ('status', 'feeder_source_http_status', 'HTTP status of the last poll of the source, 0 if it failed.'),
+    ('parse_seconds', 'feeder_source_parse_seconds', 'Time spent parsing the last response of the source.'),
+    ('extract_seconds', 'feeder_source_extract_seconds', 'Time spent extracting HTML descriptions.'),
+    ('entries', 'feeder_source_entries', 'Entries in the last changed response of the source.'),
+    ('new_entries', 'feeder_source_new_entries', 'New entries stored by the last poll of the source.'),
+    ('duplicates', 'feeder_source_duplicate_entries', 'Entries of the last poll that were already stored.'),
+    ('error_count', 'feeder_source_consecutive_errors', 'Failed polls of the source in a row.'),
+    ('interval', 'feeder_source_poll_interval_seconds', 'Current polling interval of the source.'),
+]
+
+# IngestRun field, metric name, help
+RUN_METRICS = [
+    ('seconds', 'feeder_ingest_cycle_seconds', 'Duration of the last ingest cycle of the worker.'),
+    ('sources', 'feeder_ingest_cycle_sources', 'Sources polled by the last cycle.'),
+    ('unchanged', 'feeder_ingest_cycle_unchanged_sources', 'Sources without new content in the last cycle.'),
+    ('errors', 'feeder_ingest_cycle_errors', 'Sources that failed in the last cycle.'),
+    ('bytes', 'feeder_ingest_cycle_bytes', 'Bytes downloaded by the last cycle.'),
+    ('entries', 'feeder_ingest_cycle_entries', 'Entries parsed by the last cycle.'),
+    ('new_entries', 'feeder_ingest_cycle_new_entries', 'New entries stored by the last cycle.'),
+    ('duplicates', 'feeder_ingest_cycle_duplicate_entries', 'Already stored entries seen by the last cycle.'),
+    ('fetch_seconds', 'feeder_ingest_cycle_fetch_seconds', 'Download time of the last cycle, summed over sources.'),
+    ('parse_seconds', 'feeder_ingest_cycle_parse_seconds', 'Parse time of the last cycle.'),
+    ('extract_seconds', 'feeder_ingest_cycle_extract_seconds', 'HTML extraction time of the last cycle.'),
+    ('write_seconds', 'feeder_ingest_cycle_write_seconds', 'Database write time of the last cycle.'),
+]
+
+# only workers that ran a cycle this recently are reported
+ACTIVE_WORKER_WINDOW = timedelta(hours=1)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _family(lines, name, help_text, samples, label):
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} gauge'.format(name))
+    for key, value in samples:
+        lines.append('{}{{{}="{}"}} {}'.format(name, label, _escape(key), value))
+
+
+def latest_runs(since=None):
+    """Returns the last `IngestRun` of every worker that ran a cycle after `since`."""
+    since = since or timezone.now() - ACTIVE_WORKER_WINDOW
+    last = IngestRun.objects.filter(started_on__gte=since).values('worker').annotate(last=Max('pk')).values('last')
+    return IngestRun.objects.filter(pk__in=last).order_by('worker')
+
+
+def render():
+    """Returns every ingest metric in the Prometheus text exposition format."""
+    lines = []
+    states = list(FetchState.objects.order_by('section').values('section', *(f for f, _, _ in SOURCE_METRICS)))
+    for field, name, help_text in SOURCE_METRICS:
+        _family(lines, name, help_text, ((s['section'], s[field]) for s in states), 'source')
+    runs = list(latest_runs())
+    for field, name, help_text in RUN_METRICS:
+        _family(lines, name, help_text, ((run.worker, getattr(run, field)) for run in runs), 'worker')
+    return '\n'.join(lines) + '\n'
+
+
+def cycle_totals(since):
+    """Aggregates the cycles that started after `since`."""
+    fields = [field for field, _, _ in RUN_METRICS if field != 'seconds']
+    totals = IngestRun.objects.filter(started_on__gte=since).aggregate(
+        cycles=Count('pk'), avg_seconds=Avg('seconds'), max_seconds=Max('seconds'),
+        **{field: Sum(field) for field in fields})
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def top_sources(field, limit=10):
+    """Returns the `limit` sections with the highest `field` on their last poll."""
+    return FetchState.objects.filter(fetched_on__isnull=False).order_by('-' + field).values_list(
+        'section', field)[:limit]
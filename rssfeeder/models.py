@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.core.validators import URLValidator
 from django.contrib.auth.models import User
 
@@ -10,6 +11,19 @@ class Category(models.Model):
         return self.name
 
 
+class Channel(models.Model):
+    """A feed source as shown to readers, with aggregates kept up to date by ingest."""
+    name = models.CharField(max_length=100, unique=True)
+    link = models.TextField(blank=True)
+    logo = models.URLField(blank=True)
+    category = models.ForeignKey('Category', related_name='channels', on_delete=models.CASCADE)
+    item_count = models.PositiveIntegerField(default=0)
+    latest_pub_date = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Feed(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
@@ -18,8 +32,36 @@ class Feed(models.Model):
     channel_img = models.URLField()
     feed_img = models.URLField()
     channel_name = models.CharField(max_length=100)
-    guid = models.CharField(max_length=200)
+    guid = models.CharField(max_length=200, unique=True)
     category = models.ForeignKey('Category', related_name='feeds', on_delete=models.CASCADE)
+    channel = models.ForeignKey('Channel', related_name='feeds', on_delete=models.CASCADE, null=True, blank=True)
+    # near-duplicate clustering, see rssfeeder.clustering: the SimHash of the
+    # title and text, its 16-bit bands (the LSH index, see Meta) and the first feed of
+    # the story, for feeds that repeat an earlier one
+    simhash = models.BigIntegerField(null=True, blank=True)
+    band0 = models.PositiveIntegerField(null=True, blank=True)
+    band1 = models.PositiveIntegerField(null=True, blank=True)
+    band2 = models.PositiveIntegerField(null=True, blank=True)
+    band3 = models.PositiveIntegerField(null=True, blank=True)
+    canonical = models.ForeignKey('self', related_name='alternates', on_delete=models.SET_NULL,
+                                  null=True, blank=True)
+    # `IngestStamp.version` of the ingest commit that stored the feed, in commit
+    # order unlike ids, see rssfeeder.live
+    ingest_version = models.PositiveBigIntegerField(null=True, blank=True)
+
+    class Meta:
+        # keyset pagination walks these newest first on (pub_date, id)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='feed_pub_date_idx'),
+            models.Index(fields=['category', '-pub_date', '-id'], name='feed_category_pub_date_idx'),
+            models.Index(fields=['channel', '-pub_date', '-id'], name='feed_channel_pub_date_idx'),
+            # near-duplicate lookups: one band, within the clustering window
+            models.Index(fields=['band0', 'pub_date'], name='feed_band0_pub_date_idx'),
+            models.Index(fields=['band1', 'pub_date'], name='feed_band1_pub_date_idx'),
+            models.Index(fields=['band2', 'pub_date'], name='feed_band2_pub_date_idx'),
+            models.Index(fields=['band3', 'pub_date'], name='feed_band3_pub_date_idx'),
+            models.Index(fields=['ingest_version'], name='feed_ingest_version_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.channel_name}: {self.title}"
@@ -29,3 +71,125 @@ class UserFavorites(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_on = models.DateTimeField(auto_now_add=True)
     favorites = models.ForeignKey(Feed, on_delete=models.PROTECT, related_name='favorites', blank=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'favorites'], name='unique_user_favorite'),
+        ]
+
+
+class FeedSource(models.Model):
+    """A feed to poll, imported with `manage.py importsources`, see rssfeeder.sources.
+
+    The result of the last probe of the URL is kept for the operators.
+    """
+    # shares the name space of the feed.ini sections
+    name = models.CharField(max_length=100, unique=True)
+    feed = models.URLField(max_length=500, unique=True)
+    # becomes the channel name
+    title = models.CharField(max_length=100)
+    link = models.TextField(blank=True)
+    logo = models.TextField(blank=True)
+    category = models.CharField(max_length=255, default='Default')
+    # disabled sources are not polled, even if feed.ini has a section of that name
+    enabled = models.BooleanField(default=True)
+    probed_on = models.DateTimeField(null=True, blank=True)
+    reachable = models.BooleanField(null=True)
+    status = models.PositiveSmallIntegerField(default=0)
+    # feedparser's name of the format, e.g. rss20 or atom10; empty if not a feed
+    feed_type = models.CharField(max_length=20, blank=True)
+    size = models.PositiveIntegerField(default=0)
+    entries = models.PositiveIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class FetchState(models.Model):
+    """HTTP caching state of a feed.ini section, used for conditional GETs."""
+    section = models.CharField(max_length=100, unique=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    status = models.PositiveSmallIntegerField(default=0)
+    content_hash = models.CharField(max_length=64, blank=True)
+    fetched_on = models.DateTimeField(null=True, blank=True)
+    changed_on = models.DateTimeField(null=True, blank=True)
+    # adaptive polling, see utils.schedule
+    next_poll = models.DateTimeField(null=True, blank=True, db_index=True)
+    interval = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveSmallIntegerField(default=0)
+    # ingest worker currently polling the section, see rssfeeder.leases
+    leased_by = models.CharField(max_length=100, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True, db_index=True)
+    # metrics of the last poll, see rssfeeder.metrics
+    fetch_seconds = models.FloatField(default=0)
+    bytes = models.PositiveIntegerField(default=0)
+    parse_seconds = models.FloatField(default=0)
+    extract_seconds = models.FloatField(default=0)
+    entries = models.PositiveIntegerField(default=0)
+    new_entries = models.PositiveIntegerField(default=0)
+    duplicates = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.section
+
+
+class IngestRun(models.Model):
+    """Totals of one ingest cycle, see rssfeeder.metrics."""
+    worker = models.CharField(max_length=100, blank=True)
+    started_on = models.DateTimeField(db_index=True)
+    seconds = models.FloatField(default=0)
+    sources = models.PositiveIntegerField(default=0)
+    unchanged = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    bytes = models.PositiveBigIntegerField(default=0)
+    entries = models.PositiveIntegerField(default=0)
+    new_entries = models.PositiveIntegerField(default=0)
+    duplicates = models.PositiveIntegerField(default=0)
+    # summed over sources; fetches overlap, so these can exceed `seconds`
+    fetch_seconds = models.FloatField(default=0)
+    parse_seconds = models.FloatField(default=0)
+    extract_seconds = models.FloatField(default=0)
+    write_seconds = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.started_on:%Y-%m-%d %H:%M:%S}: {self.new_entries} new feeds"
+
+
+class Thumbnail(models.Model):
+    """Downsized local copy of a remote feed image, see rssfeeder.thumbnails."""
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    EVICTED = 'evicted'
+    STATUSES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed'), (EVICTED, 'Evicted')]
+
+    # SHA-256 of the image URL
+    key = models.CharField(max_length=64, unique=True)
+    url = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    # content-addressed file name in FEED_THUMBNAIL_DIR, shared by identical images
+    file = models.CharField(max_length=80, blank=True)
+    size = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    fetched_on = models.DateTimeField(null=True, blank=True)
+    # last time the thumbnail was requested, for LRU eviction
+    used_on = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.url
+
+
+class IngestStamp(models.Model):
+    """Single row whose version is bumped whenever ingest or purge commits.
+
+    Cached listings and fragments are keyed by this version.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ingest version {self.version}"
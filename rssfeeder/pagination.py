@@ -0,0 +1,125 @@
+"""Keyset (cursor) pagination for feed listings.
+
+Pages are addressed by the ``(pub_date, id)`` of the last item shown
+instead of an offset, so every page costs one indexed range scan and no
+``COUNT(*)``, however deep the reader goes.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+PER_PAGE = 10
+
+
+def encode_cursor(feed):
+    raw = "{}|{}".format(feed.pub_date.isoformat(), feed.pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns the ``(pub_date, id)`` of a cursor, or None if it is invalid."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        pub_date, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(pub_date), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class CursorPage:
+    """A page of a keyset-paginated queryset.
+
+    Iterating the page yields its items. ``next_cursor`` and
+    ``previous_cursor`` address the neighbouring pages.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next_page else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous_page else None
+
+    def next_query(self):
+        """Returns the query parameters of the next page."""
+        return {'after': self.next_cursor}
+
+    def previous_query(self):
+        return {'before': self.previous_cursor}
+
+
+class OffsetPage(CursorPage):
+    """A page of a queryset kept in its own order, e.g. search results by rank, addressed by offset."""
+
+    def __init__(self, object_list, offset, per_page, has_next):
+        super().__init__(object_list, has_next, offset > 0)
+        self.offset = offset
+        self.per_page = per_page
+
+    def next_query(self):
+        return {'offset': self.offset + self.per_page}
+
+    def previous_query(self):
+        return {'offset': max(self.offset - self.per_page, 0)}
+
+
+def cursor_page(posts, after=None, before=None, per_page=PER_PAGE):
+    """Returns the `CursorPage` of `posts` after or before a cursor.
+
+    `posts` must not be ordered yet; it is ordered newest first on
+    ``(pub_date, id)``, which the composite indexes on `Feed` cover.
+    """
+    after, before = decode_cursor(after), decode_cursor(before)
+    if before is not None:
+        pub_date, pk = before
+        # scan upwards from the cursor and flip the rows back afterwards
+        rows = list(posts.filter(pub_date__gte=pub_date).exclude(pub_date=pub_date, pk__lte=pk)
+                    .order_by('pub_date', 'id')[:per_page + 1])
+        if len(rows) > per_page:
+            return CursorPage(rows[:per_page][::-1], has_next=True, has_previous=True)
+        # fewer rows than a page are left above the cursor: show the first page
+        after = None
+
+    posts = posts.order_by('-pub_date', '-id')
+    if after is not None:
+        pub_date, pk = after
+        # pub_date <= cursor is an index range; the exclude only trims ties
+        posts = posts.filter(pub_date__lte=pub_date).exclude(pub_date=pub_date, pk__gte=pk)
+    rows = list(posts[:per_page + 1])
+    return CursorPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=after is not None)
+
+
+def offset_page(posts, offset=0, per_page=PER_PAGE):
+    """Returns the `OffsetPage` of the ordered queryset `posts` starting at `offset`."""
+    rows = list(posts[offset:offset + per_page + 1])
+    return OffsetPage(rows[:per_page], offset, per_page, has_next=len(rows) > per_page)
+
+
+def cursor_paginate(posts, request, per_page=PER_PAGE):
+    """Cursor-based counterpart of `rssfeeder.views.paginate`."""
+    page_obj = cursor_page(posts, request.GET.get('after'), request.GET.get('before'), per_page)
+    return {'page_obj': page_obj}
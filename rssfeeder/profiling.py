@@ -0,0 +1,158 @@
+"""Opt-in request profiling for the web views.
+
+`ProfilingMiddleware` is installed when FEED_PROFILE_SAMPLE_RATE is set
+(see settings.py). For the sampled share of requests it records the
+number and total time of SQL queries, the template render time and the
+slowest queries, and flags N+1 patterns: the same SQL shape run
+FEED_PROFILE_REPEAT_THRESHOLD times or more in one request. Results go
+to a ``Server-Timing`` response header, to the ``rssfeeder.profiling``
+logger for slow queries and N+1 patterns, and to a rolling in-memory
+report per process (see `report`). Requests that are not sampled only
+cost a call to ``random.random()``.
+"""
+import logging
+import random
+import re
+import statistics
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# last profiled requests of this process
+recent = deque(maxlen=settings.FEED_PROFILE_REPORT_SIZE)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def sql_shape(sql):
+    """Returns `sql` with its values and IN lists collapsed, to group repeated queries."""
+    return _LITERAL.sub('?', _IN_LIST.sub('IN (...)', sql))
+
+
+class RequestProfile:
+    """SQL and template timings of one request."""
+
+    def __init__(self):
+        self.queries = []
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.sql_seconds += elapsed
+            self.queries.append((elapsed, sql))
+
+    def repeated(self, threshold):
+        """Returns the SQL shapes run at least `threshold` times, with their counts."""
+        counts = Counter(sql_shape(sql) for _, sql in self.queries)
+        return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+    def slowest(self, limit=5):
+        return sorted(self.queries, key=lambda query: query[0], reverse=True)[:limit]
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rate = settings.FEED_PROFILE_SAMPLE_RATE
+
+    def __call__(self, request):
+        if random.random() >= self.rate:
+            return self.get_response(request)
+        profile = request._profile = RequestProfile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+        self.record(request, response, profile, total)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            started = time.perf_counter()
+            sql_before = profile.sql_seconds
+
+            def rendered(response):
+                # lazy querysets evaluated by the template count as SQL, not template time
+                profile.template_seconds += (time.perf_counter() - started) - (profile.sql_seconds - sql_before)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, profile, total):
+        match = request.resolver_match
+        view = match.view_name if match else request.path
+        repeated = profile.repeated(settings.FEED_PROFILE_REPEAT_THRESHOLD)
+        slow_limit = settings.FEED_PROFILE_SLOW_QUERY_MS / 1000
+        for elapsed, sql in profile.queries:
+            if elapsed >= slow_limit:
+                logger.warning("Slow query in {} ({:.1f}ms): {}".format(request.path, elapsed * 1e3, sql))
+        for shape, count in repeated:
+            logger.warning("Possible N+1 in {}: {} x {}".format(request.path, count, shape))
+
+        response['Server-Timing'] = ', '.join([
+            'sql;dur={:.1f};desc="{} queries"'.format(profile.sql_seconds * 1e3, len(profile.queries)),
+            'tpl;dur={:.1f}'.format(profile.template_seconds * 1e3),
+            'total;dur={:.1f}'.format(total * 1e3),
+        ])
+        recent.append({
+            'view': view,
+            'path': request.path,
+            'status': response.status_code,
+            'total': total,
+            'sql': profile.sql_seconds,
+            'template': profile.template_seconds,
+            'queries': len(profile.queries),
+            'repeated': repeated,
+            'slowest': profile.slowest(),
+        })
+
+
+def _ms(seconds):
+    return '{:8.1f}'.format(seconds * 1e3)
+
+
+def report(slowest=10):
+    """Renders the rolling report of this process as plain text."""
+    profiles = list(recent)
+    by_view = defaultdict(list)
+    for profile in profiles:
+        by_view[profile['view']].append(profile)
+
+    lines = ['{} profiled requests in this process'.format(len(profiles)), '',
+             '{:<32} {:>6} {:>8} {:>8} {:>8} {:>8} {:>7} {:>5}'.format(
+                 'view', 'count', 'p50 ms', 'p95 ms', 'sql ms', 'tpl ms', 'queries', 'n+1')]
+    for view, items in sorted(by_view.items(), key=lambda item: -sum(p['total'] for p in item[1])):
+        totals = sorted(p['total'] for p in items)
+        lines.append('{:<32} {:>6} {} {} {} {} {:>7.1f} {:>5}'.format(
+            view[:32], len(items),
+            _ms(statistics.median(totals)), _ms(totals[int(0.95 * (len(totals) - 1))]),
+            _ms(statistics.mean(p['sql'] for p in items)),
+            _ms(statistics.mean(p['template'] for p in items)),
+            statistics.mean(p['queries'] for p in items),
+            sum(1 for p in items if p['repeated'])))
+
+    lines += ['', 'Slowest requests:']
+    for profile in sorted(profiles, key=lambda p: p['total'], reverse=True)[:slowest]:
+        lines.append('{} {} {} ({} queries, sql {}ms)'.format(
+            _ms(profile['total']), profile['status'], profile['path'], profile['queries'],
+            _ms(profile['sql']).strip()))
+        for shape, count in profile['repeated']:
+            lines.append('         N+1: {} x {}'.format(count, shape))
+        for elapsed, sql in profile['slowest'][:3]:
+            lines.append('         {} {}'.format(_ms(elapsed), sql[:200]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+"""Incremental purge of feeds past their retention period.
+
+Old feeds are deleted oldest first in batches of at most
+``FEED_PURGE_BATCH_SIZE`` ids, each in its own short transaction, so the
+ingest writer is never locked out for longer than one batch. Batches are
+selected through the (category, pub_date) index and favorited feeds are
+skipped by the same query, without being loaded.
+
+Retention is ``FEED_RETENTION_DAYS``, overridden per category name by
+``FEED_RETENTION_DAYS_BY_CATEGORY`` (``None`` keeps a category forever).
+The thumbnails of the images no feed uses any more are deleted after
+the purge, see `rssfeeder.thumbnails.delete_unused`.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .cache import bump_ingest_version
+from .channels import refresh_channel_stats
+from .models import Category, Channel, Feed, UserFavorites
+from .thumbnails import delete_unused
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ['id', 'title', 'description', 'pub_date', 'link', 'channel_img', 'feed_img',
+                  'channel_name', 'guid', 'category__name']
+
+
+def retention_days(category, default=None):
+    """Returns the retention in days of the category called `category`, or None to keep its feeds."""
+    default = settings.FEED_RETENTION_DAYS if default is None else default
+    return settings.FEED_RETENTION_DAYS_BY_CATEGORY.get(category, default)
+
+
+def expired_feeds(category, cutoff):
+    """Feeds of `category` published before `cutoff` that nobody has favorited, oldest first."""
+    return (
+        Feed.objects.filter(category=category, pub_date__lte=cutoff)
+        .filter(~Exists(UserFavorites.objects.filter(favorites=OuterRef('pk'))))
+        .order_by('pub_date', 'pk')
+    )
+
+
+def archive_batch(archive, ids):
+    """Appends the feeds `ids` to the `archive` file as JSON lines."""
+    rows = Feed.objects.filter(pk__in=ids).values(*ARCHIVE_FIELDS)
+    for row in rows:
+        archive.write(json.dumps(row, cls=DjangoJSONEncoder))
+        archive.write('\n')
+    archive.flush()
+
+
+def delete_unfavorited(ids):
+    """Deletes the feeds `ids` that nobody has favorited and returns how many were deleted.
+
+    A single DELETE that checks for favorites itself: no rows are loaded
+    for the PROTECT check of ``delete()``, and a feed favorited since it
+    was selected is kept.
+    """
+    if not ids:
+        return 0
+    qn = connection.ops.quote_name
+    favorites = UserFavorites._meta
+    sql = ('DELETE FROM {feed} WHERE {pk} IN ({ids}) '
+           'AND NOT EXISTS (SELECT 1 FROM {fav} WHERE {fav}.{col} = {feed}.{pk})')
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(
+            feed=qn(Feed._meta.db_table), pk=qn(Feed._meta.pk.column), ids=', '.join(['%s'] * len(ids)),
+            fav=qn(favorites.db_table), col=qn(favorites.get_field('favorites').column),
+        ), ids)
+        return cursor.rowcount
+
+
+def purge_category(category, cutoff, batch_size, archive=None, channels=None, images=None):
+    """Deletes the expired feeds of `category` batch by batch and returns how many were deleted.
+
+    The ids of the channels that lost feeds are added to the `channels`
+    set, and the image URLs of the deleted feeds to the `images` set.
+    """
+    deleted = 0
+    while True:
+        started = time.monotonic()
+        rows = list(expired_feeds(category, cutoff).values_list('pk', 'channel_id', 'feed_img', 'channel_img')
+                    [:batch_size])
+        if not rows:
+            break
+        ids = [pk for pk, _, _, _ in rows]
+        if channels is not None:
+            channels.update(channel_id for _, channel_id, _, _ in rows if channel_id)
+        if images is not None:
+            images.update(url for row in rows for url in row[2:])
+        if archive is not None:
+            archive_batch(archive, ids)
+        # one short transaction per batch: the ingest writer waits for one batch at most
+        with transaction.atomic():
+            # the raw DELETE skips on_delete=SET_NULL: alternates of the purged
+            # feeds are listed on their own from now on
+            Feed.objects.filter(canonical_id__in=ids).update(canonical=None)
+            count = delete_unfavorited(ids)
+        deleted += count
+        logger.info("Purged {} feeds from {} in {:.2f}s".format(count, category.name, time.monotonic() - started))
+        if len(rows) < batch_size:
+            break
+    return deleted
+
+
+def purge_old_feeds(max_days=None, batch_size=None, archive_dir=None):
+    """Deletes the feeds older than the retention of their category.
+
+    Args:
+        max_days: retention of the categories without their own setting
+            (``FEED_RETENTION_DAYS`` by default)
+        batch_size: feeds deleted per transaction
+        archive_dir: directory to write the deleted feeds to, as a JSON lines file
+
+    Returns:
+        number of deleted feeds
+    """
+    batch_size = batch_size or settings.FEED_PURGE_BATCH_SIZE
+    now = timezone.now()
+    archive = None
+    if archive_dir:
+        path = Path(archive_dir).joinpath('feeds-{}.jsonl'.format(now.strftime('%Y%m%d-%H%M%S')))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        archive = path.open('a', encoding='utf-8')
+        logger.info("Archiving purged feeds to {}".format(path))
+    started = time.monotonic()
+    deleted = 0
+    channels, images = set(), set()
+    try:
+        for category in Category.objects.order_by('name'):
+            days = retention_days(category.name, max_days)
+            if days is None:
+                continue
+            deleted += purge_category(category, now - timedelta(days=days), batch_size, archive, channels, images)
+    finally:
+        if archive is not None:
+            archive.close()
+    if deleted:
+        refresh_channel_stats(Channel.objects.filter(pk__in=channels))
+        bump_ingest_version()
+        delete_unused(images)
+    logger.info("Purged {} feeds in {:.2f}s".format(deleted, time.monotonic() - started))
+    return deleted
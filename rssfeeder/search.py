@@ -0,0 +1,171 @@
+"""Full-text search backends for feed items.
+
+The backend is chosen with the ``FEED_SEARCH_BACKEND`` setting. Every
+backend takes a `Feed` queryset and a user query and returns a ranked
+queryset whose rows carry a ``snippet`` attribute (or None). Snippets use
+``\\x02`` and ``\\x03`` around matched terms; `highlight` turns those into
+safe HTML.
+"""
+import logging
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+logger = logging.getLogger(__name__)
+
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def terms(query):
+    """Splits a user query into plain word tokens."""
+    return re.findall(r'\w+', query or '')
+
+
+def highlight(snippet):
+    """Escapes a backend snippet and wraps matched terms in <mark>."""
+    if not snippet:
+        return ''
+    html = escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    return mark_safe(html)
+
+
+class BasicSearchBackend:
+    """Case-insensitive substring match. Works on any database, but scans the table."""
+
+    def setup(self, using):
+        pass
+
+    def rebuild(self, using):
+        pass
+
+    def search(self, queryset, query):
+        from django.db.models import Q
+
+        q = Q()
+        for term in terms(query):
+            q &= Q(title__icontains=term) | Q(description__icontains=term)
+        if not q:
+            return queryset.none()
+        return queryset.filter(q).extra(select={'snippet': 'NULL'}).order_by('-pub_date', '-id')
+
+
+class SQLiteFTSBackend:
+    """SQLite FTS5 index over feed titles and descriptions.
+
+    The index is an external-content FTS5 table kept in sync with
+    ``rssfeeder_feed`` by triggers, so every insert made by ingest (including
+    ``bulk_create``) and every purge is reflected without extra code.
+    Terms are prefix matched and results are ordered by bm25 rank.
+    """
+    table = 'rssfeeder_feed_fts'
+
+    def setup(self, using):
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+            exists = cursor.fetchone() is not None
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {t} USING fts5("
+                "title, description, content='rssfeeder_feed', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')".format(t=self.table)
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {t}_ai AFTER INSERT ON rssfeeder_feed BEGIN "
+                "INSERT INTO {t}(rowid, title, description) VALUES (new.id, new.title, new.description); "
+                "END".format(t=self.table)
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {t}_ad AFTER DELETE ON rssfeeder_feed BEGIN "
+                "INSERT INTO {t}({t}, rowid, title, description) "
+                "VALUES ('delete', old.id, old.title, old.description); "
+                "END".format(t=self.table)
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {t}_au AFTER UPDATE OF title, description ON rssfeeder_feed BEGIN "
+                "INSERT INTO {t}({t}, rowid, title, description) "
+                "VALUES ('delete', old.id, old.title, old.description); "
+                "INSERT INTO {t}(rowid, title, description) VALUES (new.id, new.title, new.description); "
+                "END".format(t=self.table)
+            )
+        if not exists:
+            self.rebuild(using)
+
+    def rebuild(self, using):
+        """Indexes the feed table anew, after writes made with the triggers dropped (see ``seedfeeds``)."""
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            return
+        logger.info("Building search index")
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {t}({t}) VALUES ('rebuild')".format(t=self.table))
+
+    def search(self, queryset, query):
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        match = ' '.join('"{}"*'.format(word) for word in words)
+        return queryset.extra(
+            tables=[self.table],
+            where=['{t}.rowid = rssfeeder_feed.id'.format(t=self.table), '{t} MATCH %s'.format(t=self.table)],
+            params=[match],
+            select={
+                'rank': '{t}.rank'.format(t=self.table),
+                'snippet': "snippet({t}, -1, char(2), char(3), '…', 32)".format(t=self.table),
+            },
+        ).order_by('rank')
+
+
+class PostgresSearchBackend:
+    """PostgreSQL ``tsvector`` search with weighted title and description."""
+    config = 'english'
+
+    def setup(self, using):
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS rssfeeder_feed_tsv ON rssfeeder_feed USING GIN ("
+                "(setweight(to_tsvector(%s::regconfig, coalesce(title, '')), 'A') || "
+                "setweight(to_tsvector(%s::regconfig, coalesce(description, '')), 'B')))",
+                [self.config, self.config],
+            )
+
+    def rebuild(self, using):
+        # an index of the table itself, kept up to date by every write
+        pass
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        vector = (SearchVector('title', weight='A', config=self.config)
+                  + SearchVector('description', weight='B', config=self.config))
+        ts_query = SearchQuery(' & '.join('{}:*'.format(word) for word in words),
+                               search_type='raw', config=self.config)
+        return queryset.annotate(
+            search=vector,
+            rank=SearchRank(vector, ts_query),
+            snippet=SearchHeadline('description', ts_query, config=self.config,
+                                   start_sel=MARK_START, stop_sel=MARK_END, max_words=35),
+        ).filter(search=ts_query).order_by('-rank', '-pub_date')
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.FEED_SEARCH_BACKEND)()
+
+
+def setup_search_index(sender, using='default', **kwargs):
+    """post_migrate receiver creating the index structures of the backend."""
+    get_backend().setup(using)
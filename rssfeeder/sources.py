@@ -0,0 +1,194 @@
+"""Feed sources: feed.ini sections and the `FeedSource` table.
+
+feed.ini suits a handful of feeds edited by hand. Large catalogs (OPML
+exports of feed readers, or INI files in the feed.ini format) are
+imported into the `FeedSource` table by ``manage.py importsources``,
+which first probes every URL concurrently (see `utils.fetcher`) and
+records whether it answered, whether it is a feed and how big it is.
+
+The scheduler reads both on every dispatch round (see
+`current_sources`), so sources added, edited or disabled in either are
+picked up without a restart.
+"""
+import configparser
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import feedparser
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+
+from utils.fetcher import fetch_each
+
+from .ingest import Source
+from .models import FeedSource
+
+DEFAULT_LOGO = '/static/imgs/news.png'
+SOURCE_FIELDS = ['title', 'link', 'logo', 'category']
+PROBE_FIELDS = ['probed_on', 'reachable', 'status', 'feed_type', 'size', 'entries', 'error']
+
+
+def read_ini(path):
+    """Returns the complete sections of an INI file in the feed.ini format as sources."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    sources = (Source.from_section(section, config[section])
+               for section in config.sections() if 'feed' in config[section])
+    return [source for source in sources if source is not None]
+
+
+def read_opml(path, category='Default'):
+    """Returns the feeds of an OPML file as sources, without names (see `source_name`).
+
+    The category of a feed is the title of the outline folder it is in,
+    or `category` outside of folders.
+    """
+    sources = []
+
+    def walk(element, folder):
+        for outline in element.findall('outline'):
+            title = (outline.get('title') or outline.get('text') or '').strip()
+            url = (outline.get('xmlUrl') or '').strip()
+            if url:
+                sources.append(Source(name='', feed=url, title=title, logo='',
+                                      link=(outline.get('htmlUrl') or '').strip(), category=folder))
+            else:
+                walk(outline, title or folder)
+
+    body = ElementTree.parse(path).getroot().find('body')
+    if body is not None:
+        walk(body, category)
+    return sources
+
+
+def read_catalog(path, category='Default'):
+    """Reads the sources of an OPML (.opml, .xml) or INI file."""
+    if str(path).lower().endswith(('.opml', '.xml')):
+        return read_opml(path, category)
+    return read_ini(path)
+
+
+@dataclass
+class Probe:
+    """What a single download of a source URL told about it."""
+    reachable: bool
+    status: int = 0
+    feed_type: str = ''
+    size: int = 0
+    entries: int = 0
+    error: str = ''
+    # title and logo announced by the feed itself
+    title: str = ''
+    logo: str = ''
+
+
+def probe_one(response):
+    """Builds the `Probe` of a `utils.fetcher.FetchResult`."""
+    if not response.ok:
+        return Probe(False, response.status, error=(response.error or 'HTTP {}'.format(response.status))[:255])
+    parsed = feedparser.parse(response.body, response_headers=response.headers)
+    result = Probe(True, response.status, feed_type=parsed.version or '', size=len(response.body),
+                   entries=len(parsed.entries), title=parsed.feed.get('title', ''),
+                   logo=parsed.feed.get('image', {}).get('href', ''))
+    if not result.feed_type:
+        result.error = 'Not a feed'
+    return result
+
+
+def probe(sources, concurrency=None, per_host=None, timeout=None, max_bytes=None):
+    """Downloads every source once, concurrently, and returns a `Probe` by feed URL.
+
+    Feeds are parsed on the fetcher's callback threads as they arrive and
+    their bodies dropped, so memory does not grow with the catalog.
+    """
+    results = {}
+    fetch_each(
+        {source.feed: source.feed for source in sources},
+        lambda response: results.__setitem__(response.key, probe_one(response)),
+        concurrency=concurrency or settings.FEED_FETCH_CONCURRENCY,
+        per_host=per_host or settings.FEED_FETCH_PER_HOST,
+        timeout=timeout or settings.FEED_SOURCE_PROBE_TIMEOUT,
+        max_bytes=max_bytes or settings.FEED_SOURCE_PROBE_MAX_BYTES,
+    )
+    return results
+
+
+def source_name(source, taken):
+    """Returns a name for a `source` read without one, unique among `taken` (which it is added to)."""
+    url = urlsplit(source.feed)
+    base = (slugify(source.title) or slugify('{} {}'.format(url.netloc, url.path)) or 'feed')[:90]
+    name, n = base, 1
+    while name in taken:
+        n += 1
+        name = '{}-{}'.format(base, n)
+    taken.add(name)
+    return name
+
+
+def import_sources(sources, probes=None, skip_unreachable=False):
+    """Creates or updates the `FeedSource` rows of `sources` and returns (created, updated).
+
+    A source is matched to its row by feed URL, so re-importing a catalog
+    updates it in place. Sources without a name are given one, never that
+    of a feed.ini section (the row would replace it, see `current_sources`);
+    sources without a title or logo get the ones their feed announced.
+
+    Args:
+        sources: list of `Source`, at most one per feed URL
+        probes: optional dict of feed URL to `Probe`
+        skip_unreachable: leave out the sources whose probe failed
+    """
+    probes = probes or {}
+    now = timezone.now()
+    existing = {row.feed: row for row in FeedSource.objects.all()}
+    sections = {source.name for source in read_ini(settings.FEED_CONFIG)}
+    taken = {row.name for row in existing.values()} | sections
+    created, updated = [], []
+    for source in sources:
+        result = probes.get(source.feed)
+        if skip_unreachable and result is not None and not result.reachable:
+            continue
+        row = existing.get(source.feed)
+        if row is None:
+            # a named source may replace a section on purpose, but only once
+            if source.name and (source.name not in taken or source.name in sections):
+                name = source.name
+                taken.add(name)
+                sections.discard(name)
+            else:
+                name = source_name(source, taken)
+            row = FeedSource(name=name, feed=source.feed)
+            created.append(row)
+        else:
+            updated.append(row)
+        row.title = (source.title or (result and result.title) or row.title or row.name)[:100]
+        row.link, row.category = source.link, source.category
+        row.logo = source.logo or (result and result.logo) or row.logo or DEFAULT_LOGO
+        if result is not None:
+            row.probed_on, row.reachable, row.status = now, result.reachable, result.status
+            row.feed_type, row.size, row.entries, row.error = (
+                result.feed_type, result.size, result.entries, result.error)
+        # bulk_update does not set auto_now fields
+        row.updated_on = now
+    FeedSource.objects.bulk_create(created, batch_size=500)
+    FeedSource.objects.bulk_update(updated, SOURCE_FIELDS + PROBE_FIELDS + ['updated_on'], batch_size=500)
+    return len(created), len(updated)
+
+
+def current_sources(path=None):
+    """Returns the sources to poll by name, read anew on every call.
+
+    These are the sections of feed.ini (or `path`) and the enabled rows of
+    `FeedSource`; a row takes the place of a section of the same name, and
+    a disabled row removes it.
+    """
+    sources = {source.name: source for source in read_ini(path or settings.FEED_CONFIG)}
+    rows = FeedSource.objects.values_list('enabled', 'name', 'feed', 'title', 'logo', 'link', 'category')
+    for enabled, *fields in rows:
+        if enabled:
+            sources[fields[0]] = Source(*fields)
+        else:
+            sources.pop(fields[0], None)
+    return sources
@@ -0,0 +1,17 @@
+from django import template
+from django.urls import reverse
+
+from rssfeeder.thumbnails import is_remote, url_key
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(url):
+    """Returns the local thumbnail URL of a remote image, see rssfeeder.thumbnails.
+
+    Local images (e.g. the static placeholder) are returned unchanged.
+    """
+    if not is_remote(url):
+        return url
+    return reverse('thumbnail', args=[url_key(url)])
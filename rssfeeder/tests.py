@@ -0,0 +1,74 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+
+from utils.fetcher import FetchResult
+
+from . import ingest
+from .models import Feed, FeedSource, FetchState
+from .sources import current_sources, import_sources
+
+FEED = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Test</title><link>https://example.com/</link>
+<item><title>One</title><link>https://example.com/1</link><guid>test-1</guid>
+<pubDate>Mon, 05 Oct 2026 10:00:00 GMT</pubDate><description>First</description></item>
+<item><title>Two</title><link>https://example.com/2</link><guid>test-2</guid>
+<pubDate>Mon, 05 Oct 2026 11:00:00 GMT</pubDate><description>Second</description></item>
+</channel></rss>"""
+ETAG = '"v1"'
+
+
+def serve(urls, callback, headers=None, **kwargs):
+    """Stands in for `utils.fetcher.fetch_each`, answering every URL with `FEED` and honouring its ETag."""
+    for key, url in urls.items():
+        if (headers or {}).get(key, {}).get('If-None-Match') == ETAG:
+            callback(FetchResult(key, url, 304, headers={'etag': ETAG}))
+        else:
+            callback(FetchResult(key, url, 200, FEED, {'etag': ETAG, 'content-type': 'application/rss+xml'}))
+
+
+# the pipeline stages use connections of their own threads
+class IngestTests(TransactionTestCase):
+    source = ingest.Source('test', 'https://example.com/feed.xml', 'Test', '')
+
+    def poll(self):
+        # due again at once
+        FetchState.objects.update(next_poll=None)
+        with mock.patch.object(ingest, 'fetch_each', serve):
+            return ingest.ingest([self.source])
+
+    def test_failed_stage_refetches_at_next_poll(self):
+        with mock.patch.object(ingest, 'existing_guids', side_effect=RuntimeError("stage failed")):
+            self.assertEqual(self.poll(), 0)
+        self.assertFalse(Feed.objects.exists())
+        state = FetchState.objects.get(section='test')
+        self.assertEqual((state.etag, state.content_hash), ('', ''))
+
+        self.assertEqual(self.poll(), 2)
+        self.assertEqual(set(Feed.objects.values_list('guid', flat=True)), {'test-1', 'test-2'})
+        # and then the feed counts as unchanged
+        self.assertEqual(self.poll(), 0)
+        self.assertEqual(FetchState.objects.get(section='test').status, 304)
+
+
+class ImportSourcesTests(TestCase):
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as config:
+            config.write('[lwn]\nfeed = https://lwn.net/headlines/rss\ntitle = LWN\nlogo = /static/imgs/news.png\n')
+        self.addCleanup(os.unlink, config.name)
+        self.config = config.name
+
+    def test_generated_name_keeps_clear_of_sections(self):
+        with self.settings(FEED_CONFIG=self.config):
+            import_sources([ingest.Source('', 'https://example.com/lwn.xml', 'LWN', '')])
+            sources = current_sources()
+        self.assertEqual(FeedSource.objects.get().name, 'lwn-2')
+        self.assertEqual(sources['lwn'].feed, 'https://lwn.net/headlines/rss')
+        self.assertEqual(sources['lwn-2'].feed, 'https://example.com/lwn.xml')
+
+    def test_named_source_replaces_its_section(self):
+        with self.settings(FEED_CONFIG=self.config):
+            import_sources([ingest.Source('lwn', 'https://example.com/lwn.xml', 'LWN', '')])
+            self.assertEqual(current_sources()['lwn'].feed, 'https://example.com/lwn.xml')
@@ -0,0 +1,232 @@
+"""Downsized local copies of feed images.
+
+Ingest queues the remote image URLs of new feeds as pending `Thumbnail`
+rows, keyed by the SHA-256 of the URL, so every URL is downloaded once
+however many feeds use it. The scheduler then runs `make_thumbnails`:
+pending images are downloaded concurrently (see `utils.fetcher`) with a
+size limit, resized to fit FEED_THUMBNAIL_SIZE and written as WebP files
+named after the SHA-256 of their content, so identical images behind
+different URLs share one file.
+
+Templates link images through the ``thumbnail`` filter, which only hashes
+the URL. `ThumbnailView` serves the file with a one year cache lifetime
+once it exists and redirects to the original image until then. Files
+that were not requested for the longest time are deleted by `evict` when
+the directory outgrows FEED_THUMBNAIL_CACHE_BYTES; a later request queues
+them again. The rows of the images of purged feeds, whatever their
+status, are deleted by `delete_unused` once no feed or channel uses them.
+"""
+import hashlib
+import io
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from utils.fetcher import fetch_each
+
+from .models import Channel, Feed, Thumbnail
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'image/webp'
+# failed downloads are retried this many times before the image is given up
+MAX_ATTEMPTS = 3
+# `used_on` is refreshed at most this often per thumbnail
+TOUCH_INTERVAL = timedelta(hours=1)
+
+
+class ImageError(Exception):
+    pass
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def is_remote(url):
+    return bool(url) and url.startswith(('http://', 'https://'))
+
+
+def file_path(name):
+    """Returns the path of a thumbnail file, fanned out over subdirectories by its first two characters."""
+    return Path(settings.FEED_THUMBNAIL_DIR) / name[:2] / name
+
+
+def queue_thumbnails(urls, batch_size=500):
+    """Queues the remote image URLs among `urls`; URLs seen before are left alone."""
+    thumbnails = {url_key(url): url for url in urls if is_remote(url)}
+    Thumbnail.objects.bulk_create([Thumbnail(key=key, url=url) for key, url in thumbnails.items()],
+                                  batch_size=batch_size, ignore_conflicts=True)
+
+
+def queue_existing_images(chunk_size=5000):
+    """Queues the images of feeds and channels stored before thumbnails existed.
+
+    Scans the whole feed table: run by startjobs when no thumbnail exists
+    yet, and by the queuethumbnails command.
+    """
+    for field in ('feed_img', 'channel_img'):
+        urls = Feed.objects.order_by().values_list(field, flat=True).distinct().iterator(chunk_size=chunk_size)
+        batch = []
+        for url in urls:
+            batch.append(url)
+            if len(batch) >= chunk_size:
+                queue_thumbnails(batch)
+                batch = []
+        queue_thumbnails(batch)
+    queue_thumbnails(Channel.objects.values_list('logo', flat=True))
+
+
+def resize(body, size=None, quality=None, max_pixels=None):
+    """Returns `body`, an image in any format Pillow reads, scaled down to fit `size` as WebP."""
+    size = size or settings.FEED_THUMBNAIL_SIZE
+    max_pixels = max_pixels or settings.FEED_THUMBNAIL_MAX_PIXELS
+    try:
+        with Image.open(io.BytesIO(body)) as image:
+            # the header is read lazily: check the dimensions before decoding anything
+            if image.width * image.height > max_pixels:
+                raise ImageError("{}x{} pixels".format(image.width, image.height))
+            # reducing_gap=1 lets the JPEG decoder scale down as far as `size`
+            # while decoding, which is most of the work for large photos
+            image.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=1.0)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+            out = io.BytesIO()
+            # method 2 encodes twice as fast as the default 4, for about the same size
+            image.save(out, 'WEBP', quality=quality or settings.FEED_THUMBNAIL_QUALITY, method=2)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as exc:
+        raise ImageError("{}: {}".format(type(exc).__name__, exc)) from exc
+    return out.getvalue()
+
+
+def store(data):
+    """Writes a thumbnail under its content hash and returns the file name."""
+    name = hashlib.sha256(data).hexdigest() + '.webp'
+    path = file_path(name)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, so a request never reads a half written file
+        tmp = path.with_suffix('.{}.tmp'.format(os.getpid()))
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    return name
+
+
+def _thumbnail(thumbnail, response):
+    """Records the outcome of a download in `thumbnail`; runs on a fetcher thread."""
+    thumbnail.attempts += 1
+    thumbnail.fetched_on = timezone.now()
+    permanent = False
+    try:
+        if response.error is not None or not response.ok:
+            # 4xx responses, oversized images and refused hosts will not get better
+            permanent = 400 <= response.status < 500 or (response.error or '').startswith(
+                ('ResponseTooLarge', 'InvalidURL', 'InvalidUrl'))
+            raise ImageError(response.error or "HTTP {}".format(response.status))
+        permanent = True
+        data = resize(response.body)
+        thumbnail.file, thumbnail.size = store(data), len(data)
+        thumbnail.status, thumbnail.error = Thumbnail.READY, ''
+    except ImageError as exc:
+        thumbnail.error = str(exc)[:255]
+        if permanent or thumbnail.attempts >= MAX_ATTEMPTS:
+            thumbnail.status = Thumbnail.FAILED
+            logger.debug("No thumbnail for {}: {}".format(thumbnail.url, exc))
+    finally:
+        response.body = b''
+
+
+def make_thumbnails(limit=None):
+    """Downloads and resizes up to `limit` pending images; returns the number of thumbnails made."""
+    limit = limit or settings.FEED_THUMBNAIL_BATCH_SIZE
+    pending = {
+        thumbnail.key: thumbnail
+        for thumbnail in Thumbnail.objects.filter(status=Thumbnail.PENDING).order_by('attempts', 'pk')[:limit]
+    }
+    if not pending:
+        return 0
+    fetch_each(
+        {key: thumbnail.url for key, thumbnail in pending.items()},
+        lambda response: _thumbnail(pending[response.key], response),
+        concurrency=settings.FEED_FETCH_CONCURRENCY,
+        per_host=settings.FEED_FETCH_PER_HOST,
+        timeout=settings.FEED_FETCH_TIMEOUT,
+        max_bytes=settings.FEED_THUMBNAIL_MAX_BYTES,
+        # the URLs come from the feeds
+        public_only=not settings.FEED_THUMBNAIL_PRIVATE_HOSTS,
+    )
+    with transaction.atomic():
+        Thumbnail.objects.bulk_update(pending.values(), ['status', 'file', 'size', 'attempts', 'error', 'fetched_on'],
+                                      batch_size=500)
+    made = sum(1 for thumbnail in pending.values() if thumbnail.status == Thumbnail.READY)
+    logger.info("Made {} of {} thumbnails".format(made, len(pending)))
+    return made
+
+
+def evict(max_bytes=None):
+    """Deletes the least recently requested files until the thumbnails fit in `max_bytes`.
+
+    Returns the number of bytes freed.
+    """
+    max_bytes = settings.FEED_THUMBNAIL_CACHE_BYTES if max_bytes is None else max_bytes
+    # a file is shared by every URL with identical content: it is as recent as its latest use
+    files = list(Thumbnail.objects.filter(status=Thumbnail.READY).values('file').annotate(
+        file_size=Max('size'), last_used=Max('used_on')).order_by('last_used', 'file'))
+    total = sum(row['file_size'] for row in files)
+    evicted = []
+    for row in files:
+        if total <= max_bytes:
+            break
+        file_path(row['file']).unlink(missing_ok=True)
+        total -= row['file_size']
+        evicted.append(row['file'])
+    for i in range(0, len(evicted), 500):
+        Thumbnail.objects.filter(file__in=evicted[i:i + 500]).update(status=Thumbnail.EVICTED, file='', size=0)
+    freed = sum(row['file_size'] for row in files) - total
+    if evicted:
+        logger.info("Evicted {} thumbnails ({} bytes)".format(len(evicted), freed))
+    return freed
+
+
+def delete_unused(urls, chunk_size=500):
+    """Deletes the thumbnails of the images among `urls` that no feed or channel uses any more.
+
+    Called with the images of purged feeds, see `rssfeeder.retention`;
+    the image columns are not indexed, so the feeds are scanned once for
+    all of them. Files no other thumbnail shares are deleted too. Returns
+    the number of thumbnails deleted.
+    """
+    unused = {url for url in urls if is_remote(url)}
+    if not unused:
+        return 0
+    for images in Feed.objects.order_by().values_list('feed_img', 'channel_img').iterator(chunk_size=5000):
+        unused.difference_update(images)
+    unused.difference_update(Channel.objects.values_list('logo', flat=True))
+    keys = [url_key(url) for url in unused]
+    deleted = 0
+    for i in range(0, len(keys), chunk_size):
+        rows = Thumbnail.objects.filter(key__in=keys[i:i + chunk_size])
+        files = set(rows.exclude(file='').values_list('file', flat=True))
+        deleted += rows.delete()[0]
+        for name in files - set(Thumbnail.objects.filter(file__in=files).values_list('file', flat=True)):
+            file_path(name).unlink(missing_ok=True)
+    if deleted:
+        logger.info("Deleted {} unused thumbnails".format(deleted))
+    return deleted
+
+
+def touch(thumbnail):
+    """Records a request for `thumbnail`; an evicted image is queued again."""
+    now = timezone.now()
+    if thumbnail.status == Thumbnail.EVICTED:
+        Thumbnail.objects.filter(pk=thumbnail.pk, status=Thumbnail.EVICTED).update(
+            status=Thumbnail.PENDING, attempts=0, used_on=now)
+    elif thumbnail.used_on < now - TOUCH_INTERVAL:
+        Thumbnail.objects.filter(pk=thumbnail.pk).update(used_on=now)
@@ -1,6 +1,7 @@
 from django.urls import path, re_path
 from .views import IndexView, SearchResults, LoginView, LogoutView, UserFavoritesView, \
-    AddFavorite, ProfileView, ChangePasswordView, ChannelView, ChannelList
+    AddFavorite, ProfileView, ChangePasswordView, ChannelView, ChannelList, MetricsView, \
+    ProfilingReportView, ThumbnailView, FeedApiView
 
 
 urlpatterns = [
@@ -17,14 +18,20 @@ urlpatterns = [
     path("", IndexView.as_view(), name="home"),
     path("channel/<str:channel>", ChannelView.as_view(), name="channel"),
     path("channels", ChannelList.as_view(), name="channels"),
-    path("news", IndexView.as_view(), name="newspage"),
-    path("tech", IndexView.as_view(), name="techpage"),
-    path("videos", IndexView.as_view(), name="videospage"),
-    path("science", IndexView.as_view(), name="sciencepage"),
-    path("political", IndexView.as_view(), name="politicalpage"),
     path("search/", SearchResults.as_view(), name="search"),
     path("favorites", UserFavoritesView.as_view(), name="favorites"),
     path("favops", AddFavorite.as_view(), name="favops"),
     path("profile/<username>", ProfileView.as_view(), name="profile"),
     path('password-change/', ChangePasswordView.as_view(), name='password_change'),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path("metrics/requests", ProfilingReportView.as_view(), name="profiling"),
+    re_path(r'^api/feeds\.(?P<fmt>json|rss|atom)$', FeedApiView.as_view(), name="api_home"),
+    re_path(r'^api/category/(?P<category>[-\w]+)\.(?P<fmt>json|rss|atom)$', FeedApiView.as_view(),
+            name="api_category"),
+    re_path(r'^api/channel/(?P<channel>[^/]+)\.(?P<fmt>json|rss|atom)$', FeedApiView.as_view(kind='channel'),
+            name="api_channel"),
+    re_path(r'^api/search\.(?P<fmt>json|rss|atom)$', FeedApiView.as_view(kind='search'), name="api_search"),
+    re_path(r'^thumbnails/(?P<key>[0-9a-f]{64})$', ThumbnailView.as_view(), name="thumbnail"),
+    # keep last: any other single path segment is a category slug, Unicode ones included
+    re_path(r'^(?P<category>[-\w]+)$', IndexView.as_view(), name="category"),
 ]
@@ -1,30 +1,31 @@
+import hmac
+from collections import defaultdict
+
+from django.conf import settings
 from django.shortcuts import redirect
-from django.http import Http404
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
-from django.contrib.auth.models import User
 from django.views.generic import TemplateView, View, ListView
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.contrib.auth.views import PasswordChangeView
-from django.urls import reverse_lazy
-from django.db import IntegrityError
-from django.db.models import Q
-from .models import Feed, UserFavorites, Category
+from django.urls import reverse, reverse_lazy
+from django.utils.http import urlencode
+from django.db import IntegrityError, transaction
+from django.utils.decorators import method_decorator
+from .models import Feed, UserFavorites, Channel, Thumbnail
 from .forms import UserUpdateForm
+from .search import get_backend, highlight
+from .pagination import CursorPage, cursor_page, offset_page
+from .categories import category_id, get_categories
+from .cache import cached_listing, read_ingest_version
+from . import api, metrics, profiling, thumbnails
 
-
-def catdata():
-    cat_data = {}
-    for cat in Category.objects.all():
-        if cat.name == 'Default':
-            cat_data['/'] = Feed.objects.filter(category__id=cat.id).select_related('category').order_by("-pub_date")
-        else:
-            cat_data[f"/{cat.name}"] = \
-                Feed.objects.filter(category__id=cat.id).select_related('category').order_by("-pub_date")
-
-    return cat_data
+# views that only read run in autocommit mode: outside a transaction they
+# never wait for the write lock, see rssfeeder/backends/sqlite3/base.py
+non_atomic = method_decorator(transaction.non_atomic_requests, name='dispatch')
 
 
 def paginate(posts, request):
@@ -43,69 +44,165 @@ def paginate(posts, request):
     return context
 
 
+def paginate_feeds(posts, request, cache_key=None):
+    """Paginates a feed listing newest first, by cursor unless FEED_CURSOR_PAGINATION is off.
+
+    Cursor pages of listings with a `cache_key` are served from the feeds
+    cache until the next ingest. Pages carry the ingest version read
+    before their feeds, which they all include, for their live updates.
+    """
+    after, before = request.GET.get('after'), request.GET.get('before')
+
+    def build():
+        version = read_ingest_version()
+        if not settings.FEED_CURSOR_PAGINATION:
+            page_obj = paginate(posts.order_by('-pub_date', '-id'), request)['page_obj']
+        else:
+            page_obj = cursor_page(posts, after, before)
+        page_obj.version = version
+        return attach_alternates(page_obj)
+
+    if settings.FEED_CURSOR_PAGINATION and cache_key is not None:
+        return {'page_obj': cached_listing(cache_key + (after, before), build)}
+    return {'page_obj': build()}
+
+
+def favorite_ids(user, page_obj):
+    """Returns the ids of the feeds on `page_obj` that `user` has favorited, in one query."""
+    ids = [feed.pk for feed in page_obj] if page_obj is not None else []
+    if not ids or not user.is_authenticated:
+        return set()
+    return set(UserFavorites.objects.filter(user=user, favorites_id__in=ids).values_list('favorites_id', flat=True))
+
+
+def attach_alternates(page_obj):
+    """Sets `also_in` on the feeds of `page_obj`: the channels that repeated their story, in one query.
+
+    Returns `page_obj`, see `rssfeeder.clustering`.
+    """
+    feeds = list(page_obj) if page_obj is not None else []
+    if feeds:
+        alternates = defaultdict(dict)
+        rows = Feed.objects.filter(canonical_id__in=[feed.pk for feed in feeds]).order_by('pub_date')
+        for canonical_id, channel_name in rows.values_list('canonical_id', 'channel_name'):
+            alternates[canonical_id][channel_name] = None
+        for feed in feeds:
+            feed.also_in = [name for name in alternates[feed.pk] if name != feed.channel_name]
+    return page_obj
+
+
+def category_feeds(slug):
+    """Returns the feeds of the category with URL `slug` and their listing cache key.
+
+    The home page ('') of a site without the Default category has no
+    listing: (None, None). Unknown slugs raise Http404.
+    """
+    cat_id = category_id(slug)
+    if cat_id is not None:
+        posts = Feed.objects.filter(category_id=cat_id, canonical__isnull=True).select_related('category')
+        return posts, ('category', cat_id)
+    if slug:
+        raise Http404("Category does not exist")
+    return None, None
+
+
+def channel_feeds(name):
+    """Returns the feeds of the channel `name` and their listing cache key, or raises Http404."""
+    channel = Channel.objects.filter(name=name).first()
+    if channel is None:
+        raise Http404("Channel does not exist")
+    return Feed.objects.filter(channel=channel).select_related('category'), ('channel', channel.pk)
+
+
+def search_feeds(query):
+    """Returns the feeds matching `query`, see `rssfeeder.search`.
+
+    Like category listings, only the first feed of a story is returned.
+    """
+    if query:
+        return get_backend().search(Feed.objects.filter(canonical__isnull=True).select_related('category'), query)
+    return Feed.objects.none()
+
+
+def live_url(page_obj, **listing):
+    """Returns the URL of the live updates of a listing (see `rssfeeder.live`), or None when they are off.
+
+    The URL carries the ingest version of the feeds on `page_obj`, see `paginate_feeds`.
+    """
+    if not settings.FEED_LIVE_UPDATES:
+        return None
+    return '{}?{}'.format(settings.FEED_LIVE_PATH, urlencode(dict(listing, version=page_obj.version)))
+
+
+def bearer_token_matches(request, token):
+    """Tells whether `request` carries ``Authorization: Bearer <token>``; never true without a token."""
+    authorization = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(authorization.encode(), 'Bearer {}'.format(token).encode())
+
+
+@non_atomic
 class IndexView(PermissionRequiredMixin, TemplateView):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     permission_required = 'rssfeeder.view_feed'
     template_name = 'index.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        posts = catdata().get(self.request.path)
-        if posts:
-            context.update(paginate(posts, self.request))
+        posts, cache_key = category_feeds(self.kwargs.get('category', ''))
+        if posts is not None:
+            context.update(paginate_feeds(posts, self.request, cache_key=cache_key))
+            context['live_url'] = live_url(context['page_obj'], category=self.kwargs.get('category', ''))
         else:
             context.update({'page_obj': None})
+        context['favorite_ids'] = favorite_ids(self.request.user, context['page_obj'])
         return context
 
 
+@non_atomic
 class ChannelView(PermissionRequiredMixin, TemplateView):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     permission_required = 'rssfeeder.view_feed'
     template_name = 'index.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        posts = Feed.objects.filter(channel_name=self.kwargs['channel']).order_by("-pub_date")
-        if posts:
-            context.update(paginate(posts, self.request))
-        else:
-            raise Http404("Channel does not exist")
+        posts, cache_key = channel_feeds(self.kwargs['channel'])
+        context.update(paginate_feeds(posts, self.request, cache_key=cache_key))
+        context['live_url'] = live_url(context['page_obj'], channel=self.kwargs['channel'])
+        context['favorite_ids'] = favorite_ids(self.request.user, context['page_obj'])
         return context
 
 
+@non_atomic
 class ChannelList(PermissionRequiredMixin, TemplateView):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     permission_required = 'rssfeeder.view_feed'
     template_name = 'channels.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        posts = Feed.objects.values('channel_name').distinct().order_by('channel_name')
-        if posts:
-            context.update(paginate(posts, self.request))
-        else:
-            raise Http404("Channel does not exist")
+        posts = Channel.objects.select_related('category').order_by('name')
+        context.update(paginate(posts, self.request))
         return context
 
 
+@non_atomic
 class SearchResults(PermissionRequiredMixin, TemplateView):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     permission_required = 'rssfeeder.view_feed'
     template_name = 'search.html'
     model = Feed
 
     def get_queryset(self):
-        query = self.request.GET.get("q")
-        if query:
-            object_list = self.model.objects.filter(
-                Q(title__icontains=query) | Q(description__icontains=query)
-            ).distinct()
-            return object_list
-        return []
+        return search_feeds(self.request.GET.get("q"))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context.update(paginate(self.get_queryset().order_by('pub_date'), self.request))
+        context.update(paginate(self.get_queryset(), self.request))
+        attach_alternates(context['page_obj'])
+        for feed in context['page_obj']:
+            feed.snippet_html = highlight(feed.snippet)
+        context['favorite_ids'] = favorite_ids(self.request.user, context['page_obj'])
         return context
 
 
@@ -146,15 +243,16 @@ class LogoutView(View):
         return redirect('home')
 
 
+@non_atomic
 class UserFavoritesView(PermissionRequiredMixin, ListView):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     permission_required = 'rssfeeder.view_feed'
     template_name = 'favorites.html'
     model = UserFavorites
 
     def get_queryset(self):
-        user = self.request.user.id
-        object_list = self.model.objects.filter(user=user).order_by("-created_on")
+        object_list = self.model.objects.filter(user=self.request.user).select_related(
+            'favorites__category').order_by("-created_on")
         return object_list
 
     def get_context_data(self, **kwargs):
@@ -164,25 +262,30 @@ class UserFavoritesView(PermissionRequiredMixin, ListView):
 
 
 class AddFavorite(PermissionRequiredMixin, View):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     permission_required = 'rssfeeder.view_feed'
 
     def post(self, request, *args, **kwargs):
-        user = User.objects.get(id=self.request.user.id)
-        feed = Feed.objects.get(pk=self.request.POST.get('pk'))
+        pk = request.POST.get('pk', '')
+        if not pk.isdigit():
+            raise Http404("Feed does not exist")
 
         if 'addfavorite' in request.POST:
-            UserFavorites.objects.get_or_create(user=user, favorites=feed)
+            if not Feed.objects.filter(pk=pk).exists():
+                raise Http404("Feed does not exist")
+            # a single INSERT; the (user, favorites) constraint drops duplicates
+            UserFavorites.objects.bulk_create([UserFavorites(user=request.user, favorites_id=pk)],
+                                              ignore_conflicts=True)
             messages.success(request, "Feed added to favorites!")
         elif 'removefavorite' in request.POST:
-            UserFavorites.objects.filter(user=user).get(favorites=feed).delete()
+            UserFavorites.objects.filter(user=request.user, favorites_id=pk).delete()
             messages.success(request, "Feed removed from favorites!")
 
         return redirect(request.META.get('HTTP_REFERER'))
 
 
 class ProfileView(LoginRequiredMixin, TemplateView):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     template_name = 'profile.html'
 
     def get_context_data(self, **kwargs):
@@ -204,7 +307,116 @@ class ProfileView(LoginRequiredMixin, TemplateView):
 
 
 class ChangePasswordView(LoginRequiredMixin, SuccessMessageMixin, PasswordChangeView):
-    login_url = '/login'
+    login_url = reverse_lazy('login')
     template_name = 'change_password.html'
     success_message = "Successfully Changed Your Password"
     success_url = reverse_lazy('home')
+
+
+@non_atomic
+class MetricsView(View):
+    """Ingest metrics for Prometheus.
+
+    Open to staff users, and to scrapers sending ``Authorization: Bearer``
+    with the value of FEED_METRICS_TOKEN.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not (request.user.is_staff or bearer_token_matches(request, settings.FEED_METRICS_TOKEN)):
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@non_atomic
+class ProfilingReportView(View):
+    """Rolling request profiling report of the serving process, for staff users."""
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        return HttpResponse(profiling.report(), content_type='text/plain; charset=utf-8')
+
+
+@non_atomic
+class FeedApiView(View):
+    """JSON, RSS and Atom listings of a category, a channel or a search, see rssfeeder.api.
+
+    Open to users who may view feeds, and to services sending
+    ``Authorization: Bearer`` with the value of FEED_API_TOKEN.
+    """
+    # 'category', 'channel' or 'search'
+    kind = 'category'
+
+    def get(self, request, fmt, *args, **kwargs):
+        if not (request.user.has_perm('rssfeeder.view_feed') or
+                bearer_token_matches(request, settings.FEED_API_TOKEN)):
+            return HttpResponseForbidden()
+        name = request.GET.get('q', '') if self.kind == 'search' else kwargs.get(self.kind, '')
+        # unknown listings are a 404, never a 304
+        posts, title, link = self.listing(name)
+        after, before = request.GET.get('after'), request.GET.get('before')
+        offset = api.page_offset(request) if self.kind == 'search' else 0
+        limit = api.page_size(request)
+        parts = (request.get_host(), self.kind, name, fmt, after, before, offset, limit)
+        return api.respond(request, fmt, parts,
+                           lambda: self.build(fmt, posts, title, link, after, before, offset, limit))
+
+    def listing(self, name):
+        """Returns the unevaluated feeds, title and link of the listing `name`, or raises Http404."""
+        if self.kind == 'channel':
+            posts, _ = channel_feeds(name)
+            return posts, name, reverse('channel', args=[name])
+        if self.kind == 'search':
+            link = '{}?{}'.format(reverse('search'), urlencode({'q': name}))
+            return search_feeds(name), 'Search: {}'.format(name), link
+        posts, _ = category_feeds(name)
+        title = get_categories()[name][1] if posts is not None else 'Feeds'
+        return posts, title, reverse('category', args=[name]) if name else reverse('home')
+
+    def build(self, fmt, posts, title, link, after, before, offset, limit):
+        if posts is None:
+            page = CursorPage([], False, False)
+        elif self.kind == 'search':
+            # by rank, as on the search page
+            page = offset_page(posts, offset, limit)
+        else:
+            page = cursor_page(posts, after, before, limit)
+        attach_alternates(page)
+
+        def page_url(query_update):
+            query = self.request.GET.copy()
+            for key in ('after', 'before', 'offset'):
+                query.pop(key, None)
+            query.update(query_update)
+            path = self.request.path + ('?' + query.urlencode() if query else '')
+            return self.request.build_absolute_uri(path)
+
+        return api.render(page, fmt, title, self.request.build_absolute_uri(link), page_url)
+
+
+@non_atomic
+class ThumbnailView(View):
+    """Serves the thumbnail of a feed image, or redirects to the original until it is made.
+
+    Thumbnail files never change, so browsers may keep them for a year.
+    """
+
+    def get(self, request, key, *args, **kwargs):
+        thumbnail = Thumbnail.objects.filter(key=key).first()
+        if thumbnail is None:
+            raise Http404("Unknown image")
+        thumbnails.touch(thumbnail)
+        if thumbnail.status == Thumbnail.READY:
+            try:
+                response = FileResponse(open(thumbnails.file_path(thumbnail.file), 'rb'),
+                                        content_type=thumbnails.CONTENT_TYPE)
+            except FileNotFoundError:
+                # evicted since the row was read
+                pass
+            else:
+                response['Cache-Control'] = 'public, max-age=31536000, immutable'
+                return response
+        response = HttpResponseRedirect(thumbnail.url)
+        # ask again soon: the thumbnail may be ready by then
+        response['Cache-Control'] = 'public, max-age=600'
+        return response
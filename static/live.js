@@ -0,0 +1,63 @@
+// Live updates of a listing, see rssfeeder/live.py: a banner counts the new
+// items and shows their cards on click (or reloads the first page).
+(function () {
+    var banner = document.getElementById('live-updates');
+    if (!banner || !window.EventSource) {
+        return;
+    }
+    var firstPage = banner.getAttribute('data-first-page') === '1';
+    var count = 0;
+    var cards = [];
+    var stale = false;
+
+    function show(text) {
+        banner.textContent = text;
+        banner.classList.remove('d-none');
+    }
+
+    var source = new EventSource(banner.getAttribute('data-url'));
+    source.addEventListener('items', function (event) {
+        var data = JSON.parse(event.data);
+        var fresh = [];
+        count += data.count;
+        for (var i = 0; i < data.cards.length; i++) {
+            // a page built during an ingest may already show some of them
+            if (document.querySelector('[data-feed="' + data.ids[i] + '"]')) {
+                count--;
+            } else {
+                fresh.push(data.cards[i]);
+            }
+        }
+        if (count <= 0) {
+            count = 0;
+            return;
+        }
+        // newest first, like the listing
+        cards = fresh.concat(cards);
+        show(count + (count === 1 ? ' new item' : ' new items') + ' in ' + data.label + ' - show');
+    });
+    source.addEventListener('stale', function (event) {
+        stale = true;
+        show('New items in ' + JSON.parse(event.data).label + ' - reload');
+    });
+
+    banner.addEventListener('click', function () {
+        // the forms of the new cards are sent without a CSRF token
+        var token = document.querySelector('input[name="csrfmiddlewaretoken"]');
+        if (stale || !firstPage || !token || cards.length < count) {
+            window.location.href = window.location.pathname;
+            return;
+        }
+        banner.insertAdjacentHTML('afterend', cards.join(''));
+        var node = banner.nextElementSibling;
+        for (var i = 0; i < cards.length && node; i++, node = node.nextElementSibling) {
+            var form = node.querySelector('form');
+            if (form && !form.querySelector('input[name="csrfmiddlewaretoken"]')) {
+                form.appendChild(token.cloneNode());
+            }
+        }
+        count = 0;
+        cards = [];
+        banner.classList.add('d-none');
+    });
+})();
@@ -0,0 +1,200 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from yarl import URL
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "feeder (+https://github.com/mofm/feeder)"
+# aiohttp's default limit, for the redirects followed by hand
+MAX_REDIRECTS = 10
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+
+@dataclass
+class FetchResult:
+    """Outcome of a single feed download."""
+    key: str
+    url: str
+    status: int = 0
+    body: bytes = b""
+    headers: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None and 200 <= self.status < 300
+
+    @property
+    def not_modified(self):
+        return self.error is None and self.status == 304
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+def is_public_address(host):
+    """Tells whether `host` is an IP address reachable on the internet, not e.g. loopback or private."""
+    try:
+        address = ipaddress.ip_address(host.split('%', 1)[0])
+    except ValueError:
+        return False
+    return address.is_global and not address.is_multicast
+
+
+class PublicResolver(aiohttp.abc.AbstractResolver):
+    """Resolves host names to their public addresses only, so that a URL cannot reach the local network."""
+
+    def __init__(self):
+        self.resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        hosts = [info for info in await self.resolver.resolve(host, port, family) if is_public_address(info['host'])]
+        if not hosts:
+            raise OSError(0, "{} has no public address".format(host))
+        return hosts
+
+    async def close(self):
+        await self.resolver.close()
+
+
+def check_public_url(url):
+    """Raises InvalidURL unless `url` (a yarl.URL) is http(s) on a host name or a public address.
+
+    Host names are checked once resolved, by `PublicResolver`.
+    """
+    if url.scheme not in ('http', 'https'):
+        raise aiohttp.InvalidURL(url)
+    host = url.host or ''
+    try:
+        ipaddress.ip_address(host.split('%', 1)[0])
+    except ValueError:
+        return
+    if not is_public_address(host):
+        raise aiohttp.InvalidURL("{} is not a public address".format(host))
+
+
+async def _get(session, url, headers, timeout, public_only):
+    """Returns the response to a GET of `url`, to be released by the caller.
+
+    With `public_only`, redirects are followed here to check every URL with `check_public_url`.
+    """
+    if not public_only:
+        return await session.get(url, headers=headers, timeout=timeout)
+    url = URL(url)
+    for _ in range(MAX_REDIRECTS):
+        check_public_url(url)
+        response = await session.get(url, headers=headers, timeout=timeout, allow_redirects=False)
+        location = response.headers.get('Location')
+        if response.status not in REDIRECT_STATUSES or not location:
+            return response
+        response.release()
+        url = response.url.join(URL(location))
+    raise aiohttp.TooManyRedirects(response.request_info, response.history)
+
+
+async def _read(response, max_bytes):
+    if max_bytes is None:
+        return await response.read()
+    if response.content_length is not None and response.content_length > max_bytes:
+        raise ResponseTooLarge("{} bytes".format(response.content_length))
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        body += chunk
+        if len(body) > max_bytes:
+            raise ResponseTooLarge("over {} bytes".format(max_bytes))
+    return bytes(body)
+
+
+async def _fetch_one(session, key, url, headers, timeout, max_bytes=None, public_only=False):
+    result = FetchResult(key=key, url=url)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        async with await _get(session, url, headers, timeout, public_only) as response:
+            result.status = response.status
+            # lower-cased so they can be handed straight to feedparser
+            result.headers = {k.lower(): v for k, v in response.headers.items()}
+            result.headers.setdefault('content-location', str(response.url))
+            result.body = await _read(response, max_bytes)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ResponseTooLarge) as exc:
+        result.error = "{}: {}".format(type(exc).__name__, exc)
+    result.elapsed = loop.time() - started
+    return result
+
+
+async def _fetch_each(urls, callback, headers, concurrency, per_host, timeout, max_bytes, public_only):
+    loop = asyncio.get_running_loop()
+    # the connector enforces both the global and the per-host connection caps
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host,
+                                     resolver=PublicResolver() if public_only else None)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    # the timeout of a request also runs while it waits for a pooled
+    # connection: queue requests here, so it only starts once one is free
+    slots = asyncio.Semaphore(concurrency)
+    host_slots = defaultdict(lambda: asyncio.Semaphore(per_host))
+
+    async def fetch(session, key, url):
+        async with host_slots[urlsplit(url).netloc]:
+            await slots.acquire()
+            try:
+                result = await _fetch_one(session, key, url, headers.get(key), client_timeout, max_bytes, public_only)
+            except BaseException:
+                slots.release()
+                raise
+        # the callback may block (e.g. on a full queue); keep it off the event loop, but
+        # hold the global slot until it returns, so at most `concurrency` bodies wait for it
+        try:
+            await loop.run_in_executor(None, callback, result)
+        finally:
+            slots.release()
+
+    async with aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT}) as session:
+        await asyncio.gather(*(fetch(session, key, url) for key, url in urls.items()))
+
+
+def fetch_each(urls, callback, headers=None, concurrency=50, per_host=4, timeout=30, max_bytes=None,
+               public_only=False):
+    """Downloads many feeds concurrently, handing each result to `callback` as it completes.
+
+    All requests share one connection pool, so keep-alive connections are
+    reused between feeds on the same host. `callback` runs on a worker
+    thread and may block, which holds back further downloads: a result
+    counts against `concurrency` until its callback returns.
+
+    Args:
+        urls: mapping of key (e.g. feed.ini section) to feed URL
+        callback: called with the `FetchResult` of every URL
+        headers: optional mapping of key to extra request headers
+        concurrency: maximum number of requests in flight
+        per_host: maximum number of connections to a single host
+        timeout: total seconds allowed for each request
+        max_bytes: optional size limit of a response body; larger responses
+            are abandoned and reported with an error
+        public_only: refuse hosts that are or resolve to non-public
+            addresses (loopback, private, link-local...), for URLs taken
+            from untrusted content; refused URLs are reported with an error
+    """
+    asyncio.run(_fetch_each(urls, callback, headers or {}, concurrency, per_host, timeout, max_bytes, public_only))
+
+
+def fetch_all(urls, headers=None, concurrency=50, per_host=4, timeout=30, max_bytes=None):
+    """Downloads many feeds concurrently, see `fetch_each`.
+
+    Returns:
+        dict of key to `FetchResult`
+    """
+    results = {}
+    fetch_each(urls, lambda result: results.__setitem__(result.key, result),
+               headers=headers, concurrency=concurrency, per_host=per_host, timeout=timeout,
+               max_bytes=max_bytes)
+    return results
@@ -1,40 +1,146 @@
-from io import StringIO
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from html.parser import HTMLParser
 
+ScanResult = namedtuple('ScanResult', ['text', 'images', 'summary'])
 
-class MLStripper(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.reset()
-        self.strict = False
-        self.convert_charrefs = True
-        self.text = StringIO()
+SKIP_TAGS = {'script', 'style'}
+
+
+class _BudgetReached(Exception):
+    pass
+
+
+class FeedScanner(HTMLParser):
+    """Single-pass HTML scanner for feed entries.
+
+    Collects the plain text and the image sources of a document at the
+    same time. A scanner is reset before every document, so one instance
+    can be reused for any number of documents (but not across threads).
+
+    Args:
+        max_length: stop parsing once this many characters of text were
+            collected. Images after that point are not reported.
+        max_images: stop collecting image sources after this many
+        summary_length: also return the text cut at a word boundary
+    """
+
+    def __init__(self, max_length=None, max_images=None, summary_length=None):
+        super().__init__(convert_charrefs=True)
+        self.max_length = max_length
+        self.max_images = max_images
+        self.summary_length = summary_length
+        self._reset_state()
+
+    def _reset_state(self):
+        self._chunks = []
+        self._length = 0
+        self._skip = 0
+        self.images = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'img':
+            if self.max_images is None or len(self.images) < self.max_images:
+                for name, value in attrs:
+                    if name == 'src' and value:
+                        self.images.append(value)
+                        break
+        elif tag in SKIP_TAGS:
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip:
+            self._skip -= 1
 
     def handle_data(self, d):
-        self.text.write(d)
+        if self._skip:
+            return
+        self._chunks.append(d)
+        self._length += len(d)
+        if self.max_length is not None and self._length >= self.max_length:
+            raise _BudgetReached
+
+    def scan(self, html):
+        """Scans `html` and returns a `ScanResult`."""
+        self.reset()
+        self._reset_state()
+        if '<' not in html and '&' not in html:
+            # plain text, nothing to parse
+            self._chunks.append(html)
+        else:
+            try:
+                self.feed(html)
+                self.close()
+            except _BudgetReached:
+                pass
+        text = ''.join(self._chunks)
+        if self.max_length is not None:
+            text = text[:self.max_length]
+        return ScanResult(text, self.images, self._summary(text))
 
-    def get_data(self):
-        return self.text.getvalue()
+    def _summary(self, text):
+        if self.summary_length is None:
+            return None
+        text = ' '.join(text.split())
+        if len(text) <= self.summary_length:
+            return text
+        cut = text.rfind(' ', 0, self.summary_length)
+        return text[:cut if cut > 0 else self.summary_length].rstrip() + '…'
+
+
+_local = threading.local()
+
+
+def _scanner():
+    # HTMLParser instances keep state, so every thread gets its own scanner
+    scanner = getattr(_local, 'scanner', None)
+    if scanner is None:
+        scanner = _local.scanner = FeedScanner(max_images=1)
+    return scanner
 
 
 def strip_tags(html):
-    s = MLStripper()
-    s.feed(html)
-    return s.get_data()
+    return FeedScanner().scan(html).text
 
 
 def get_links(html):
-    class URLSeeker(HTMLParser):
-        def __init__(self):
-            HTMLParser.__init__(self)
-            self.urls = []
-
-        def handle_starttag(self, tag, attrs):
-            if tag == 'img':
-                src = dict(attrs).get('src')
-                if src:
-                    self.urls.append(src)
-
-    url_seeker = URLSeeker()
-    url_seeker.feed(html)
-    return url_seeker.urls
+    return FeedScanner().scan(html).images
+
+
+def extract(html, max_length=None):
+    """Returns a ``(text, first image URL)`` tuple for `html`.
+
+    With `max_length`, parsing stops once that much text was collected.
+    """
+    scanner = _scanner()
+    scanner.max_length = max_length
+    result = scanner.scan(html)
+    return result.text, result.images[0] if result.images else None
+
+
+def extract_many(htmls, workers=None, chunksize=64, max_length=None, executor=None):
+    """Runs `extract` over many documents on a process pool.
+
+    Documents are sent to the workers in chunks of `chunksize` to keep the
+    pickling overhead low. Small inputs are extracted in-process, because
+    starting a pool would cost more than the parsing itself.
+
+    Args:
+        htmls: list of HTML strings
+        workers: number of worker processes, defaults to the CPU count
+        chunksize: number of documents sent to a worker at once
+        max_length: optional text budget per document, see `extract`
+        executor: an existing process pool to use instead of starting one
+
+    Returns:
+        list of ``(text, first image URL)`` tuples, in input order
+    """
+    func = partial(extract, max_length=max_length)
+    if len(htmls) <= chunksize:
+        return [func(html) for html in htmls]
+    if executor is not None:
+        return list(executor.map(func, htmls, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, htmls, chunksize=chunksize))
@@ -0,0 +1,113 @@
+"""Polling interval policy for feed sources.
+
+Each source is polled again after an interval derived from how often it
+publishes, bounded by what the publisher asks for (RSS ``ttl``,
+``sy:updatePeriod``/``sy:updateFrequency``, ``Cache-Control: max-age`` and
+``Retry-After``) and stretched exponentially while it keeps failing.
+"""
+import calendar
+import random
+import re
+import statistics
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+UPDATE_PERIODS = {
+    'hourly': 3600,
+    'daily': 86400,
+    'weekly': 7 * 86400,
+    'monthly': 30 * 86400,
+    'yearly': 365 * 86400,
+}
+
+# Retry-After delays beyond this are treated as garbage, not as a request
+MAX_RETRY_AFTER = 30 * 86400
+
+
+def publish_interval(entries, sample=20):
+    """Returns half the median gap in seconds between the newest entries, or None.
+
+    Polling twice per typical publish gap keeps the expected delay of a
+    new item at a quarter of the gap.
+    """
+    stamps = []
+    for entry in entries:
+        parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+        if parsed:
+            stamps.append(calendar.timegm(parsed))
+    stamps = sorted(stamps, reverse=True)[:sample]
+    gaps = [a - b for a, b in zip(stamps, stamps[1:]) if a > b]
+    if not gaps:
+        return None
+    return statistics.median(gaps) / 2
+
+
+def hinted_interval(feed=None, headers=None):
+    """Returns the minimum interval in seconds the publisher asks for, or None."""
+    hints = []
+    meta = feed.get('feed', {}) if feed is not None else {}
+    try:
+        hints.append(int(meta['ttl']) * 60)
+    except (KeyError, TypeError, ValueError):
+        pass
+    period = UPDATE_PERIODS.get(str(meta.get('sy_updateperiod', '')).strip().lower())
+    if period:
+        try:
+            frequency = max(int(meta.get('sy_updatefrequency', 1)), 1)
+        except (TypeError, ValueError):
+            frequency = 1
+        hints.append(period / frequency)
+    match = re.search(r'max-age=(\d+)', (headers or {}).get('cache-control', ''))
+    if match:
+        hints.append(int(match.group(1)))
+    return max(hints) if hints else None
+
+
+def retry_after(headers, now=None):
+    """Returns the ``Retry-After`` delay in seconds, or None if missing or absurd."""
+    value = (headers or {}).get('retry-after', '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        delay = int(value)
+    else:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        now = now or datetime.now(timezone.utc)
+        delay = max((when - now).total_seconds(), 0)
+    return delay if delay <= MAX_RETRY_AFTER else None
+
+
+def next_interval(previous, changed, feed=None, headers=None, errors=0,
+                  minimum=300, maximum=86400, default=1800, jitter=0.1):
+    """Computes the seconds to wait before polling a source again.
+
+    Args:
+        previous: interval used for the last poll, in seconds
+        changed: whether the last poll returned new content
+        feed: parsed feedparser result of the last poll, if any
+        headers: lower-cased response headers of the last poll
+        errors: number of consecutive failed polls
+        minimum, maximum, default: interval bounds and starting value
+        jitter: random spread, as a fraction of the interval
+
+    Returns:
+        interval in seconds
+    """
+    if errors:
+        interval = default * 2 ** min(errors, 16)
+    elif changed and feed is not None:
+        interval = publish_interval(feed.entries) or previous or default
+    else:
+        # nothing new: back off gently towards the maximum
+        interval = (previous or default) * 1.5
+    interval = min(max(interval, minimum), maximum)
+    # publisher hints only slow polling down, and never beyond our maximum
+    interval = max(interval,
+                   min(hinted_interval(feed, headers) or 0, maximum),
+                   min(retry_after(headers) or 0, maximum))
+    return interval * random.uniform(1 - jitter, 1 + jitter)
@@ -0,0 +1,60 @@
+"""SimHash fingerprints for near-duplicate text detection.
+
+A fingerprint is a 64-bit integer in which every bit is the majority
+vote of that bit over the hashes of the text's word shingles (Charikar,
+2002), so texts sharing most of their shingles get fingerprints that
+differ in few bits. Fingerprints within `MAX_DISTANCE` bits of each
+other are near-duplicates.
+
+For lookups, a fingerprint is cut into `BANDS` bands of 16 bits. Two
+fingerprints at most `MAX_DISTANCE` = `BANDS` - 1 bits apart always have
+at least one identical band, so the candidates for a fingerprint can be
+found with one equality lookup per band in an ordinary index, and only
+those need a distance check.
+"""
+import hashlib
+import re
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+MAX_DISTANCE = BANDS - 1
+
+_WORD = re.compile(r'\w+')
+
+
+def words(text):
+    return _WORD.findall(text.lower())
+
+
+def shingles(tokens, size=2):
+    """Returns the runs of `size` consecutive tokens, or the tokens themselves if there are fewer."""
+    if len(tokens) <= size:
+        return [' '.join(tokens)] if tokens else []
+    return [' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+
+def _hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+
+
+def simhash(tokens, shingle_size=2):
+    """Returns the 64-bit SimHash of a list of words, or None if it is empty."""
+    features = shingles(tokens, shingle_size)
+    if not features:
+        return None
+    # one row of '0'/'1' per feature; the bit votes are then counted column by column
+    rows = [format(_hash(feature), '064b') for feature in features]
+    half = len(rows) / 2
+    return int(''.join('1' if column.count('1') > half else '0' for column in zip(*rows)), 2)
+
+
+def bands(fingerprint):
+    """Returns the `BANDS` 16-bit bands of a fingerprint, lowest first."""
+    return [(fingerprint >> (BAND_BITS * i)) & BAND_MASK for i in range(BANDS)]
+
+
+def distance(a, b):
+    """Returns the number of bits in which two fingerprints differ."""
+    return bin(a ^ b).count('1')